@@ -7,6 +7,7 @@ import sys
 import clusterking.cluster
 import clusterking.data
 import clusterking.maths
+import clusterking.preprocess
 import clusterking.scan
 import clusterking.util
 from clusterking.data import Data, DataWithErrors
@@ -68,4 +68,6 @@ class AbstractBenchmarkResult(DataResult):
             None
         """
         self._data.df[bpoint_column] = self._bpoints
+        self._data._invalidate_cache()
         self._data.md["bpoint"][bpoint_column] = self._md
+        self._data._apply_dtypes([bpoint_column])
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
 
 # std
+import copy
 
 # 3rd
-import copy
 import numpy as np
+import scipy.sparse
 from typing import Callable
 
 # ours
@@ -12,11 +13,15 @@ from clusterking.benchmark.abstract_benchmark import (
     AbstractBenchmark,
     AbstractBenchmarkResult,
 )
-from clusterking.util.metadata import failsafe_serialize
-from clusterking.maths.metric_utils import (
-    uncondense_distance_matrix,
-    metric_selection,
-)
+from clusterking.util.metadata import stable_serialize
+from clusterking.maths.metric_utils import metric_selection
+from clusterking.maths.neighbour_graph import graph_metrics
+from clusterking.maths.distance_matrix import DistanceMatrix
+
+
+def _sum_fom(x):
+    """ Default figure of merit: Sum of all distances """
+    return np.sum(x, axis=1)
 
 
 class BenchmarkResult(AbstractBenchmarkResult):
@@ -43,7 +48,7 @@ class Benchmark(AbstractBenchmark):
         """
         super().__init__()
         self.metric = None
-        self.fom = lambda x: np.sum(x, axis=1)
+        self.fom = _sum_fom
 
     # **************************************************************************
     # Settings
@@ -51,12 +56,36 @@ class Benchmark(AbstractBenchmark):
 
     # Docstring set below
     def set_metric(self, *args, **kwargs) -> None:
-        self.md["metric"]["args"] = failsafe_serialize(args)
-        self.md["metric"]["kwargs"] = failsafe_serialize(kwargs)
+        if args and isinstance(args[0], str) and args[0] in graph_metrics:
+            raise ValueError(
+                "Metric '{}' returns a sparse graph of distances, which is "
+                "not supported for benchmarking, because all distances "
+                "within a cluster are needed.".format(args[0])
+            )
+        self.md["metric"]["args"] = stable_serialize(args)
+        self.md["metric"]["kwargs"] = stable_serialize(kwargs)
         self.metric = metric_selection(*args, **kwargs)
 
     set_metric.__doc__ = metric_selection.__doc__
 
+    def set_distance_matrix(self, distance_matrix: DistanceMatrix) -> None:
+        """ Take the distances from the rows and columns of a precomputed
+        distance matrix rather than computing the metric for every cluster
+        (replaces :meth:`set_metric`).
+
+        Args:
+            distance_matrix:
+                :class:`~clusterking.maths.distance_matrix.DistanceMatrix`
+                built with
+                :meth:`~clusterking.maths.distance_matrix.DistanceMatrix.from_data`
+                for the data (or a superset of the data)
+
+        Returns:
+            None
+        """
+        self.md["metric"] = copy.deepcopy(distance_matrix.md["metric"])
+        self.metric = distance_matrix.subset
+
     def set_fom(self, fct: Callable, *args, **kwargs) -> None:
         """ Set a figure of merit. The default case for the figure of merit (
         "sum") chooses the point as benchmark point that minimizes the sum of
@@ -100,11 +129,22 @@ class Benchmark(AbstractBenchmark):
                 np.argwhere(np.array(clusters) == cluster), axis=1
             )
             # A data object with only these spoints
-            # todo: Can't we somehow implement this nicer?
-            d_cut = type(data)()
-            d_cut.df = data.df.iloc[indizes]
-            d_cut.md = copy.deepcopy(data.md)
-            m = self.fom(uncondense_distance_matrix(self.metric(d_cut)))
+            d_cut = data.view(indizes)
+            distances = self.metric(d_cut)
+            if scipy.sparse.issparse(distances):
+                raise ValueError(
+                    "The metric returns a sparse graph of distances, which is "
+                    "not supported for benchmarking, because all distances "
+                    "within a cluster are needed."
+                )
+            if not isinstance(distances, DistanceMatrix):
+                distances = DistanceMatrix(distances)
+            if self.fom is _sum_fom:
+                # Only needs the row sums, which can be computed without
+                # building the full distance matrix
+                m = distances.row_sums()
+            else:
+                m = self.fom(distances.uncondense())
             # The index of the wpoint of the current cluster that has the lowest
             # sum of distances to all other elements in the same cluster
             index_minimal = indizes[np.argmin(m)]
@@ -5,11 +5,13 @@ from pathlib import Path
 import unittest
 
 # 3rd
+import numpy as np
 
 # ours
 from clusterking.util.testing import MyTestCase
 from clusterking.data.data import Data
 from clusterking.benchmark.benchmark import Benchmark
+from clusterking.maths.metric_utils import metric_selection
 
 
 class TestHierarchyCluster(MyTestCase):
@@ -34,6 +36,32 @@ class TestHierarchyCluster(MyTestCase):
         self.assertEqual(self.d.df["bpoint"].value_counts()[True], 1)
         self.assertEqual(self.d.df[self.d.df["bpoint"]]["bin0"].values, 5)
 
+    def test_rerun_closest_bpoints(self):
+        d = self.d.copy()
+        d.df["a"] = np.arange(d.n, dtype=float)
+        b = Benchmark()
+        b.set_metric()
+        b.run(d).write()
+        # Every point is a benchmark point
+        closest = d.find_closest_bpoints({"a": 7.0}, n=1)
+        self.assertEqual(closest.df.index.tolist(), [7])
+        # Re-benchmark: Only one benchmark point is left
+        b.set_cluster_column("cluster1")
+        b.run(d).write()
+        bpoint = d.df.index[d.df["bpoint"]].tolist()
+        self.assertEqual(len(bpoint), 1)
+        closest = d.find_closest_bpoints({"a": 7.0}, n=1)
+        self.assertEqual(closest.df.index.tolist(), bpoint)
+
+    def test_sparse_metric(self):
+        b = Benchmark()
+        with self.assertRaises(ValueError):
+            b.set_metric("knn_graph", k=5)
+        b.set_metric(metric_selection("radius_graph", radius=1.0))
+        b.set_cluster_column("cluster1")
+        with self.assertRaises(ValueError):
+            b.run(self.d)
+
 
 if __name__ == "__main__":
     unittest.main()
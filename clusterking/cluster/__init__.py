@@ -12,6 +12,8 @@ Currently implemented:
   (https://en.wikipedia.org/wiki/Hierarchical_clustering/)
 * :class:`~clusterking.cluster.KmeansCluster`: Kmeans clustering
   (https://en.wikipedia.org/wiki/K-means_clustering/)
+* :class:`~clusterking.cluster.DBSCANCluster`: Density based clustering
+  (https://en.wikipedia.org/wiki/DBSCAN/)
 
 """
 
@@ -23,4 +25,8 @@ from clusterking.cluster.kmeans_cluster import (
     KmeansCluster,
     KmeansClusterResult,
 )
+from clusterking.cluster.dbscan_cluster import (
+    DBSCANCluster,
+    DBSCANClusterResult,
+)
 from clusterking.cluster.cluster import Cluster, ClusterResult
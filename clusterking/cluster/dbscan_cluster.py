@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# std
+import copy
+from typing import Callable
+
+# 3rd
+import numpy as np
+import scipy.sparse
+import scipy.spatial
+import sklearn.cluster
+
+# ours
+from clusterking.cluster.cluster import Cluster, ClusterResult
+from clusterking.maths.metric_utils import metric_selection
+from clusterking.maths.distance_matrix import DistanceMatrix
+from clusterking.util.metadata import failsafe_serialize, stable_serialize
+
+
+class DBSCANClusterResult(ClusterResult):
+    @property
+    def n_noise(self) -> int:
+        """ Number of sample points that DBSCAN considered noise (each of
+        them is a cluster of its own)."""
+        return self._md["dbscan"]["n_noise"]
+
+
+class DBSCANCluster(Cluster):
+    """ Density based clustering (DBSCAN,
+    `wikipedia <https://en.wikipedia.org/wiki/DBSCAN>`_) as implemented in
+    :mod:`sklearn.cluster` on precomputed distances.
+
+    With the sparse graphs of the distances to the nearest neighbours
+    (metrics ``"knn_graph"`` and ``"radius_graph"``, see
+    :mod:`clusterking.maths.neighbour_graph`), the distances between all
+    pairs of sample points are never computed. Sample points that do not
+    belong to a dense region (noise) are put in clusters of their own.
+
+    Example:
+
+    .. code-block:: python
+
+        import clusterking as ck
+        d = ck.Data("/path/to/data.sql")
+        c = ck.cluster.DBSCANCluster()
+        c.set_metric("radius_graph", radius=0.1)
+        c.set_dbscan_options(eps=0.1, min_samples=5)
+        c.run(d).write()
+    """
+
+    def __init__(self):
+        super().__init__()
+        #: Function that, applied to Data object returns the metric as
+        #: a condensed distance matrix or sparse graph of distances.
+        self._metric = None  # type: Callable
+        self._dbscan_kwargs = {}
+        self.set_metric()
+        self.set_dbscan_options()
+
+    @property
+    def metric(self) -> Callable:
+        """ Metric that was set in :meth:`set_metric` """
+        return self._metric
+
+    # Docstring set below
+    def set_metric(self, *args, **kwargs) -> None:
+        self.md["metric"]["args"] = stable_serialize(args)
+        self.md["metric"]["kwargs"] = stable_serialize(kwargs)
+        self._metric = metric_selection(*args, **kwargs)
+
+    set_metric.__doc__ = metric_selection.__doc__
+
+    def set_dbscan_options(self, eps=0.5, min_samples=5, **kwargs) -> None:
+        """ Configure clustering algorithm.
+
+        Args:
+            eps: Maximal distance of two sample points that are considered
+                neighbours. For sparse graphs of distances, only pairs of
+                sample points that are connected by the graph can be
+                neighbours, so this shouldn't be larger than the radius of
+                ``"radius_graph"``.
+            min_samples: Minimal number of neighbours (including the point
+                itself) of a core point
+            **kwargs: Further keyword arguments to
+                :class:`sklearn.cluster.DBSCAN`
+
+        Returns:
+            None
+        """
+        self._dbscan_kwargs = dict(eps=eps, min_samples=min_samples)
+        self._dbscan_kwargs.update(kwargs)
+        self.md["dbscan"]["kwargs"] = failsafe_serialize(self._dbscan_kwargs)
+
+    def run(self, data) -> DBSCANClusterResult:
+        distances = self._metric(data)
+        if (
+            isinstance(distances, DistanceMatrix)
+            and "precision" in distances.md
+        ):
+            # Result of the check of mixed precision metrics
+            self.md["precision"] = copy.deepcopy(distances.md["precision"])
+        if not scipy.sparse.issparse(distances):
+            distances = scipy.spatial.distance.squareform(np.asarray(distances))
+        dbscan = sklearn.cluster.DBSCAN(
+            metric="precomputed", **self._dbscan_kwargs
+        )
+        clusters = dbscan.fit_predict(distances)
+        noise = clusters == -1
+        n_noise = int(noise.sum())
+        clusters[noise] = clusters.max(initial=-1) + 1 + np.arange(n_noise)
+        self.md["dbscan"]["n_noise"] = n_noise
+        self.log.debug(
+            "DBSCAN found {} noise points out of {}.".format(
+                n_noise, len(clusters)
+            )
+        )
+        return DBSCANClusterResult(data=data, md=self.md, clusters=clusters)
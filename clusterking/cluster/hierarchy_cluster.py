@@ -1,25 +1,43 @@
 #!/usr/bin/env python3
 
 # std
+import copy
+import hashlib
+import json
 import pathlib
 from typing import Union, Callable, Optional
 
 # 3rd
+import numpy as np
 import scipy.cluster
+import scipy.sparse
 import scipy.spatial
 
 # ours
 from clusterking.cluster.cluster import Cluster, ClusterResult
-from clusterking.util.metadata import failsafe_serialize
+from clusterking.util.metadata import failsafe_serialize, stable_serialize
 from clusterking.maths.metric_utils import metric_selection
+from clusterking.maths.distance_matrix import DistanceMatrix
+from clusterking.maths.neighbour_graph import single_linkage
 from clusterking.util.matplotlib_utils import import_matplotlib
 
 
 class HierarchyClusterResult(ClusterResult):
-    def __init__(self, data, md, clusters, hierarchy, worker_id):
+    def __init__(
+        self,
+        data,
+        md,
+        clusters,
+        hierarchy,
+        worker_id,
+        worker_fingerprint=None,
+        data_fingerprint=None,
+    ):
         super().__init__(data=data, md=md, clusters=clusters)
         self._hierarchy = hierarchy
         self._worker_id = worker_id
+        self._worker_fingerprint = worker_fingerprint
+        self._data_fingerprint = data_fingerprint
 
     @property
     def hierarchy(self):
@@ -36,6 +54,21 @@ class HierarchyClusterResult(ClusterResult):
         """
         return id(self._data)
 
+    @property
+    def worker_fingerprint(self) -> Optional[str]:
+        """ Fingerprint of the configuration (metric and hierarchy options)
+        of the HierarchyCluster worker that generated this object (see
+        :meth:`HierarchyCluster.fingerprint`).
+        """
+        return self._worker_fingerprint
+
+    @property
+    def data_fingerprint(self) -> Optional[str]:
+        """ Fingerprint of the data object that the HierarchyCluster worker
+        was run on (see :meth:`clusterking.data.Data.fingerprint`).
+        """
+        return self._data_fingerprint
+
     def dendrogram(
         self,
         output: Optional[Union[None, str, pathlib.Path]] = None,
@@ -131,12 +164,53 @@ class HierarchyCluster(Cluster):
 
     # Docstring set below
     def set_metric(self, *args, **kwargs) -> None:
-        self.md["metric"]["args"] = failsafe_serialize(args)
-        self.md["metric"]["kwargs"] = failsafe_serialize(kwargs)
+        self.md["metric"]["args"] = stable_serialize(args)
+        self.md["metric"]["kwargs"] = stable_serialize(kwargs)
         self._metric = metric_selection(*args, **kwargs)
 
     set_metric.__doc__ = metric_selection.__doc__
 
+    def set_distance_matrix(self, distance_matrix: DistanceMatrix) -> None:
+        """ Take the distances from the rows and columns of a precomputed
+        distance matrix rather than computing the metric (replaces
+        :meth:`set_metric`).
+
+        Args:
+            distance_matrix:
+                :class:`~clusterking.maths.distance_matrix.DistanceMatrix`
+                built with
+                :meth:`~clusterking.maths.distance_matrix.DistanceMatrix.from_data`
+                for the data (or a superset of the data) that will be
+                clustered
+
+        Returns:
+            None
+        """
+        self.md["metric"] = copy.deepcopy(distance_matrix.md["metric"])
+        self._metric = distance_matrix.subset
+
+    def fingerprint(self) -> str:
+        """ Return a hash of the configuration that determines the hierarchy
+        (metric and hierarchy options). The cutoff value and the options to
+        ``fcluster`` are not included, because they do not change the
+        hierarchy. Functions in the metric configuration are described by
+        their qualified name (see
+        :func:`clusterking.util.metadata.stable_serialize`), so the
+        fingerprint is the same across sessions.
+
+        Returns:
+            Hexadecimal string
+        """
+        config = stable_serialize(
+            {
+                "metric": self.md.get("metric"),
+                "hierarchy": self.md.get("hierarchy"),
+            }
+        )
+        return hashlib.blake2b(
+            json.dumps(config, sort_keys=True).encode(), digest_size=16
+        ).hexdigest()
+
     # todo: should be at least properties
     def set_hierarchy_options(self, method="complete", optimal_ordering=False):
         """ Configure hierarchy building
@@ -152,7 +226,11 @@ class HierarchyCluster(Cluster):
         md["optimal_ordering"] = optimal_ordering
 
     def _build_hierarchy(self, data):
-        """ Builds hierarchy using :class:`scipy.cluster.hierarchy.linkage` """
+        """ Builds hierarchy using :class:`scipy.cluster.hierarchy.linkage`
+        or, if the metric returns a sparse graph of distances, from its
+        minimum spanning tree (see
+        :func:`~clusterking.maths.neighbour_graph.single_linkage`).
+        """
 
         if self._metric is None:
             msg = (
@@ -165,8 +243,33 @@ class HierarchyCluster(Cluster):
 
         self.log.debug("Building hierarchy.")
 
+        distances = self._metric(data)
+        if (
+            isinstance(distances, DistanceMatrix)
+            and "precision" in distances.md
+        ):
+            # Result of the check of mixed precision metrics
+            self.md["precision"] = copy.deepcopy(distances.md["precision"])
+        if scipy.sparse.issparse(distances):
+            if self.md["hierarchy"]["method"] != "single":
+                raise ValueError(
+                    "The metric returns a sparse graph of distances, which "
+                    "only supports the 'single' linkage method (not '{}'). "
+                    "Please use set_hierarchy_options(method='single')."
+                    "".format(self.md["hierarchy"]["method"])
+                )
+            if self.md["hierarchy"]["optimal_ordering"]:
+                raise ValueError(
+                    "Optimal ordering requires all distances and is not "
+                    "supported for sparse graphs of distances."
+                )
+            hierarchy = single_linkage(distances)
+            self.log.debug("Done")
+            return hierarchy
+
+        # np.asarray also accepts a DistanceMatrix (without copying it)
         hierarchy = scipy.cluster.hierarchy.linkage(
-            self._metric(data),
+            np.asarray(distances),
             method=self.md["hierarchy"]["method"],
             optimal_ordering=self.md["hierarchy"]["optimal_ordering"],
         )
@@ -216,7 +319,10 @@ class HierarchyCluster(Cluster):
         Args:
             data:
             reuse_hierarchy_from: Reuse the hierarchy from a
-                :class:`HierarchyClusterResult` object.
+                :class:`HierarchyClusterResult` object. This requires that
+                both the data (see :meth:`clusterking.data.Data.fingerprint`)
+                and the configuration of the metric and the hierarchy (see
+                :meth:`fingerprint`) are the same.
 
         Returns:
 
@@ -227,27 +333,28 @@ class HierarchyCluster(Cluster):
                 "running this worker."
             )
 
+        worker_fingerprint = self.fingerprint()
+        data_fingerprint = data.fingerprint()
         if reuse_hierarchy_from:
-            if not id(self) == reuse_hierarchy_from.worker_id:
+            reused_worker_fingerprint = reuse_hierarchy_from.worker_fingerprint
+            if not worker_fingerprint == reused_worker_fingerprint:
                 raise ValueError(
                     "It seems like the hierarchy you passed comes from a"
-                    " different HierarchyCluster object than this one: IDs "
-                    "don't match (self: {} vs reuse_hierarchy_from: {})".format(
-                        id(self), reuse_hierarchy_from.worker_id
+                    " different HierarchyCluster configuration than this one: "
+                    "fingerprints of metric and hierarchy options don't match "
+                    "(self: {} vs reuse_hierarchy_from: {})".format(
+                        worker_fingerprint, reused_worker_fingerprint
                     )
                 )
-            if not id(data) == reuse_hierarchy_from.data_id:
+            if not data_fingerprint == reuse_hierarchy_from.data_fingerprint:
                 raise ValueError(
-                    "It seems like the hierarchy you passed corresponds to a"
-                    " different data object than the one you gave me now. "
-                    "IDs don't match (passed to me: {} vs "
+                    "It seems like the hierarchy you passed corresponds to"
+                    " different data than the data object you gave me now. "
+                    "Fingerprints don't match (passed to me: {} vs "
                     "reuse_hierarchy_from: {})".format(
-                        id(data), reuse_hierarchy_from.data_id
+                        data_fingerprint, reuse_hierarchy_from.data_fingerprint
                     )
                 )
-            # Without caching properties of data and cluster class, we can't
-            # really check that they weren't modified in place, so this is
-            # about all we can do right now.
             hierarchy = reuse_hierarchy_from.hierarchy
         else:
             hierarchy = self._build_hierarchy(data)
@@ -263,4 +370,6 @@ class HierarchyCluster(Cluster):
             clusters=clusters,
             hierarchy=hierarchy,
             worker_id=id(self),
+            worker_fingerprint=worker_fingerprint,
+            data_fingerprint=data_fingerprint,
         )
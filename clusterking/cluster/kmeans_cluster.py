@@ -44,9 +44,26 @@ class KmeansCluster(Cluster):
         self._kmeans_kwargs = kwargs
         self.md["kmeans"]["kwargs"] = failsafe_serialize(kwargs)
 
+    def set_reduced(self, reduced=True) -> None:
+        """ Cluster the coordinates of the principal components that were
+        determined by :class:`clusterking.preprocess.PCA` (see
+        :meth:`clusterking.data.Data.reduced_data`) rather than the bin
+        contents.
+
+        Args:
+            reduced: Use reduced coordinates
+
+        Returns:
+            None
+        """
+        self.md["reduced"] = reduced
+
     def run(self, data) -> KmeansClusterResult:
         kmeans = sklearn.cluster.KMeans(**self._kmeans_kwargs)
-        matrix = data.data()
+        if self.md.get("reduced"):
+            matrix = data.reduced_data()
+        else:
+            matrix = data.data()
         kmeans.fit(matrix)
         return KmeansClusterResult(
             data=data, md=self.md, clusters=kmeans.predict(matrix)
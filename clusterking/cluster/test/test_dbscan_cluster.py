@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# std
+import unittest
+
+# 3rd
+import numpy as np
+import pandas as pd
+
+# ours
+from clusterking.cluster.dbscan_cluster import DBSCANCluster
+from clusterking.data import Data
+
+
+class TestDBSCANCluster(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        data = np.concatenate(
+            [
+                rng.normal(0.0, 0.05, size=(20, 3)),
+                rng.normal(1.0, 0.05, size=(20, 3)),
+                [[5.0, 5.0, 5.0]],
+            ]
+        )
+        self.d = Data()
+        self.d.df = pd.DataFrame(
+            data, columns=["bin{}".format(i) for i in range(3)]
+        )
+        self.d.md["scan"]["spoints"]["coeffs"] = []
+
+    def _run(self, *args, **kwargs):
+        c = DBSCANCluster()
+        c.set_metric(*args, **kwargs)
+        c.set_dbscan_options(eps=0.3, min_samples=3)
+        r = c.run(self.d)
+        self.assertEqual(r.n_noise, 1)
+        return r.get_clusters()
+
+    def test_radius_graph(self):
+        clusters = self._run("radius_graph", radius=0.3)
+        self.assertEqual(len(set(clusters)), 3)
+        self.assertEqual(len(set(clusters[:20])), 1)
+        self.assertEqual(len(set(clusters[20:40])), 1)
+
+    def test_same_as_condensed(self):
+        self.assertEqual(
+            self._run("radius_graph", radius=0.3).tolist(),
+            self._run("euclidean").tolist(),
+        )
+
+    def test_write(self):
+        c = DBSCANCluster()
+        c.set_metric("knn_graph", k=5)
+        c.set_dbscan_options(eps=0.3, min_samples=3)
+        c.run(self.d).write()
+        self.assertEqual(len(self.d.clusters()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
 # std
+import functools
+import json
 from pathlib import Path
 import pytest
 
+# 3rd
+import scipy.spatial
+
 # ours
 from clusterking.data.data import Data
 from clusterking.cluster.hierarchy_cluster import HierarchyCluster
@@ -46,15 +51,32 @@ def test_reuse_hierarchy(_data):
     assert d.df["cluster"].tolist() == d.df["reused"].tolist()
 
 
+def test_reuse_hierarchy_other_object(_data):
+    # Equal data and configuration in different objects
+    d = _data.copy()
+    e = _data.copy()
+    c = HierarchyCluster()
+    c2 = HierarchyCluster()
+    for worker in [c, c2]:
+        worker.set_metric("euclidean")
+        worker.set_max_d(1.5)
+    r = c.run(d)
+    r.write()
+    r2 = c2.run(e, reuse_hierarchy_from=r)
+    r2.write()
+    assert d.df["cluster"].tolist() == e.df["cluster"].tolist()
+
+
 def test_reuse_hierarchy_fail_different_data(_data):
     d = _data.copy()
     e = _data.copy()
+    e.df[e.bin_cols[0]] *= 2
     c = HierarchyCluster()
     c.set_metric("euclidean")
     c.set_max_d(1.5)
     r = c.run(d)
     r.write()
-    with pytest.raises(ValueError, match=".*different data object.*"):
+    with pytest.raises(ValueError, match=".*different data.*"):
         c.run(e, reuse_hierarchy_from=r)
 
 
@@ -65,11 +87,51 @@ def test_reuse_hierarchy_fail_different_cluster(_data):
     c.set_metric("euclidean")
     c.set_max_d(1.5)
     c2.set_metric("euclidean")
+    c2.set_hierarchy_options(method="single")
     c2.set_max_d(1.5)
     r = c.run(d)
     r.write()
     with pytest.raises(
-        ValueError, match=".*different HierarchyCluster object.*"
+        ValueError, match=".*different HierarchyCluster configuration.*"
+    ):
+        c2.run(d, reuse_hierarchy_from=r)
+
+
+def _pdist_euclidean(data):
+    return scipy.spatial.distance.pdist(data.data(), "euclidean")
+
+
+def test_fingerprint_callable_metric():
+    c1 = HierarchyCluster()
+    c1.set_metric(_pdist_euclidean)
+    c2 = HierarchyCluster()
+    c2.set_metric(functools.partial(_pdist_euclidean))
+    c3 = HierarchyCluster()
+    c3.set_metric(_pdist_euclidean)
+    assert c1.fingerprint() == c3.fingerprint()
+    assert c1.fingerprint() != c2.fingerprint()
+    assert " at 0x" not in json.dumps(c1.md["metric"])
+    assert c1.md["metric"]["args"][0]["callable"] == "{}.{}".format(
+        __name__, "_pdist_euclidean"
+    )
+
+
+def test_reuse_hierarchy_fail_different_lambda(_data):
+    d = _data.copy()
+    c = HierarchyCluster()
+    c.set_metric(
+        lambda data: scipy.spatial.distance.pdist(data.data(), "euclidean")
+    )
+    c.set_max_d(1.5)
+    c2 = HierarchyCluster()
+    c2.set_metric(
+        lambda data: scipy.spatial.distance.pdist(data.data(), "cityblock")
+    )
+    c2.set_max_d(1.5)
+    assert c.fingerprint() != c2.fingerprint()
+    r = c.run(d)
+    with pytest.raises(
+        ValueError, match=".*different HierarchyCluster configuration.*"
     ):
         c2.run(d, reuse_hierarchy_from=r)
 
@@ -87,3 +149,42 @@ def test_dendrogram_plot(_data, tmp_path):
     c.set_max_d(0.2)
     r = c.run(_data)
     r.dendrogram(output=str(tmp_path / "output.pdf"))
+
+
+def test_cluster_knn_graph(_data):
+    d = _data.copy()
+    e = _data.copy()
+    c = HierarchyCluster()
+    c.set_metric("knn_graph", k=d.n - 1)
+    c.set_hierarchy_options(method="single")
+    c.set_max_d(1.5)
+    c.run(d).write()
+    c2 = HierarchyCluster()
+    c2.set_metric("euclidean")
+    c2.set_hierarchy_options(method="single")
+    c2.set_max_d(1.5)
+    c2.run(e).write()
+    assert d.df["cluster"].tolist() == e.df["cluster"].tolist()
+
+
+def test_cluster_graph_requires_single(_data):
+    c = HierarchyCluster()
+    c.set_metric("radius_graph", radius=2.0)
+    c.set_max_d(1.5)
+    with pytest.raises(ValueError):
+        c.run(_data)
+
+
+def test_cluster_mixed_precision(_data):
+    d = _data.copy()
+    e = _data.copy()
+    c = HierarchyCluster()
+    c.set_metric("euclidean", precision="mixed")
+    c.set_max_d(1.5)
+    c.run(d).write()
+    assert d.md["cluster"]["cluster"]["precision"]["precision"] == "mixed"
+    c2 = HierarchyCluster()
+    c2.set_metric("euclidean")
+    c2.set_max_d(1.5)
+    c2.run(e).write()
+    assert d.df["cluster"].tolist() == e.df["cluster"].tolist()
@@ -10,8 +10,12 @@ If you do not need to include errors in your analysis, use
 Both classes inherit from a very basic class,
 :py:class:`~clusterking.data.DFMD`, which provides basic input and output
 methods.
+
+Large datasets that are split into several files can be handled with
+:py:class:`~clusterking.data.ShardedData`.
 """
 
 from clusterking.data.dwe import DataWithErrors
 from clusterking.data.data import Data
 from clusterking.data.dfmd import DFMD
+from clusterking.data.sharded import ShardedData
@@ -1,20 +1,55 @@
 #!/usr/bin/env python3
 
 # std
-import copy
+import hashlib
+import json
+from pathlib import Path
 
 # 3d
 import numpy as np
-from typing import Callable, Union, Iterable, List, Any, Optional, Dict
+import pandas as pd
+import scipy.spatial
+import sqlalchemy
+from typing import (
+    Callable,
+    Union,
+    Iterable,
+    List,
+    Any,
+    Optional,
+    Dict,
+    Sequence,
+    Tuple,
+)
 
 # ours
-from clusterking.data.dfmd import DFMD
+from clusterking.data.dfmd import (
+    DFMD,
+    _metadata_depends,
+    _pandas_copy_on_write,
+)
+from clusterking.data.param_index import ParamIndex
+from clusterking.data.grid import GridView
+from clusterking.util.metadata import hash_metadata
 from clusterking.maths.metric_utils import (
     uncondense_distance_matrix,
     metric_selection,
 )
 
 
+def _compact_label_dtype(labels: pd.Series):
+    """ Smallest data type for cluster numbers: ``uint16`` for small positive
+    integers, categorical data otherwise. """
+    if pd.api.types.is_integer_dtype(labels.dtype):
+        if labels.empty or (
+            labels.min() >= 0 and labels.max() <= np.iinfo(np.uint16).max
+        ):
+            return np.dtype(np.uint16)
+    if isinstance(labels.dtype, pd.CategoricalDtype):
+        return labels.dtype
+    return "category"
+
+
 class Data(DFMD):
     """ This class inherits from the :py:class:`~clusterking.data.DFMD`
     class and adds additional methods to it. It is the basic container,
@@ -96,6 +131,51 @@ class Data(DFMD):
             yvar = None
         return xvar, yvar
 
+    def _compatibility_md(self) -> Dict[str, Any]:
+        """ Return the part of the metadata that has to agree between two
+        data objects, so that their sample points can be combined into one
+        dataset (e.g. the distribution function, the binning and the names of
+        the parameters).
+        """
+        # Use get to avoid adding empty entries to the nested dictionary
+        scan = self.md.get("scan", {})
+        dfunction = scan.get("dfunction", {})
+        return {
+            "dfunction": {
+                key: dfunction.get(key)
+                for key in [
+                    "name",
+                    "kwargs",
+                    "binning",
+                    "binning_mode",
+                    "nbins",
+                    "xvar",
+                    "yvar",
+                ]
+            },
+            "coeffs": scan.get("spoints", {}).get("coeffs"),
+            "imaginary_prefix": scan.get("imaginary_prefix"),
+        }
+
+    def _fingerprint_md(self) -> Dict[str, Any]:
+        """ Return the metadata (and other quantities) that are included in
+        the fingerprint (see :meth:`fingerprint`). """
+        md = self._compatibility_md()
+        if "pca" in self.md:
+            # Changes the reduced coordinates
+            md["pca"] = self._projection_md()
+        return md
+
+    def _projection_md(self) -> Dict[str, Any]:
+        """ The part of the metadata of :class:`clusterking.preprocess.PCA`
+        that determines the reduced coordinates (see :meth:`reduced_data`).
+        """
+        pca = self.md["pca"]
+        return {
+            key: pca[key]
+            for key in ["mean", "components", "explained_variance", "whiten"]
+        }
+
     # **************************************************************************
     # Returning things
     # **************************************************************************
@@ -112,10 +192,43 @@ class Data(DFMD):
         data = self.df[self.bin_cols].values
         if normalize:
             # Reshaping here is important!
-            return data / np.sum(data, axis=1).reshape((self.n, 1))
+            return data / np.sum(data, axis=1, dtype=np.float64).reshape(
+                (self.n, 1)
+            )
         else:
             return data
 
+    def reduced_data(self) -> np.ndarray:
+        """ Returns the coordinates of all normalized histograms in the space
+        of the principal components that were determined by
+        :class:`clusterking.preprocess.PCA`.
+
+        Returns:
+            numpy.ndarray of shape self.n x number of components
+        """
+        if "pca" not in self.md:
+            raise ValueError(
+                "No projection found. Run clusterking.preprocess.PCA and "
+                "write its result first."
+            )
+        pca = self._projection_md()
+        h = hashlib.blake2b(digest_size=16)
+        hash_metadata(pca, h)
+
+        def build():
+            reduced = (self.data(normalize=True) - pca["mean"]) @ np.asarray(
+                pca["components"]
+            ).T
+            if pca["whiten"]:
+                scale = np.sqrt(np.asarray(pca["explained_variance"]))
+                reduced /= np.where(scale > 0, scale, 1.0)
+            reduced.flags.writeable = False
+            return reduced
+
+        return self._cached(
+            ("reduced_data", h.hexdigest()), build, columns=self.bin_cols
+        )
+
     def norms(self) -> np.ndarray:
         """ Returns a vector of all normalizations of all histograms (where
         each histogram corresponds to one sampled point in parameter space).
@@ -123,7 +236,7 @@ class Data(DFMD):
         Returns:
             numpy.ndarray of shape self.n
         """
-        return np.sum(self.data(), axis=1)
+        return np.sum(self.data(), axis=1, dtype=np.float64)
 
     def clusters(self, cluster_column="cluster") -> List[Any]:
         """ Return list of all cluster names (unique)
@@ -158,33 +271,200 @@ class Data(DFMD):
             }
         return self.df[param].unique()
 
+    def param_index(self, param: str) -> ParamIndex:
+        """ Return an index of the values of a parameter (sorted unique
+        values and the rows where they are attained), that allows to quickly
+        select sample points by their parameter values.
+
+        The index is built when it is first requested and cached until the
+        dataframe or the parameter column is changed.
+
+        Args:
+            param: Name of the parameter
+
+        Returns:
+            :class:`~clusterking.data.param_index.ParamIndex` object
+        """
+        return self._cached(
+            ("param_index", param),
+            lambda: ParamIndex(self.df[param].values),
+            columns=[param],
+        )
+
+    def grid(self, params: Optional[List[str]] = None) -> Optional[GridView]:
+        """ Detect whether the sample points form a complete cartesian grid
+        in parameter space (e.g. if they were created with
+        :meth:`clusterking.scan.Scanner.set_spoints_equidist`) and return a
+        view that arranges the rows on this grid.
+
+        Example:
+
+        .. code-block:: python
+
+            grid = d.grid()
+            grid.axes  # Sorted values of every parameter
+            grid.tensor(d.data())  # Bin contents, shape grid.shape + (nbins,)
+            grid.tensor(d.df["cluster"].values)  # Clusters on the grid
+            grid.select(a=0.5)  # Row positions with a = 0.5
+
+        The grid is detected when it is first requested and cached until the
+        dataframe is changed.
+
+        Args:
+            params: Parameters that span the grid. Default: All parameters.
+
+        Returns:
+            :class:`~clusterking.data.grid.GridView` or ``None`` if the sample
+            points do not form a complete grid.
+        """
+        if params is None:
+            params = self.par_cols
+
+        def build():
+            indizes = [self.param_index(param) for param in params]
+            return GridView.from_codes(
+                params,
+                [index.values for index in indizes],
+                [index.codes for index in indizes],
+            )
+
+        return self._cached(("grid", tuple(params)), build, columns=params)
+
+    def fingerprint(self) -> str:
+        """ Return a hash of the content of this object that is relevant for
+        clustering: The bin contents, the parameter values, the index of the
+        sample points and the relevant metadata (distribution function,
+        binning, parameter names and, for
+        :class:`~clusterking.data.DataWithErrors` objects, the error
+        configuration). Other columns (e.g. cluster numbers or benchmark
+        points) do not change the fingerprint.
+
+        Two objects with the same fingerprint will give the same distance
+        matrices, hierarchies etc., so the fingerprint can be used to check
+        whether results can be reused, even across different sessions.
+
+        The fingerprint is maintained incrementally: It is built from a
+        64 bit hash of every sample point (bin contents, parameter values and
+        index label), which is cached and only computed for the new rows in
+        :meth:`extend`. The fingerprint itself is cached until the dataframe
+        or the metadata change. Assigning to the bin or parameter columns
+        (e.g. ``d.df["bin0"] *= 2``) is detected, for other in-place
+        modifications of the dataframe call :meth:`_invalidate_cache` (see
+        :meth:`_cached`).
+
+        Returns:
+            Hexadecimal string
+        """
+        row_hashes = self._row_hashes()
+
+        def build():
+            h = hashlib.blake2b(digest_size=16)
+            hash_metadata(self._fingerprint_md(), h)
+            h.update(json.dumps([self.bin_cols, self.par_cols]).encode())
+            h.update(row_hashes.tobytes())
+            return h.hexdigest()
+
+        return self._cached(
+            ("fingerprint",),
+            build,
+            columns=self.bin_cols + self.par_cols,
+            depends=[row_hashes] + self._fingerprint_depends(),
+        )
+
+    def _fingerprint_depends(self) -> List[Any]:
+        """ The metadata of the fingerprint as objects that the cached
+        fingerprint depends on (see :meth:`_cached`). """
+        return _metadata_depends(self._fingerprint_md())
+
+    @staticmethod
+    def _hash_rows(df: pd.DataFrame) -> np.ndarray:
+        """ 64 bit hash of the values (as 64 bit floats) and the index label
+        of every row of a dataframe. """
+        hashes = pd.util.hash_pandas_object(
+            df.astype(np.float64), index=True
+        ).values
+        hashes.setflags(write=False)
+        return hashes
+
+    def _row_hashes(self) -> np.ndarray:
+        """ 64 bit hash of the bin contents, parameter values and the index
+        label of every sample point (cached, see :meth:`fingerprint`). """
+        columns = self.bin_cols + self.par_cols
+        return self._cached(
+            ("row_hashes",),
+            lambda: self._hash_rows(self.df[columns]),
+            columns=columns,
+        )
+
     # **************************************************************************
     # Subsample
     # **************************************************************************
 
+    def view(self, rows: Union[np.ndarray, Iterable[int]]) -> "Data":
+        """ Return a new data object that only contains a subset of the
+        sample points (rows of the dataframe).
+
+        The new object is cheap to create: The metadata is copied, but (with
+        copy-on-write semantics in pandas, see
+        ``pd.options.mode.copy_on_write``) the dataframe is only built from
+        the selected rows of this object once it is accessed. Without
+        copy-on-write, the selected rows are copied right away. Modifying the
+        new object does not change this object and vice versa.
+
+        Args:
+            rows: Boolean mask of length :attr:`n` or integer positions of the
+                rows to keep
+
+        Returns:
+            New object of the same type as this object
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            if not len(rows) == self.n:
+                raise ValueError(
+                    "Boolean mask has length {}, but there are {} rows".format(
+                        len(rows), self.n
+                    )
+                )
+            rows = np.flatnonzero(rows)
+        new = self.copy(data=False)
+        if _pandas_copy_on_write():
+            # Shallow copy so that columns added to this object later are not
+            # visible in the new object. Modifications of the values are not
+            # visible either, because they copy the data first.
+            base = self.df.copy(deep=False)
+            new._set_lazy_df(lambda: base.iloc[rows])
+        else:
+            # Without copy-on-write, the shallow copy would share the data
+            # with this object, so we have to select the rows right away.
+            new.df = self.df.iloc[rows].copy()
+        return new
+
     def only_bpoints(self, bpoint_column="bpoint", inplace=False):
         """ Keep only the benchmark points as sample points.
 
         Args:
             bpoint_column: benchmark point column (boolean)
             inplace: If True, the current Data object is modified, if False,
-                a new copy of the Data object is returned.
+                a new copy of the Data object is returned (see :meth:`view`).
 
         Returns:
             None or Data
         """
+        selector = self.df[bpoint_column].values.astype(bool)
         if inplace:
-            self.df = self.df[self.df[bpoint_column]]
+            self.df = self.df[selector]
         else:
-            # todo: this is inefficient
-            new_obj = copy.deepcopy(self)
-            new_obj.only_bpoints(inplace=True, bpoint_column=bpoint_column)
-            return new_obj
+            return self.view(selector)
 
     def _bpoint_slices(self, bpoint_column="bpoint"):
         """ See docstring of only_bpoint_slices. """
-        bpoint_df = self.only_bpoints(bpoint_column=bpoint_column)
-        return {param: bpoint_df.df[param].unique() for param in self.par_cols}
+        is_bpoint = self.df[bpoint_column].values.astype(bool)
+        slices = {}
+        for param in self.par_cols:
+            index = self.param_index(param)
+            slices[param] = index.values[np.unique(index.codes[is_bpoint])]
+        return slices
 
     # todo: test me
     # todo: order dict to avoid changing results
@@ -212,7 +492,7 @@ class Data(DFMD):
 
         Returns:
             If ``inplace == False``, return new Data with subset of sample
-            points.
+            points (see :meth:`view`).
 
         Examples:
 
@@ -258,20 +538,6 @@ class Data(DFMD):
             d.fix_param(CT_bctaunutau=[], bpoint_slice=True)
 
         """
-        if not inplace:
-            # todo: this is inefficient
-            new_obj = copy.deepcopy(self)
-            new_obj.fix_param(
-                inplace=True,
-                bpoints=bpoints,
-                bpoint_slices=bpoint_slices,
-                bpoint_column=bpoint_column,
-                **kwargs
-            )
-            return new_obj
-
-        # From here on, we apply everything in place.
-
         if bpoint_slices:
             bpoint_slices = self._bpoint_slices(bpoint_column=bpoint_column)
         else:
@@ -286,23 +552,21 @@ class Data(DFMD):
                 values_dict[param] = list(values)
             values_dict[param].extend(bpoint_slices[param])
 
-        # Get selector
+        # Get selector: For every requested value, we look up the closest
+        # value that is attained and keep all rows with that value.
         selector = np.full(self.n, True, bool)
         for param, values in values_dict.items():
-            param_selector = np.full(self.n, False, bool)
-            for value in values:
-                available_values = self.df[param].values
-                idx = (np.abs(available_values - value)).argmin()
-                nearest_value = available_values[idx]
-                param_selector |= np.isclose(
-                    self.df[param].values, nearest_value
-                )
-            selector &= param_selector
+            if not values:
+                selector[:] = False
+                continue
+            selector &= self.param_index(param).select_nearest(values)
         if bpoints:
-            selector |= self.df[bpoint_column].astype(bool)
+            selector |= self.df[bpoint_column].values.astype(bool)
 
-        # Apply selector to dataframe
-        self.df = self.df[selector]
+        if inplace:
+            self.df = self.df[selector]
+        else:
+            return self.view(selector)
 
     # todo: test
     def sample_param(
@@ -372,8 +636,9 @@ class Data(DFMD):
                         "Please specify minimum, maximum and number of points."
                     )
             elif isinstance(value, (int, float)):
-                param_min = self.df[param].min()
-                param_max = self.df[param].max()
+                param_values = self.param_index(param).values
+                param_min = param_values[0]
+                param_max = param_values[-1]
                 param_npoints = value
             else:
                 raise ValueError(
@@ -404,85 +669,211 @@ class Data(DFMD):
 
         Returns:
             If ``inplace == False``, return new Data with subset of sample
-            points.
+            points (see :meth:`view`).
         """
-        if not inplace:
-            # todo: this is inefficient, why do we have to copy everything
-            #  first?
-            new = self.copy()
-            new.sample_param_random(
-                inplace=True,
-                bpoints=bpoints,
-                bpoint_column=bpoint_column,
-                **kwargs
-            )
-            return new
+        # Sample positions of rows rather than the dataframe itself to avoid
+        # copying any data
+        positions = pd.Series(np.arange(self.n), index=self.df.index)
         if not bpoints:
-            self.df = self.df.sample(**kwargs)
+            rows = positions.sample(**kwargs).values
         else:
-            bpoint_df = self.df[self.df[bpoint_column]]
-            self.df = self.df[~self.df[bpoint_column]].sample(**kwargs)
-            self.df = self.df.append(bpoint_df)
+            is_bpoint = self.df[bpoint_column].values.astype(bool)
+            rows = np.concatenate(
+                [
+                    positions[~is_bpoint].sample(**kwargs).values,
+                    positions[is_bpoint].values,
+                ]
+            )
+        if inplace:
+            self.df = self.df.iloc[rows]
+        else:
+            return self.view(rows)
+
+    # --------------------------------------------------------------------------
+    # Nearest sample points
+    # --------------------------------------------------------------------------
+
+    def _scale_vector(
+        self, scale: Optional[Dict[str, float]] = None
+    ) -> np.ndarray:
+        """ Convert per-parameter scaling factors to a vector (in the order
+        of :attr:`par_cols`). """
+        if scale is None:
+            scale = {}
+        unknown = set(scale) - set(self.par_cols)
+        if unknown:
+            raise ValueError(
+                "Unknown parameter(s) in scale: {}".format(
+                    ", ".join(sorted(unknown))
+                )
+            )
+        return np.array([scale.get(param, 1.0) for param in self.par_cols])
+
+    def _spoint_tree(
+        self,
+        scale: Optional[Dict[str, float]] = None,
+        bpoint_column: Optional[str] = None,
+    ):
+        """ Spatial index over the (scaled) parameter values of the sample
+        points. It is built on first use and cached until the dataframe
+        changes.
+
+        Args:
+            scale: Dictionary of parameter name to scaling factor
+            bpoint_column: If given, only use the benchmark points from this
+                column
+
+        Returns:
+            Tuple of :class:`scipy.spatial.cKDTree` and the positions of the
+            rows that it contains.
+        """
+        scale_vector = self._scale_vector(scale)
+
+        def build():
+            if bpoint_column is None:
+                rows = np.arange(self.n)
+            else:
+                rows = np.flatnonzero(self.df[bpoint_column].values)
+            coords = self.df[self.par_cols].values[rows] * scale_vector
+            return scipy.spatial.cKDTree(coords), rows
+
+        key = ("spoint_tree", tuple(scale_vector), bpoint_column)
+        columns = list(self.par_cols)
+        if bpoint_column is not None:
+            columns.append(bpoint_column)
+        return self._cached(key, build, columns=columns)
+
+    def _interpret_points(self, points) -> np.ndarray:
+        """ Convert points in parameter space to a m x npars array.
+
+        Args:
+            points: Dictionary of parameter name to value (or array of
+                values) or array of shape ``npars`` or ``m x npars`` (in the
+                order of :attr:`par_cols`)
+
+        Returns:
+            m x npars array
+        """
+        if isinstance(points, dict):
+            if not set(points.keys()) == set(self.par_cols):
+                raise ValueError(
+                    "Invalid specification of a point: Please give values"
+                    " exactly for the following keys: {}".format(
+                        ", ".join(self.par_cols)
+                    )
+                )
+            points = np.stack(
+                [
+                    np.atleast_1d(np.asarray(points[param], float))
+                    for param in self.par_cols
+                ],
+                axis=-1,
+            )
+        points = np.atleast_2d(np.asarray(points, float))
+        if not points.ndim == 2 or not points.shape[1] == self.npars:
+            raise ValueError(
+                "Points have to be of shape (m, {}), but got {}.".format(
+                    self.npars, points.shape
+                )
+            )
+        return points
+
+    def nearest_spoints(
+        self,
+        points,
+        k=1,
+        scale: Optional[Dict[str, float]] = None,
+        bpoint_column: Optional[str] = None,
+    ):
+        """ Find the ``k`` nearest sample points for one or many points in
+        parameter space.
+
+        Args:
+            points: Dictionary of parameter name to value (or array of
+                values) or array of shape ``npars`` or ``m x npars`` (in the
+                order of :attr:`par_cols`)
+            k: Number of nearest sample points
+            scale: Optional dictionary of parameter name to a factor that the
+                parameter values are multiplied with before calculating
+                distances. Parameters that are not given are not scaled.
+            bpoint_column: If given, only consider benchmark points from this
+                column
+
+        Returns:
+            Tuple of two ``m x k`` arrays: The distances and the positions
+            (row numbers) of the nearest sample points, in order of increasing
+            distance. If there are less than ``k`` sample points, the missing
+            distances are ``inf`` and the missing positions are :attr:`n`.
+        """
+        if k <= 0:
+            raise ValueError("k has to be an integer >= 1.")
+        points = self._interpret_points(points) * self._scale_vector(scale)
+        tree, rows = self._spoint_tree(scale, bpoint_column)
+        distances, idx = tree.query(points, k=[i + 1 for i in range(k)])
+        # Convert tree indizes to row positions, keeping the placeholder for
+        # missing neighbours
+        positions = np.append(rows, self.n)[np.minimum(idx, len(rows))]
+        return distances, positions
+
+    def spoints_within(
+        self,
+        points,
+        radius: float,
+        scale: Optional[Dict[str, float]] = None,
+        bpoint_column: Optional[str] = None,
+    ) -> List[np.ndarray]:
+        """ Find all sample points within a distance of ``radius`` around one
+        or many points in parameter space.
+
+        Args:
+            points: See :meth:`nearest_spoints`
+            radius: Maximal distance (after scaling)
+            scale: See :meth:`nearest_spoints`
+            bpoint_column: See :meth:`nearest_spoints`
+
+        Returns:
+            List of arrays (one for every point) with the positions (row
+            numbers) of the sample points (in increasing order)
+        """
+        points = self._interpret_points(points) * self._scale_vector(scale)
+        tree, rows = self._spoint_tree(scale, bpoint_column)
+        return [
+            rows[np.sort(np.array(idx, int))]
+            for idx in tree.query_ball_point(points, radius)
+        ]
 
-    def find_closest_spoints(self, point: Dict[str, float], n=10) -> "Data":
+    def find_closest_spoints(
+        self,
+        point: Dict[str, float],
+        n=10,
+        scale: Optional[Dict[str, float]] = None,
+    ) -> "Data":
         """ Given a point in parameter space, find the closest sampling
         points to it and return them as a :py:class:`Data` object with the
         corresponding subset of spoints.
         The order of the rows in the dataframe :py:attr:`Data.df` will be in
         order of increasing parameter space distance from the given point.
+        To query many points at once, use :meth:`nearest_spoints`.
 
         Args:
             point: Dictionary of parameter name to value
             n: Maximal number of rows to return
+            scale: Optional dictionary of parameter name to a factor that the
+                parameter values are multiplied with before calculating
+                distances.
 
         Returns:
             :py:class:`Data` object with subset of rows of dataframe
             corresponding to the closest points in parameter space.
         """
-        if not set(point.keys()) == set(self.par_cols):
-            raise ValueError(
-                "Invalid specification of a point: Please give values"
-                " exactly for the following keys: {}".format(
-                    ", ".join(self.par_cols)
-                )
-            )
-        if n <= 0:
-            raise ValueError("n has to be an integer >= 1.")
-
-        # argpartition will throw if we request more or equal rows than we have,
-        # so we have to be careful
-        n_max = self.n
-        if n_max == 0:
-            raise ValueError("Not enough rows available.")
-        if n_max < n:
-            n_max = n
-
-        distances = np.sqrt(
-            np.sum(
-                np.array(
-                    [
-                        np.square(self.df[param].values - point[param])
-                        for param in self.par_cols
-                    ]
-                ),
-                axis=0,
-            )
-        )
-
-        if n < n_max:
-            closest = np.argpartition(distances, n)[:n]
-        else:
-            # n == n_max
-            closest = np.arange(0, len(distances))
-        # note that argpartition did not sort these yet, so we do this now
-        closest = closest[np.argsort(distances[closest])]
-
-        new = self.copy(data=False)
-        new.df = self.df.iloc[closest]
-        return new
+        return self._find_closest(point, n=n, scale=scale)
 
     def find_closest_bpoints(
-        self, point: Dict[str, float], n=10, bpoint_column="bpoint"
+        self,
+        point: Dict[str, float],
+        n=10,
+        bpoint_column="bpoint",
+        scale: Optional[Dict[str, float]] = None,
     ):
         """ Given a point in parameter space, find the closest benchmark
         points to it and return them as a :py:class:`Data` object with the
@@ -494,12 +885,23 @@ class Data(DFMD):
             point: Dictionary of parameter name to value
             n: Maximal number of rows to return
             bpoint_column: Column name of the benchmark column
+            scale: Optional dictionary of parameter name to a factor that the
+                parameter values are multiplied with before calculating
+                distances.
 
         Returns:
             :py:class:`Data` object with subset of rows of dataframe
             corresponding to the closest points in parameter space.
         """
-        if not set(point.keys()) == set(self.par_cols):
+        return self._find_closest(
+            point, n=n, scale=scale, bpoint_column=bpoint_column
+        )
+
+    def _find_closest(self, point, n, scale, bpoint_column=None) -> "Data":
+        """ See docstring of find_closest_spoints. """
+        if not isinstance(point, dict) or not set(point.keys()) == set(
+            self.par_cols
+        ):
             raise ValueError(
                 "Invalid specification of a point: Please give values"
                 " exactly for the following keys: {}".format(
@@ -508,41 +910,16 @@ class Data(DFMD):
             )
         if n <= 0:
             raise ValueError("n has to be an integer >= 1.")
-
-        # argpartition will throw if we request more or equal rows than we have,
-        # so we have to be careful
-        n_max = len(self.df[self.df[bpoint_column]])
-        if n_max == 0:
+        _, rows = self._spoint_tree(scale, bpoint_column)
+        if len(rows) == 0:
             raise ValueError("Not enough rows available.")
-        if n_max < n:
-            n_max = n
-
-        distances = np.sqrt(
-            np.sum(
-                np.array(
-                    [
-                        np.square(
-                            self.df[self.df[bpoint_column]][param].values
-                            - point[param]
-                        )
-                        for param in self.par_cols
-                    ]
-                ),
-                axis=0,
-            )
+        _, positions = self.nearest_spoints(
+            point,
+            k=min(n, len(rows)),
+            scale=scale,
+            bpoint_column=bpoint_column,
         )
-
-        if n < n_max:
-            closest = np.argpartition(distances, n)[:n]
-        else:
-            # n == n_max
-            closest = np.arange(0, len(distances))
-        # note that argpartition did not sort these yet, so we do this now
-        closest = closest[np.argsort(distances[closest])]
-
-        new = self.copy(data=False)
-        new.df = self.df[self.df[bpoint_column]].iloc[closest]
-        return new
+        return self.view(positions[0])
 
     # **************************************************************************
     # Manipulating things
@@ -567,6 +944,340 @@ class Data(DFMD):
         else:
             return variable
 
+    # --------------------------------------------------------------------------
+    # Data types
+    # --------------------------------------------------------------------------
+
+    def set_dtypes(self, bins="float32", compact_labels=True) -> None:
+        """ Set the data types that are used for the columns of the
+        dataframe in order to save memory. The setting is saved in the
+        metadata, so that it is also applied to columns that are written
+        later (e.g. by clustering or benchmarking) and restored when loading
+        the data from a file.
+
+        Calculations that need the precision (e.g. normalizations, covariance
+        matrices and the chi2 metric) are still performed with 64 bit floats.
+
+        Args:
+            bins: Data type of the bin contents: ``float32`` or ``float64``
+                (default for new data)
+            compact_labels: Store cluster numbers as ``uint16`` (or as
+                categorical data if they are not small positive integers) and
+                benchmark points as booleans.
+
+        Returns:
+            None
+        """
+        if bins not in ["float32", "float64"]:
+            raise ValueError(
+                "Unsupported data type '{}' for bins. Use 'float32' or "
+                "'float64'.".format(bins)
+            )
+        self.md["dtypes"]["bins"] = bins
+        self.md["dtypes"]["compact_labels"] = compact_labels
+        self._apply_dtypes()
+
+    def _apply_dtypes(self, columns: Optional[List[str]] = None) -> None:
+        """ Convert columns to the data types set in :meth:`set_dtypes`.
+
+        Args:
+            columns: Only convert these columns. Default: All columns.
+
+        Returns:
+            None
+        """
+        policy = self.md.get("dtypes")
+        if not policy:
+            return
+        df = self.df
+        if columns is None:
+            columns = list(df.columns)
+        dtypes = {}
+        if policy.get("bins"):
+            for col in self.bin_cols:
+                if col in columns:
+                    dtypes[col] = policy["bins"]
+        if policy.get("compact_labels"):
+            for col in self.md.get("cluster", {}):
+                if col in columns and col in df.columns:
+                    dtypes[col] = _compact_label_dtype(df[col])
+            for col in self.md.get("bpoint", {}):
+                if col in columns and col in df.columns:
+                    dtypes[col] = bool
+        dtypes = {
+            col: dtype
+            for col, dtype in dtypes.items()
+            if not df[col].dtype == dtype
+        }
+        if dtypes:
+            self.df = df.astype(dtypes)
+
+    def _load(self, path) -> None:
+        super()._load(path)
+        self._restore_grid_columns()
+        # SQL only knows 64 bit numbers, so we restore the data types here
+        self._apply_dtypes()
+
+    # --------------------------------------------------------------------------
+    # Combining data
+    # --------------------------------------------------------------------------
+
+    def _check_compatible(self, other: "Data") -> None:
+        """ Raise ``ValueError`` if the sample points of another data object
+        can't be combined with ours (see :meth:`_compatibility_md`). """
+        ours = self._compatibility_md()
+        theirs = other._compatibility_md()
+
+        def _hash(value):
+            hasher = hashlib.blake2b(digest_size=16)
+            hash_metadata(value, hasher)
+            return hasher.hexdigest()
+
+        differing = sorted(
+            key
+            for key in set(ours) | set(theirs)
+            if _hash(ours.get(key)) != _hash(theirs.get(key))
+        )
+        if differing:
+            raise ValueError(
+                "The metadata of the two data objects is not compatible. "
+                "The following entries differ: {}".format(", ".join(differing))
+            )
+
+    def _extension_rows(
+        self, index: pd.Index, params: pd.DataFrame, other: "Data", dedupe=True
+    ) -> Tuple[np.ndarray, pd.Index]:
+        """ Determine which rows of another data object are added to ours and
+        their new index labels.
+
+        Args:
+            index: Our index
+            params: Our parameter values (columns :attr:`par_cols`)
+            other: Other data object
+            dedupe: Skip rows whose sample points we already have
+
+        Returns:
+            Boolean mask of the rows of ``other`` that are added and the
+            index labels of these rows
+        """
+        keep = np.full(other.n, True, bool)
+        if dedupe and self.par_cols:
+            ours = pd.MultiIndex.from_frame(params[self.par_cols])
+            theirs = pd.MultiIndex.from_frame(other.df[self.par_cols])
+            keep = ~(theirs.isin(ours) | theirs.duplicated())
+        if len(index) and not pd.api.types.is_integer_dtype(index.dtype):
+            raise ValueError(
+                "Data can only be extended if the index is integer valued."
+            )
+        start = int(index.max()) + 1 if len(index) else 0
+        labels = pd.RangeIndex(
+            start, start + int(keep.sum()), name=index.name or "index"
+        )
+        return keep, labels
+
+    def _extend_md(
+        self, other: "Data", old_labels: pd.Index, new_labels: pd.Index
+    ) -> None:
+        """ Update our metadata after rows of another data object were added
+        to the dataframe.
+
+        Args:
+            other: Other data object
+            old_labels: Index labels of the added rows in ``other``
+            new_labels: Index labels of the added rows in our dataframe
+
+        Returns:
+            None
+        """
+        pass
+
+    def _extended_cache(
+        self, other: "Data", keep: np.ndarray, labels: np.ndarray
+    ) -> List[
+        Tuple[Any, Any, List[str], Optional[Callable[[], Sequence[Any]]]]
+    ]:
+        """ Cached quantities of the extended data object that can be built
+        from our cached quantities and the added rows (see :meth:`extend`).
+
+        Args:
+            other: Other data object
+            keep: Boolean mask of the rows of ``other`` that are added
+            labels: Index labels of the added rows
+
+        Returns:
+            List of tuples of the cache key, the quantity, the columns that it
+            is built from and ``None`` or a function that returns the further
+            objects that it depends on (evaluated after extending, see
+            :meth:`_cached`)
+        """
+        cache = []
+        for param in self.par_cols:
+            key = ("param_index", param)
+            index = self._get_cached(key, columns=[param])
+            if index is None:
+                continue
+            index = ParamIndex.concatenate(
+                index, other.param_index(param).subset(keep)
+            )
+            cache.append((key, index, [param], None))
+        columns = self.bin_cols + self.par_cols
+        row_hashes = self._get_cached(("row_hashes",), columns=columns)
+        if row_hashes is not None and list(self.df[columns].dtypes) == list(
+            other.df[columns].dtypes
+        ):
+            rows = other.df[columns][keep]
+            rows.index = labels
+            row_hashes = np.concatenate([row_hashes, self._hash_rows(rows)])
+            row_hashes.setflags(write=False)
+            cache.append((("row_hashes",), row_hashes, columns, None))
+        return cache
+
+    def extend(self, other: "Data", dedupe=True) -> None:
+        """ Add the sample points of another data object (e.g. from a scan of
+        a different region of parameter space) to this one.
+
+        The metadata of both objects has to be compatible, i.e. the
+        distribution function, the binning and the parameters have to agree
+        (and for :class:`~clusterking.data.DataWithErrors` objects also
+        the errors that are the same for all sample points).
+        Our metadata is kept.
+        The added rows get new index labels that continue our index. Errors
+        per sample point of :class:`~clusterking.data.DataWithErrors` objects
+        are kept for the added rows.
+        Cached parameter indizes (see :meth:`param_index`) and errors are
+        updated rather than rebuilt.
+
+        Args:
+            other: :class:`~clusterking.data.Data` object
+            dedupe: Skip sample points of ``other`` that we already have (or
+                that appear several times in ``other``)
+
+        Returns:
+            None
+        """
+        if self.df.empty and not self.md.get("scan"):
+            # Nothing to be compatible with
+            self.md = other.copy(data=False).md
+            self.df = other.df.copy()
+            self._apply_dtypes()
+            return
+        self._check_compatible(other)
+        keep, labels = self._extension_rows(
+            self.df.index, self.df, other, dedupe=dedupe
+        )
+        cache = self._extended_cache(other, keep, labels)
+        rows = other.df[keep].copy()
+        old_labels = rows.index
+        rows.index = labels
+        self.df = pd.concat([self.df, rows])
+        self._extend_md(other, old_labels, labels)
+        self._apply_dtypes()
+        for key, value, columns, depends in cache:
+            depends = depends() if depends is not None else ()
+            self._set_cached(key, value, columns=columns, depends=depends)
+        self.log.debug(
+            "Added {} sample points ({} duplicates skipped).".format(
+                int(keep.sum()), int(len(keep) - keep.sum())
+            )
+        )
+
+    # --------------------------------------------------------------------------
+    # Writing
+    # --------------------------------------------------------------------------
+
+    def write(self, path, overwrite="ask", grid_axes=False) -> None:
+        """ Write output files.
+
+        Args:
+            path: Path to output file
+            overwrite: How to proceed if output file already exists:
+                'ask' (ask interactively for approval if we have to overwrite),
+                'overwrite' (overwrite without asking), 'raise'
+                (raise Exception if file exists).
+                Default is 'ask'.
+            grid_axes: If the sample points form a complete grid (see
+                :meth:`grid`) and the rows are in the order of the grid, only
+                save the axes of the grid rather than the values of the
+                parameters for every row. They are restored upon loading.
+
+        Returns:
+            None
+        """
+        df, md = self.df, self.md
+        grid = self.grid() if grid_axes and self.par_cols else None
+        if grid is not None and grid.is_ordered:
+            md = self.md.copy()
+            md["grid_axes"] = grid.to_dict()
+            md["grid_axes"]["columns"] = list(self.df.columns)
+            df = self.df.drop(columns=grid.params)
+        elif grid_axes:
+            self.log.warning(
+                "Sample points don't form an ordered grid, so parameter "
+                "values are written for every row."
+            )
+        self._write(path, df, md, overwrite=overwrite)
+
+    def append_to_file(self, path, dedupe=True) -> None:
+        """ Add our sample points to a file that was written by
+        :meth:`write` (see :meth:`extend`). Only the new rows and the
+        metadata are written, the existing rows are not read (except for their
+        parameter values and index) or rewritten.
+        If the file does not exist yet, it is created.
+
+        Args:
+            path: Path to file
+            dedupe: Skip sample points that are already in the file
+
+        Returns:
+            None
+        """
+        path = Path(path)
+        if not path.is_file():
+            self.write(path, overwrite="raise")
+            return
+        engine = sqlalchemy.create_engine("sqlite:///" + str(path.resolve()))
+        columns = [
+            column["name"]
+            for column in sqlalchemy.inspect(engine).get_columns("df")
+        ]
+        existing = type(self)()
+        existing.md = self._read_md(path)
+        if "grid_axes" in existing.md or set(columns) != set(
+            ["index"] + list(self.df.columns)
+        ):
+            # The file has to be rewritten completely
+            existing = type(self)(path)
+            existing.extend(self, dedupe=dedupe)
+            existing.write(path, overwrite="overwrite")
+            return
+        existing.df = pd.read_sql_table(
+            "df", engine, columns=["index"] + list(existing.par_cols)
+        ).set_index("index")
+        existing._check_compatible(self)
+        keep, labels = existing._extension_rows(
+            existing.df.index, existing.df, self, dedupe=dedupe
+        )
+        rows = self.df[keep]
+        old_labels = rows.index
+        rows = rows.set_axis(labels, axis=0)
+        rows.to_sql("df", engine, if_exists="append")
+        existing._extend_md(self, old_labels, labels)
+        existing._write_md(engine, existing.md)
+
+    def _restore_grid_columns(self) -> None:
+        """ Restore the parameter columns that were saved as the axes of the
+        grid (see :meth:`write`).
+        """
+        if "grid_axes" not in self.md:
+            return
+        config = self.md.pop("grid_axes")
+        axes = [config["axes"][param] for param in config["params"]]
+        values = np.meshgrid(*axes, indexing="ij")
+        df = self.df
+        for param, value in zip(config["params"], values):
+            df[param] = value.reshape(-1)
+        self.df = df[config["columns"]]
+
     # --------------------------------------------------------------------------
     # Renaming clusters
     # --------------------------------------------------------------------------
@@ -613,6 +1324,41 @@ class Data(DFMD):
                 "Unsupported type ({}) for argument.".format(type(arg))
             )
 
+    def _factorize_clusters(self, column: str, sort=False):
+        """ Split a column into its unique values and the position of the
+        value of each row among them.
+
+        Args:
+            column: Column with the cluster names
+            sort: Sort the unique values
+
+        Returns:
+            Tuple of the list of unique values and an integer array of codes
+        """
+        codes, uniques = pd.factorize(self.df[column], sort=sort)
+        uniques = list(uniques.tolist())
+        missing = codes < 0
+        if missing.any():
+            codes = codes.copy()
+            codes[missing] = len(uniques)
+            uniques.append(np.nan)
+        return uniques, codes
+
+    def _set_renamed_clusters(self, new_names: list, codes, column: str):
+        """ Write cluster names to a column.
+
+        Args:
+            new_names: New name for every unique value
+            codes: Position of the value of every row in ``new_names``
+            column: Column to write to
+
+        Returns:
+            None
+        """
+        self.df[column] = pd.Series(new_names).to_numpy()[codes]
+        self._invalidate_cache()
+        self._apply_dtypes([column])
+
     def _rename_clusters_dict(self, old2new, column="cluster", new_column=None):
         """Renames the clusters. This also allows to merge several
         get_clusters by assigning them the same name.
@@ -624,17 +1370,16 @@ class Data(DFMD):
             new_column: Write out as a new column with name `new_columns`,
                 e.g. when merging get_clusters with this method
         """
-        clusters_old_unique = self.df[column].unique()
+        if not new_column:
+            new_column = column
+        uniques, codes = self._factorize_clusters(column)
         # If a key doesn't appear in old2new, this means we don't change it.
-        for cluster in clusters_old_unique:
-            if cluster not in old2new:
-                old2new[cluster] = cluster
-        self._rename_clusters_func(
-            lambda name: old2new[name], column, new_column
-        )
+        new_names = [old2new.get(cluster, cluster) for cluster in uniques]
+        self._set_renamed_clusters(new_names, codes, new_column)
 
     def _rename_clusters_func(self, funct, column="cluster", new_column=None):
-        """Apply method to cluster names.
+        """Apply method to cluster names. The function is only evaluated once
+        for every distinct cluster name.
 
         Example:  Suppose your get_clusters are numbered from 1 to 10, but you
         want to start counting at 0:
@@ -654,9 +1399,9 @@ class Data(DFMD):
         """
         if not new_column:
             new_column = column
-        self.df[new_column] = [
-            funct(cluster) for cluster in self.df[column].values
-        ]
+        uniques, codes = self._factorize_clusters(column)
+        new_names = [funct(cluster) for cluster in uniques]
+        self._set_renamed_clusters(new_names, codes, new_column)
 
     def _rename_clusters_auto(self, column="cluster", new_column=None):
         """Try to name get_clusters in a way that doesn't depend on the
@@ -673,10 +1418,13 @@ class Data(DFMD):
         Returns:
             None
         """
-        old_cluster_names = sorted(list(self.df[column].unique()))
-        new_cluster_names = range(len(old_cluster_names))
-        old2new = dict(zip(old_cluster_names, new_cluster_names))
-        self.rename_clusters(old2new, column, new_column)
+        if not new_column:
+            new_column = column
+        uniques, codes = self._factorize_clusters(column, sort=True)
+        # The codes of the sorted unique values are already the new names
+        self.df[new_column] = codes.astype(np.int64)
+        self._invalidate_cache()
+        self._apply_dtypes([new_column])
 
     # **************************************************************************
     # Quick plots
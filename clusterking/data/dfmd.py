@@ -6,9 +6,20 @@ import json
 import logging
 import pandas as pd
 from pathlib import PurePath, Path
-from typing import Union, Optional
+from typing import (
+    Union,
+    Optional,
+    Callable,
+    Dict,
+    Any,
+    List,
+    Sequence,
+    Tuple,
+)
+import weakref
 
 # 3rd
+import numpy as np
 import sqlalchemy
 
 # ours
@@ -17,10 +28,131 @@ from clusterking.util.log import get_logger
 from clusterking.util.cli import handle_overwrite
 
 
+def _pandas_copy_on_write() -> bool:
+    """ Are copy-on-write semantics enabled in pandas? In this case, (shallow)
+    copies of dataframes only copy the data once either of them is modified.
+    This is always the case for pandas >= 3.0 and can be enabled with
+    ``pd.options.mode.copy_on_write = True`` for pandas >= 1.5.
+    """
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    try:
+        return pd.options.mode.copy_on_write is True
+    except (AttributeError, KeyError):
+        return False
+
+
+#: Key that marks a reference to a numpy array in the JSON representation of
+#: the metadata (see :func:`_extract_arrays`)
+_ARRAY_REFERENCE = "__array__"
+
+
+def _extract_arrays(md, path="") -> Tuple[Any, Dict[str, np.ndarray]]:
+    """ Replace all numpy arrays in (nested) metadata by references, so that
+    they can be stored in binary form rather than as JSON lists.
+
+    Args:
+        md: Metadata
+        path: Path of ``md`` in the metadata (keys joined by ``/``)
+
+    Returns:
+        Tuple of the metadata with the references and a dictionary that maps
+        the references to the arrays.
+    """
+    if isinstance(md, np.ndarray):
+        return {_ARRAY_REFERENCE: path}, {path: md}
+    if isinstance(md, dict):
+        new = {}
+        arrays = {}
+        for key, value in md.items():
+            subpath = "{}/{}".format(path, key) if path else str(key)
+            new[key], subarrays = _extract_arrays(value, subpath)
+            arrays.update(subarrays)
+        return new, arrays
+    return md, {}
+
+
+def _metadata_depends(md) -> List[Any]:
+    """ Describe (nested) metadata by objects for the ``depends`` argument of
+    :meth:`DFMD._cached`: The JSON representation of the metadata without
+    its numpy arrays and the arrays themselves, which are compared by
+    identity (arrays in the metadata are replaced rather than modified in
+    place).
+
+    Args:
+        md: Metadata
+
+    Returns:
+        List
+    """
+    md, arrays = _extract_arrays(md)
+    keys = sorted(arrays)
+    return [json.dumps([md, keys], sort_keys=True, default=str)] + [
+        arrays[key] for key in keys
+    ]
+
+
+def _insert_arrays(md, arrays: Dict[str, np.ndarray]):
+    """ Inverse of :func:`_extract_arrays`. """
+    if isinstance(md, dict):
+        if set(md.keys()) == {_ARRAY_REFERENCE}:
+            return arrays[md[_ARRAY_REFERENCE]]
+        return {key: _insert_arrays(value, arrays) for key, value in md.items()}
+    return md
+
+
+class _IdentityToken(object):
+    """ Compares equal to another token if both were built from the same
+    objects: Hashable objects (e.g. strings and numbers) are compared by
+    value, all other objects (e.g. numpy arrays) by identity. Only weak
+    references to the latter are kept where possible, so that a token never
+    compares equal after an object was garbage collected.
+    """
+
+    def __init__(self, objects: Sequence[Any]):
+        self._values = []
+        for obj in objects:
+            try:
+                hash(obj)
+            except TypeError:
+                try:
+                    obj = weakref.ref(obj)
+                except TypeError:
+                    # Can't be weakly referenced, keep a strong reference
+                    obj = (lambda _obj: lambda: _obj)(obj)
+                self._values.append((True, obj))
+            else:
+                self._values.append((False, obj))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, _IdentityToken):
+            return NotImplemented
+        if len(self._values) != len(other._values):
+            return False
+        for (by_id, value), (other_by_id, other_value) in zip(
+            self._values, other._values
+        ):
+            if by_id != other_by_id:
+                return False
+            if by_id:
+                obj = value()
+                if obj is None or obj is not other_value():
+                    return False
+            elif type(value) is not type(other_value) or value != other_value:
+                return False
+        return True
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+
 class DFMD(object):
     """ DFMD = DataFrame with MetaData.
     This class bundles a pandas dataframe together with metadata and
     provides methods to save and load such an object.
+
+    Numpy arrays in the metadata are written in binary form to a separate
+    table rather than as part of the JSON representation of the metadata.
     """
 
     def __init__(
@@ -41,7 +173,14 @@ class DFMD(object):
         #: This will hold all the configuration that we will write out
         self.md = None
         #: :py:class:`pandas.DataFrame` to hold all of the results
-        self.df = None  # type: Optional[pd.DataFrame]
+        #: (access via :attr:`df`)
+        self._df = None  # type: Optional[pd.DataFrame]
+        #: Function without arguments that returns the dataframe. If set,
+        #: the dataframe is only created once it is accessed the first time
+        #: (see :meth:`_set_lazy_df`).
+        self._df_loader = None  # type: Optional[Callable[[], pd.DataFrame]]
+        #: Quantities derived from the dataframe (see :meth:`_cached`)
+        self._cache = {}  # type: Dict[Any, Tuple[pd.Index, Any, Any]]
         #: Instance of :py:class:`logging.Logger`
         self.log = None
 
@@ -67,6 +206,149 @@ class DFMD(object):
                 "Unsupported type '{}' for 'log' argument.".format(type(log))
             )
 
+    # **************************************************************************
+    # Dataframe
+    # **************************************************************************
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """ :py:class:`pandas.DataFrame` to hold all of the results """
+        if self._df is None and self._df_loader is not None:
+            self._df = self._df_loader()
+            self._df_loader = None
+        return self._df
+
+    @df.setter
+    def df(self, value: pd.DataFrame) -> None:
+        self._df = value
+        self._df_loader = None
+        self._invalidate_cache()
+
+    def _set_lazy_df(self, loader: Callable[[], pd.DataFrame]) -> None:
+        """ Do not set the dataframe right away, but only create it when it
+        is first accessed.
+
+        Args:
+            loader: Function without arguments that returns the dataframe
+
+        Returns:
+            None
+        """
+        self._df = None
+        self._df_loader = loader
+        self._invalidate_cache()
+
+    def _column_buffers(self, columns: List[str]) -> List[Any]:
+        """ The objects that hold the data of some columns of the dataframe
+        (for numpy columns the base array of the values). Assigning to a
+        column (e.g. ``d.df["a"] += 1`` with copy-on-write semantics) or
+        sorting the dataframe replaces these objects, so that they can be
+        used to detect such modifications without looking at the data.
+        """
+        buffers = []
+        for column in columns:
+            values = self.df[column].values
+            while isinstance(values, np.ndarray) and isinstance(
+                values.base, np.ndarray
+            ):
+                values = values.base
+            buffers.append(values)
+        return buffers
+
+    def _cache_token(
+        self, columns: Optional[List[str]], depends: Sequence[Any]
+    ) -> _IdentityToken:
+        """ Token that describes the state that a cached quantity is built
+        from (see :meth:`_cached`). """
+        objects = list(depends)
+        if columns is not None:
+            objects.extend(self._column_buffers(columns))
+        return _IdentityToken(objects)
+
+    def _cached(
+        self,
+        key,
+        build: Callable[[], Any],
+        columns: Optional[List[str]] = None,
+        depends: Sequence[Any] = (),
+    ) -> Any:
+        """ Return a quantity that is derived from the dataframe, building it
+        only if it is not already cached.
+
+        The cache is cleared whenever a new dataframe is set. Entries are
+        rebuilt if the index of the dataframe was replaced (e.g. by sorting
+        the dataframe in place), if the columns that the quantity was built
+        from were replaced (e.g. ``d.df["a"] += 1`` with copy-on-write
+        semantics in pandas) or if one of the objects that it depends on
+        changed. The checks only compare the identity of the objects (and
+        not their content), so that they are cheap. Other in-place
+        modifications of the dataframe (e.g. ``d.df.loc[0, "a"] = 1``) are
+        not detected, call :meth:`_invalidate_cache` after them.
+
+        Args:
+            key: Hashable key of the quantity
+            build: Function without arguments that builds the quantity
+            columns: Columns that the quantity is built from
+            depends: Further objects that the quantity is built from. Numpy
+                arrays and other unhashable objects are compared by identity,
+                everything else by value.
+
+        Returns:
+            The quantity
+        """
+        if self._is_cached(key, columns, depends):
+            return self._cache[key][2]
+        value = build()
+        self._set_cached(key, value, columns=columns, depends=depends)
+        return value
+
+    def _is_cached(
+        self,
+        key,
+        columns: Optional[List[str]] = None,
+        depends: Sequence[Any] = (),
+    ) -> bool:
+        """ Is a quantity cached by :meth:`_cached` and still valid? """
+        if key not in self._cache:
+            return False
+        cached_index, token, _ = self._cache[key]
+        if cached_index is not self.df.index:
+            return False
+        return token == self._cache_token(columns, depends)
+
+    def _get_cached(
+        self,
+        key,
+        columns: Optional[List[str]] = None,
+        depends: Sequence[Any] = (),
+    ) -> Any:
+        """ Return a quantity cached by :meth:`_cached` if it is still valid,
+        else ``None`` (without building it).
+        """
+        if self._is_cached(key, columns, depends):
+            return self._cache[key][2]
+        return None
+
+    def _set_cached(
+        self,
+        key,
+        value,
+        columns: Optional[List[str]] = None,
+        depends: Sequence[Any] = (),
+    ) -> None:
+        """ Put a quantity that is derived from the current dataframe into the
+        cache of :meth:`_cached`.
+        """
+        self._cache[key] = (
+            self.df.index,
+            self._cache_token(columns, depends),
+            value,
+        )
+
+    def _invalidate_cache(self) -> None:
+        """ Clear all quantities cached by :meth:`_cached`. """
+        self._cache = {}
+
     # **************************************************************************
     # Loading
     # **************************************************************************
@@ -87,8 +369,34 @@ class DFMD(object):
         engine = sqlalchemy.create_engine("sqlite:///" + str(path.resolve()))
         self.df = pd.read_sql_table("df", engine)
         self.df.set_index("index", inplace=True)
+        self.md = self._read_md(path)
+
+    @staticmethod
+    def _read_md(path: Union[str, PurePath]) -> dict:
+        """ Read only the metadata from an input file as created by
+        :py:meth:`~clusterking.data.DFMD.write`.
+
+        Args:
+            path: Path to input file
+
+        Returns:
+            Metadata as nested dictionary
+        """
+        path = Path(path)
+        engine = sqlalchemy.create_engine("sqlite:///" + str(path.resolve()))
         md_json = pd.read_sql_table("md", engine)["md"][0]
-        self.md = turn_into_nested_dict(json.loads(md_json))
+        md = json.loads(md_json)
+        # Files written with older versions don't have this table
+        if "md_arrays" in sqlalchemy.inspect(engine).get_table_names():
+            arrays = {}
+            for row in pd.read_sql_table("md_arrays", engine).itertuples():
+                arrays[row.key] = (
+                    np.frombuffer(row.data, dtype=row.dtype)
+                    .reshape(json.loads(row.shape))
+                    .copy()
+                )
+            md = _insert_arrays(md, arrays)
+        return turn_into_nested_dict(md)
 
     # **************************************************************************
     # Writing
@@ -105,6 +413,28 @@ class DFMD(object):
                 (raise Exception if file exists).
                 Default is 'ask'.
 
+        Returns:
+            None
+        """
+        self._write(path, self.df, self.md, overwrite=overwrite)
+
+    def _write(
+        self,
+        path: Union[str, PurePath],
+        df: pd.DataFrame,
+        md: dict,
+        overwrite="ask",
+    ) -> None:
+        """ Write a dataframe and metadata to an output file (see
+        :meth:`write`). Subclasses can use this to write a different
+        representation of their content.
+
+        Args:
+            path: Path to output file
+            df: Dataframe
+            md: Metadata
+            overwrite: See :meth:`write`
+
         Returns:
             None
         """
@@ -115,15 +445,54 @@ class DFMD(object):
             path.parent.mkdir(parents=True)
 
         engine = sqlalchemy.create_engine("sqlite:///" + str(path))
-        self.df.to_sql("df", engine, if_exists="replace")
+        df.to_sql("df", engine, if_exists="replace")
+        self._write_md(engine, md)
+
+    @staticmethod
+    def _write_md(engine, md: dict) -> None:
+        """ Write (only) the metadata to a database.
+
+        Args:
+            engine: :class:`sqlalchemy.engine.Engine`
+            md: Metadata
+
+        Returns:
+            None
+        """
         # todo: perhaps it's better to use pickle in the future?
-        md_json = json.dumps(self.md, sort_keys=True, indent=4)
+        md, arrays = _extract_arrays(md)
+        md_json = json.dumps(md, sort_keys=True, indent=4)
         md_df = pd.DataFrame({"md": [md_json]})
         md_df.to_sql("md", engine, if_exists="replace")
+        arrays_df = pd.DataFrame(
+            {
+                "key": list(arrays.keys()),
+                "dtype": [array.dtype.str for array in arrays.values()],
+                "shape": [json.dumps(array.shape) for array in arrays.values()],
+                "data": [
+                    np.ascontiguousarray(array).tobytes()
+                    for array in arrays.values()
+                ],
+            },
+            columns=["key", "dtype", "shape", "data"],
+        )
+        arrays_df.to_sql(
+            "md_arrays",
+            engine,
+            if_exists="replace",
+            dtype={"data": sqlalchemy.LargeBinary},
+        )
 
     def copy(self, deep=True, data=True, memo=None):
         """ Make a copy of this object.
 
+        If pandas uses copy-on-write semantics (always the case for
+        pandas >= 3.0), a deep copy does not copy the dataframe right away:
+        Both objects share the same data until one of them is modified.
+        A dataframe that has not been loaded yet (e.g. for the results of
+        :meth:`clusterking.data.Data.fix_param`) is also not loaded by
+        copying. Read-only numpy arrays in the metadata are shared as well.
+
         Args:
             deep: Make a deep copy (default True). If this is disabled, any
                 change to the copy will also affect the original.
@@ -135,13 +504,27 @@ class DFMD(object):
         """
         new = type(self)()
         if data:
-            if deep:
+            if deep and self._df is None and self._df_loader is not None:
+                # The loader creates a new dataframe every time, so we can
+                # simply share it.
+                new._set_lazy_df(self._df_loader)
+            elif deep and _pandas_copy_on_write():
+                new.df = self.df.copy(deep=False)
+            elif deep:
                 # Pycharm doesn't seem to recognize the memo argument:
                 # noinspection PyArgumentList
                 new.df = copy.deepcopy(self.df, memo)
             else:
                 new.df = copy.copy(self.df)
         if deep:
+            if memo is None:
+                memo = {}
+            # Read-only arrays can't be modified, so they can be shared
+            # rather than copied
+            _, arrays = _extract_arrays(self.md)
+            for array in arrays.values():
+                if not array.flags.writeable:
+                    memo[id(array)] = array
             # noinspection PyArgumentList
             new.md = copy.deepcopy(self.md, memo)
         else:
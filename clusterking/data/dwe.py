@@ -2,16 +2,21 @@
 
 # 3rd
 import numpy as np
-from typing import List, Optional, Dict, Any
+import pandas as pd
+from typing import List, Optional, Dict, Any, Iterator, Tuple
 
 # ours
 from clusterking.data.data import Data
 from clusterking.maths.statistics import (
-    cov2err,
     cov2corr,
     abs2rel_cov,
     corr2cov,
 )
+from clusterking.maths.covariance import (
+    StructuredCovariance,
+    chunk_size_from_memory,
+)
+from clusterking.data.dfmd import _metadata_depends
 
 
 class DataWithErrors(Data):
@@ -43,10 +48,15 @@ class DataWithErrors(Data):
             + &\\sum_k\\mathrm{Cov}_{\\text{abs}}^{(k)}(i, j) + \\\\
             + &\\delta_{ij} \\sqrt{d^{(n)}_i d^{(n)}_j} / \\sqrt{s}
 
-    .. note::
-        All of these methods add the errors in a consistent way for all sample
-        points/distributions, i.e. it is impossible to add a certain error
-        specifically to one sample point only!
+    If the errors (or correlations, covariance matrices) that are passed to
+    these methods are given for every sample point (i.e. with an additional
+    first axis of length ``self.n``), they are stored separately for each
+    sample point instead. Such errors can also be given as low rank factors
+    (:meth:`add_err_factor`, :meth:`add_rel_err_factor`), which is the most
+    compact form if the covariance matrices are estimated from a small number
+    of variations. Errors per sample point are stored together with the index
+    of the dataframe, so that they stay attached to the right sample points
+    when taking subsets of the data.
 
     Afterwards, you can get errors, correlation and covariance matrices for
     every data point by using one of the methods such as
@@ -64,12 +74,20 @@ class DataWithErrors(Data):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Initialize some values to their default
+        # Initialize some values to their default unless they were loaded
+        # from a file
         # [Defined as properties, documented below]
-        self.rel_cov = None
-        self.abs_cov = None
-        self.poisson_errors = False
-        self.poisson_errors_scale = 1.0
+        errors = self.md["errors"]
+        self.rel_cov = errors.get("rel_cov")
+        self.abs_cov = errors.get("abs_cov")
+        self.poisson_errors = errors.get("poisson", False)
+        self.poisson_errors_scale = errors.get("poisson_scale", 1.0)
+        for term in errors.get("points", {}).values():
+            # Errors per sample point are never modified in place, which
+            # allows to share them between copies (see DFMD.copy)
+            for value in term.values():
+                if isinstance(value, np.ndarray):
+                    value.setflags(write=False)
 
     # **************************************************************************
     # Properties
@@ -96,13 +114,17 @@ class DataWithErrors(Data):
                 return np.zeros((self.nbins, self.nbins))
             else:
                 return None
-        return np.array(value)
+        if not isinstance(value, np.ndarray):
+            # E.g. if the metadata was set manually
+            value = np.array(value, dtype=float)
+            self.md["errors"]["rel_cov"] = value
+        return value
 
     @rel_cov.setter
     def rel_cov(self, value):
-        if isinstance(value, np.ndarray):
-            # convert to list in order to serialize
-            value = value.tolist()
+        if value is not None:
+            # The array is stored in binary form when writing the data
+            value = np.array(value, dtype=float)
         self.md["errors"]["rel_cov"] = value
 
     @property
@@ -126,13 +148,17 @@ class DataWithErrors(Data):
                 return np.zeros((self.nbins, self.nbins))
             else:
                 return None
-        return np.array(value)
+        if not isinstance(value, np.ndarray):
+            # E.g. if the metadata was set manually
+            value = np.array(value, dtype=float)
+            self.md["errors"]["abs_cov"] = value
+        return value
 
     @abs_cov.setter
     def abs_cov(self, value):
-        if isinstance(value, np.ndarray):
-            # convert to list in order to serialize
-            value = value.tolist()
+        if value is not None:
+            # The array is stored in binary form when writing the data
+            value = np.array(value, dtype=float)
         self.md["errors"]["abs_cov"] = value
 
     @property
@@ -158,6 +184,151 @@ class DataWithErrors(Data):
     # Internal helper functions
     # **************************************************************************
 
+    def _compatibility_md(self) -> Dict[str, Any]:
+        md = super()._compatibility_md()
+        errors = self.md.get("errors")
+        if errors is not None:
+            # Errors per sample point are different for different sample
+            # points, so they are not part of this
+            errors = {
+                key: value for key, value in errors.items() if key != "points"
+            }
+        md["errors"] = errors
+        return md
+
+    def _fingerprint_depends(self) -> List[Any]:
+        # The errors per sample point in _fingerprint_md are built from the
+        # metadata every time, so we use the metadata itself.
+        return _metadata_depends(super()._fingerprint_md()) + list(
+            self._errors_depends()
+        )
+
+    def _fingerprint_md(self) -> Dict[str, Any]:
+        md = super()._fingerprint_md()
+        md["point_errors"] = [
+            {key: value for key, value in term.items() if key != "index"}
+            for term in self._point_error_terms()
+        ]
+        return md
+
+    def _point_error_terms(self) -> List[Dict[str, Any]]:
+        """ Errors that were added per sample point, aligned with the rows of
+        the dataframe. Sample points for which the errors were not given, get
+        zero errors.
+
+        Returns:
+            List of dictionaries with the keys ``relative`` and either
+            ``factor``, ``err`` and ``corr`` or ``cov``.
+        """
+        terms = []
+        for term in self.md.get("errors", {}).get("points", {}).values():
+            positions = pd.Index(term["index"]).get_indexer(self.df.index)
+            aligned = len(term["index"]) == len(positions) and np.array_equal(
+                positions, np.arange(len(positions))
+            )
+            missing = positions < 0
+            new_term = {}
+            for key, value in term.items():
+                if self._is_per_point(key, value) and not aligned:
+                    value = value[np.maximum(positions, 0)]
+                    value[missing] = 0.0
+                new_term[key] = value
+            terms.append(new_term)
+        return terms
+
+    @staticmethod
+    def _is_per_point(key: str, value) -> bool:
+        """ Is this entry of a term of errors per sample point (see
+        :meth:`_add_point_errors`) given for every sample point? """
+        return key in ["factor", "err", "cov"] or (
+            key == "corr" and value.ndim == 3
+        )
+
+    def _add_point_errors(self, relative: bool, **arrays) -> None:
+        """ Add errors that differ between the sample points.
+
+        Args:
+            relative: Are the errors relative to the bin contents?
+            **arrays: ``factor`` or ``err`` and ``corr`` or ``cov``
+
+        Returns:
+            None
+        """
+        if not self.df.index.is_unique:
+            raise ValueError(
+                "Errors per sample point can only be added if the index of "
+                "the dataframe is unique."
+            )
+        term = {"index": np.array(self.df.index), "relative": relative}
+        term.update(arrays)
+        for value in term.values():
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+        points = self.md["errors"]["points"]
+        points[str(len(points))] = term
+
+    def _extension_rows(self, index, params, other, dedupe=True):
+        # Errors per sample point might still be stored for rows that were
+        # removed, so new rows must not reuse their labels.
+        for term in self.md.get("errors", {}).get("points", {}).values():
+            index = index.append(pd.Index(term["index"]))
+        return super()._extension_rows(index, params, other, dedupe=dedupe)
+
+    def _extend_md(
+        self, other: Data, old_labels: pd.Index, new_labels: pd.Index
+    ) -> None:
+        super()._extend_md(other, old_labels, new_labels)
+        # Errors that are the same for all sample points agree, so we only
+        # need to take over the errors per sample point of the added rows
+        # (with the new index labels).
+        for term in other.md.get("errors", {}).get("points", {}).values():
+            positions = pd.Index(old_labels).get_indexer(term["index"])
+            selected = positions >= 0
+            if not selected.any():
+                continue
+            new_term = {}
+            for key, value in term.items():
+                if key == "index":
+                    value = np.asarray(new_labels)[positions[selected]]
+                elif self._is_per_point(key, value):
+                    value = value[selected]
+                if isinstance(value, np.ndarray):
+                    value.setflags(write=False)
+                new_term[key] = value
+            points = self.md["errors"]["points"]
+            points[str(len(points))] = new_term
+
+    def _extended_cache(
+        self, other: Data, keep: np.ndarray, labels: np.ndarray
+    ):
+        cache = super()._extended_cache(other, keep, labels)
+        if list(self.df[self.bin_cols].dtypes) != list(
+            other.df[self.bin_cols].dtypes
+        ):
+            # Errors calculated from the bin contents would differ slightly
+            return cache
+        for relative in [False, True]:
+            err = self._get_cached(
+                ("err", relative),
+                columns=self.bin_cols,
+                depends=self._errors_depends(),
+            )
+            if err is None:
+                continue
+            err = np.concatenate([err, other.err(relative)[keep]])
+            err.setflags(write=False)
+            cache.append(
+                (("err", relative), err, self.bin_cols, self._errors_depends)
+            )
+        return cache
+
+    def _errors_depends(self) -> List[Any]:
+        """ The error configuration as objects that results which depend on
+        it are cached with (see :meth:`_cached` and
+        :func:`~clusterking.data.dfmd._metadata_depends`).
+        """
+        return _metadata_depends(self.md.get("errors", {}))
+
     def _interpret_input(self, inpt, what: str) -> np.ndarray:
         """ Interpret user input
 
@@ -174,6 +345,8 @@ class DataWithErrors(Data):
                 return np.tile(inpt, self.nbins)
             if inpt.ndim == 1:
                 return inpt
+            if inpt.ndim == 2 and inpt.shape == (self.n, self.nbins):
+                return inpt
             else:
                 raise ValueError(
                     "Wrong dimension ({}) of {} array.".format(inpt.ndim, what)
@@ -181,6 +354,19 @@ class DataWithErrors(Data):
         elif what.lower() in ["corr", "cov"]:
             if inpt.ndim == 2:
                 return inpt
+            if inpt.ndim == 3 and inpt.shape[0] == self.n:
+                return inpt
+            else:
+                raise ValueError(
+                    "Wrong dimension ({}) of {} array.".format(inpt.ndim, what)
+                )
+        elif what.lower() in ["factor"]:
+            if inpt.ndim == 1:
+                return inpt.reshape((self.nbins, 1))
+            if inpt.ndim == 2:
+                return inpt
+            if inpt.ndim == 3 and inpt.shape[:2] == (self.n, self.nbins):
+                return inpt
             else:
                 raise ValueError(
                     "Wrong dimension ({}) of {} array.".format(inpt.ndim, what)
@@ -192,6 +378,58 @@ class DataWithErrors(Data):
     # Actual calculations
     # **************************************************************************
 
+    def structured_cov(self) -> StructuredCovariance:
+        """ Return the covariance matrices of all sample points as a
+        :class:`~clusterking.maths.covariance.StructuredCovariance` object.
+        This object only holds the different contributions to the
+        covariance matrix, so that it can be used for large datasets where
+        the ``self.n x self.nbins x self.nbins`` array of :meth:`cov`
+        would be too large.
+
+        Returns:
+            :class:`~clusterking.maths.covariance.StructuredCovariance`
+        """
+        # Normal poisson errors are sqrt(data_i). What happens if
+        # data is normalized from N to N', i.e.
+        #   Sum(data_normalized) = N'?
+        # Let N/N' = scale
+        # Then the errors should be
+        #   sqrt(data) / scale = sqrt(data/scale) / sqrt(scale) =
+        #   = sqrt(data_normalized) / sqrt(scale)
+        # Hence the variance is data_normalized / scale.
+        poisson_scale = None
+        if self.poisson_errors:
+            poisson_scale = self.poisson_errors_scale
+        # Always calculate with 64 bit precision (see Data.set_dtypes)
+        data = self.data().astype(np.float64, copy=False)
+        point_factors = []
+        point_corrs = []
+        point_covs = []
+        for term in self._point_error_terms():
+            if term["relative"]:
+                scale = data
+            else:
+                scale = 1.0
+            if "factor" in term:
+                point_factors.append(term["factor"] * np.atleast_3d(scale))
+            elif "err" in term:
+                point_corrs.append((term["err"] * scale, term["corr"]))
+            else:
+                point_covs.append(
+                    term["cov"]
+                    * np.atleast_3d(scale)
+                    * np.atleast_3d(scale).swapaxes(1, 2)
+                )
+        return StructuredCovariance(
+            data,
+            abs_cov=self.md["errors"]["abs_cov"],
+            rel_cov=self.md["errors"]["rel_cov"],
+            poisson_scale=poisson_scale,
+            point_factors=point_factors,
+            point_corrs=point_corrs,
+            point_covs=point_covs,
+        )
+
     def cov(self, relative=False) -> np.ndarray:
         """ Return covariance matrix :math:`\\mathrm{Cov}(d^{(n)}_i, d^{(n)}_j)`
 
@@ -205,54 +443,153 @@ class DataWithErrors(Data):
         Returns:
             ``self.n x self.nbins x self.nbins`` array
         """
-
-        data = self.data()
-        cov = np.tile(self.abs_cov, (self.n, 1, 1))
-        cov += np.einsum("ij,ki,kj->kij", self.rel_cov, data, data)
-        if self.poisson_errors:
-            cov += corr2cov(
-                np.tile(np.eye(self.nbins), (self.n, 1, 1)),
-                # Normal poisson errors are sqrt(data_i). What happens if
-                # data is normalized from N to N', i.e.
-                #   Sum(data_normalized) = N'?
-                # Let N/N' = scale
-                # Then the errors should be
-                #   sqrt(data) / scale = sqrt(data/scale) / sqrt(scale) =
-                #   = sqrt(data_normalized) / sqrt(scale)
-                # Hence:
-                np.sqrt(data) / np.sqrt(self.poisson_errors_scale),
-            )
-
+        cov = self.structured_cov().dense()
         if not relative:
             return cov
         else:
-            return abs2rel_cov(cov, data)
+            return abs2rel_cov(cov, self.data())
 
-    def corr(self) -> np.ndarray:
+    def corr(self, chunk_size: Optional[int] = None, max_memory=None):
         """ Return correlation matrix. If covariance matrix is empty (because
         no errors have been added), a unit matrix is returned.
 
+        Args:
+            chunk_size: Calculate the correlation matrices for this many
+                sample points at a time (see :meth:`iter_corr`)
+            max_memory: Alternatively: Memory budget for the temporary arrays
+                in bytes
+
         Returns:
             ``self.n x self.nbins x self.nbins`` array
         """
-        if np.sum(np.abs(self.cov())) == 0.0:
-            return np.tile(np.eye(self.nbins), (self.n, 1, 1))
-        return cov2corr(self.cov())
+        corr = np.empty((self.n, self.nbins, self.nbins))
+        for rows, block in self.iter_corr(
+            chunk_size=chunk_size, max_memory=max_memory
+        ):
+            corr[rows] = block
+        return corr
+
+    def iter_cov(
+        self, chunk_size: Optional[int] = None, max_memory=None, relative=False
+    ) -> Iterator[Tuple[slice, np.ndarray]]:
+        """ Iterate over the covariance matrices (see :meth:`cov`) in chunks
+        of consecutive sample points, so that the full
+        ``self.n x self.nbins x self.nbins`` array is never built.
+
+        Example:
+
+        .. code-block:: python
+
+            for rows, cov in dwe.iter_cov(max_memory=500e6):
+                # cov is a (rows.stop - rows.start) x nbins x nbins array
+                ...
+
+        Args:
+            chunk_size: Number of sample points per chunk
+            max_memory: Maximal size of one chunk in bytes (only used if
+                ``chunk_size`` is not given). If neither is given, everything
+                is returned in one chunk.
+            relative: See :meth:`cov`
+
+        Yields:
+            Tuples ``(rows, cov)`` of the slice of the rows (positions in the
+            dataframe) and the array of the covariance matrices
+        """
+        if chunk_size is None:
+            chunk_size = chunk_size_from_memory(
+                self.nbins, max_memory, n_arrays=2 if relative else 1
+            )
+        if relative:
+            data = self.data().astype(np.float64, copy=False)
+        for rows, block in self.structured_cov().iter_blocks(chunk_size):
+            if relative:
+                yield rows, abs2rel_cov(block, data[rows])
+            else:
+                yield rows, block
+
+    def iter_corr(
+        self, chunk_size: Optional[int] = None, max_memory=None
+    ) -> Iterator[Tuple[slice, np.ndarray]]:
+        """ Iterate over the correlation matrices (see :meth:`corr`) in
+        chunks of consecutive sample points.
+
+        Args:
+            chunk_size: Number of sample points per chunk
+            max_memory: Maximal size of the temporary arrays in bytes (only
+                used if ``chunk_size`` is not given)
+
+        Yields:
+            Tuples ``(rows, corr)`` of the slice of the rows (positions in the
+            dataframe) and the array of the correlation matrices
+        """
+        cov = self.structured_cov()
+        if chunk_size is None:
+            # Covariance and correlation matrices of one chunk
+            chunk_size = chunk_size_from_memory(
+                self.nbins, max_memory, n_arrays=2
+            )
+        for rows, block in cov.iter_blocks(chunk_size=chunk_size):
+            if cov.is_zero:
+                yield rows, np.tile(np.eye(self.nbins), (len(block), 1, 1))
+            else:
+                yield rows, cov2corr(block)
+
+    def iter_err(
+        self, relative=False, chunk_size: Optional[int] = None
+    ) -> Iterator[Tuple[slice, np.ndarray]]:
+        """ Iterate over the errors (see :meth:`err`) in chunks of
+        consecutive sample points. Unlike :meth:`err`, nothing is cached.
+
+        Args:
+            relative: See :meth:`err`
+            chunk_size: Number of sample points per chunk. If not given,
+                everything is returned in one chunk.
+
+        Yields:
+            Tuples ``(rows, err)`` of the slice of the rows (positions in the
+            dataframe) and the ``len(rows) x self.nbins`` array of errors
+        """
+        cov = self.structured_cov()
+        if chunk_size is None:
+            chunk_size = max(self.n, 1)
+        if chunk_size <= 0:
+            raise ValueError("chunk_size has to be an integer >= 1.")
+        if relative:
+            data = self.data().astype(np.float64, copy=False)
+        for start in range(0, self.n, chunk_size):
+            rows = slice(start, min(start + chunk_size, self.n))
+            err = np.sqrt(cov.diagonal(rows))
+            if relative:
+                err /= data[rows]
+            yield rows, err
 
     def err(self, relative=False) -> np.ndarray:
         """ Return errors per bin, i.e.
         :math:`e_i^{(n)} = \\sqrt{\\mathrm{Cov}(d^{(n)}_i, d^{(n)}_i)}`
 
+        The result is cached until the data or the error configuration is
+        changed, so the returned array is read-only.
+
         Args:
             relative: Relative errors, i.e. :math:`e_i^{(n)}/d_i^{(n)}`
 
         Returns:
             ``self.n x self.nbins`` array
         """
-        if not relative:
-            return cov2err(self.cov())
-        else:
-            return cov2err(self.cov()) / self.data()
+
+        def build():
+            err = np.sqrt(self.structured_cov().diagonal())
+            if relative:
+                err /= self.data().astype(np.float64, copy=False)
+            err.setflags(write=False)
+            return err
+
+        return self._cached(
+            ("err", relative),
+            build,
+            columns=self.bin_cols,
+            depends=self._errors_depends(),
+        )
 
     # **************************************************************************
     # Configuration
@@ -268,6 +605,7 @@ class DataWithErrors(Data):
         self.abs_cov = None
         self.poisson_errors = False
         self.poisson_errors_scale = 1
+        self.md["errors"].pop("points", None)
 
     # -------------------------------------------------------------------------
     # Add absolute errors
@@ -282,7 +620,10 @@ class DataWithErrors(Data):
                 for all data points)
         """
         cov = self._interpret_input(cov, "cov")
-        self.abs_cov += cov
+        if cov.ndim == 3:
+            self._add_point_errors(False, cov=cov)
+        else:
+            self.abs_cov += cov
 
     def add_err_corr(self, err, corr) -> None:
         """ Add error from errors vector and correlation matrix.
@@ -296,7 +637,11 @@ class DataWithErrors(Data):
         """
         err = self._interpret_input(err, "err")
         corr = self._interpret_input(corr, "corr")
-        self.add_err_cov(corr2cov(corr, err))
+        if err.ndim == 2 or corr.ndim == 3:
+            err = np.array(np.broadcast_to(err, (self.n, self.nbins)))
+            self._add_point_errors(False, err=err, corr=corr)
+        else:
+            self.add_err_cov(corr2cov(corr, err))
 
     def add_err_uncorr(self, err) -> None:
         """
@@ -320,6 +665,24 @@ class DataWithErrors(Data):
         corr = np.ones((self.nbins, self.nbins))
         self.add_err_corr(err, corr)
 
+    def add_err_factor(self, factor) -> None:
+        """ Add error from a (low rank) factor :math:`F` of the covariance
+        matrix :math:`\\mathrm{Cov} = F F^T`. For example, if the
+        distributions were recalculated with ``r`` variations of nuisance
+        parameters, the columns of :math:`F` could be the differences to the
+        nominal distribution divided by :math:`\\sqrt{r - 1}`.
+
+        Args:
+            factor: ``self.n x self.nbins x r`` array of factors for each data
+                point or ``self.nbins x r`` factor (if equal for all data
+                points)
+        """
+        factor = self._interpret_input(factor, "factor")
+        if factor.ndim == 3:
+            self._add_point_errors(False, factor=factor)
+        else:
+            self.add_err_cov(factor @ factor.T)
+
     # -------------------------------------------------------------------------
     # Add relative errors
     # -------------------------------------------------------------------------
@@ -332,7 +695,10 @@ class DataWithErrors(Data):
             cov: see argument of :py:meth:`.add_err_cov`
         """
         cov = self._interpret_input(cov, "cov")
-        self.rel_cov += cov
+        if cov.ndim == 3:
+            self._add_point_errors(True, cov=cov)
+        else:
+            self.rel_cov += cov
 
     def add_rel_err_corr(self, err, corr) -> None:
         """
@@ -344,7 +710,11 @@ class DataWithErrors(Data):
         """
         err = self._interpret_input(err, "err")
         corr = self._interpret_input(corr, "corr")
-        self.add_rel_err_cov(corr2cov(corr, err))
+        if err.ndim == 2 or corr.ndim == 3:
+            err = np.array(np.broadcast_to(err, (self.n, self.nbins)))
+            self._add_point_errors(True, err=err, corr=corr)
+        else:
+            self.add_rel_err_cov(corr2cov(corr, err))
 
     def add_rel_err_uncorr(self, err) -> None:
         """
@@ -369,6 +739,19 @@ class DataWithErrors(Data):
         corr = np.ones((self.nbins, self.nbins))
         self.add_rel_err_corr(err, corr)
 
+    def add_rel_err_factor(self, factor) -> None:
+        """ Add error from a (low rank) factor of the relative covariance
+        matrix.
+
+        Args:
+            factor: see argument of :py:meth:`.add_err_factor`
+        """
+        factor = self._interpret_input(factor, "factor")
+        if factor.ndim == 3:
+            self._add_point_errors(True, factor=factor)
+        else:
+            self.add_rel_err_cov(factor @ factor.T)
+
     # -------------------------------------------------------------------------
     # Other forms of errors
     # -------------------------------------------------------------------------
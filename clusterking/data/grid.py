@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# std
+from typing import List, Optional, Dict, Any
+
+# 3rd
+import numpy as np
+
+
+class GridView(object):
+    """ View of the sample points of a :class:`~clusterking.data.Data` object
+    that form a complete cartesian grid in parameter space (as created by
+    :meth:`clusterking.scan.Scanner.set_spoints_equidist` or
+    :meth:`clusterking.scan.Scanner.set_spoints_grid`).
+
+    The grid is described by the sorted values of every parameter (the axes)
+    and an N-dimensional array holding the position of the row of every grid
+    point in the dataframe. Columns, bin contents or clusters can therefore be
+    retrieved as N-dimensional arrays and slices or neighbours of grid points
+    are found by indexing.
+
+    This object is usually not initialized by the user, but retrieved from
+    :meth:`clusterking.data.Data.grid`.
+    """
+
+    def __init__(self, params: List[str], axes: List[np.ndarray], rows):
+        """ Initialize grid view.
+
+        Args:
+            params: Names of the parameters
+            axes: Sorted values of every parameter
+            rows: N-dimensional integer array of the positions of the rows of
+                all grid points in the dataframe (axes in the order of
+                ``params``)
+        """
+        #: Names of the parameters that span the grid
+        self.params = list(params)
+        #: Sorted values of every parameter
+        self.axes = [np.asarray(axis) for axis in axes]
+        #: For every grid point the position of its row in the dataframe
+        self.rows = np.asarray(rows)
+        if self.rows.shape != self.shape:
+            raise ValueError(
+                "Shape of rows {} doesn't match the axes {}.".format(
+                    self.rows.shape, self.shape
+                )
+            )
+        # Position of every row in the flattened grid (built on demand)
+        self._grid_positions = None  # type: Optional[np.ndarray]
+
+    @classmethod
+    def from_codes(
+        cls, params: List[str], axes: List[np.ndarray], codes: List[np.ndarray]
+    ) -> Optional["GridView"]:
+        """ Build grid view from the position of the parameter value of
+        every row on every axis (e.g. from
+        :class:`~clusterking.data.param_index.ParamIndex`).
+
+        Args:
+            params: Names of the parameters
+            axes: Sorted values of every parameter
+            codes: For every parameter the position of the value of every row
+                in the corresponding axis
+
+        Returns:
+            :class:`GridView` or ``None`` if the rows do not form a complete
+            grid
+        """
+        shape = tuple(len(axis) for axis in axes)
+        n = len(codes[0]) if codes else 0
+        if int(np.prod(shape)) != n:
+            return None
+        if not params:
+            return cls(params, axes, np.zeros(shape, int))
+        flat = np.ravel_multi_index(tuple(codes), shape)
+        rows = np.full(n, -1, int)
+        rows[flat] = np.arange(n)
+        if (rows < 0).any():
+            # Some grid points appear twice and others not at all
+            return None
+        return cls(params, axes, rows.reshape(shape))
+
+    # **************************************************************************
+    # Properties
+    # **************************************************************************
+
+    @property
+    def shape(self):
+        """ Number of values of every parameter """
+        return tuple(len(axis) for axis in self.axes)
+
+    @property
+    def ndim(self) -> int:
+        """ Number of parameters """
+        return len(self.params)
+
+    @property
+    def is_ordered(self) -> bool:
+        """ Are the rows of the dataframe in the (C) order of the grid? """
+        return bool(np.array_equal(self.rows.reshape(-1), np.arange(self.n)))
+
+    @property
+    def n(self) -> int:
+        """ Number of grid points """
+        return self.rows.size
+
+    def axis(self, param: str) -> np.ndarray:
+        """ Sorted values of a parameter """
+        return self.axes[self._param_position(param)]
+
+    def _param_position(self, param: str) -> int:
+        try:
+            return self.params.index(param)
+        except ValueError:
+            raise ValueError(
+                "Parameter '{}' is not part of the grid {}.".format(
+                    param, self.params
+                )
+            )
+
+    # **************************************************************************
+    # Selection
+    # **************************************************************************
+
+    def locate(self, **values) -> tuple:
+        """ Index tuple into the grid arrays that fixes some parameters to
+        the grid values closest to the requested ones.
+
+        Args:
+            **values: ``{parameter name: value}``
+
+        Returns:
+            Tuple of integers (fixed parameters) and slices (all other
+            parameters)
+        """
+        index = [slice(None)] * self.ndim  # type: List[Any]
+        for param, value in values.items():
+            i = self._param_position(param)
+            index[i] = int(np.argmin(np.abs(self.axes[i] - value)))
+        return tuple(index)
+
+    def select(self, **values) -> np.ndarray:
+        """ Positions of the rows with some parameters fixed to the grid
+        values closest to the requested ones, as an array with one
+        dimension per free parameter.
+
+        Args:
+            **values: ``{parameter name: value}``
+
+        Returns:
+            Integer array of row positions
+        """
+        return self.rows[self.locate(**values)]
+
+    def neighbours(self, row: int) -> np.ndarray:
+        """ Positions of the rows of the grid points that are adjacent to the
+        grid point of a row (differing by one step along one axis).
+
+        Args:
+            row: Position of the row in the dataframe
+
+        Returns:
+            Integer array of row positions
+        """
+        if not 0 <= row < self.n:
+            raise ValueError("Row {} is not part of the grid.".format(row))
+        if self._grid_positions is None:
+            self._grid_positions = np.empty(self.n, int)
+            self._grid_positions[self.rows.reshape(-1)] = np.arange(self.n)
+        point = np.array(
+            np.unravel_index(self._grid_positions[row], self.shape)
+        )
+        neighbours = []
+        for axis, size in enumerate(self.shape):
+            for step in (-1, 1):
+                other = point.copy()
+                other[axis] += step
+                if 0 <= other[axis] < size:
+                    neighbours.append(self.rows[tuple(other)])
+        return np.array(neighbours, dtype=int)
+
+    # **************************************************************************
+    # Tensors
+    # **************************************************************************
+
+    def tensor(self, values: np.ndarray) -> np.ndarray:
+        """ Arrange values that are given for every row on the grid.
+
+        Args:
+            values: Array with the rows along the first axis
+
+        Returns:
+            Array of shape ``shape + values.shape[1:]``
+        """
+        return np.asarray(values)[self.rows]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Parameters and axes of the grid, e.g. to be saved in metadata. """
+        return {
+            "params": list(self.params),
+            "axes": dict(zip(self.params, self.axes)),
+        }
+
+    def __repr__(self):
+        return "GridView({})".format(
+            ", ".join(
+                "{}: {}".format(param, len(axis))
+                for param, axis in zip(self.params, self.axes)
+            )
+        )
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# std
+from typing import Iterable
+
+# 3rd
+import numpy as np
+
+
+class ParamIndex(object):
+    """ Index of the values of one parameter column of a
+    :class:`~clusterking.data.Data` object.
+
+    It holds the sorted unique values of the parameter and, for every row,
+    the position of its value in this list. Selections of rows by parameter
+    values can therefore be resolved with binary searches instead of
+    comparing every row with every requested value.
+
+    This object is usually not initialized by the user, but retrieved from
+    :meth:`clusterking.data.Data.param_index`.
+    """
+
+    def __init__(self, values: np.ndarray):
+        """ Build index.
+
+        Args:
+            values: Values of the parameter for all rows
+        """
+        values = np.asarray(values)
+        #: Sorted unique values of the parameter
+        self.values, codes = np.unique(values, return_inverse=True)
+        #: For every row the position of its value in :attr:`values`
+        self.codes = codes.reshape(-1)
+        # Posting lists (built on demand, see _postings)
+        self._order = None
+        self._bounds = None
+
+    @classmethod
+    def concatenate(cls, first: "ParamIndex", second: "ParamIndex"):
+        """ Index of the rows of two indizes after each other, built without
+        sorting all values again.
+
+        Args:
+            first: Index of the first rows
+            second: Index of the following rows
+
+        Returns:
+            :class:`ParamIndex`
+        """
+        new = cls(np.array([]))
+        new.values = np.union1d(first.values, second.values)
+        new.codes = np.concatenate(
+            [
+                np.searchsorted(new.values, first.values)[first.codes],
+                np.searchsorted(new.values, second.values)[second.codes],
+            ]
+        )
+        return new
+
+    def subset(self, selector: np.ndarray) -> "ParamIndex":
+        """ Index of a subset of the rows, built without sorting all values
+        again.
+
+        Args:
+            selector: Boolean mask or positions of the rows
+
+        Returns:
+            :class:`ParamIndex`
+        """
+        codes = self.codes[selector]
+        used = np.bincount(codes, minlength=len(self.values)) > 0
+        new = type(self)(np.array([]))
+        new.values = self.values[used]
+        new.codes = (np.cumsum(used) - 1)[codes]
+        return new
+
+    @property
+    def n(self) -> int:
+        """ Number of rows """
+        return len(self.codes)
+
+    def _postings(self):
+        if self._order is None:
+            self._order = np.argsort(self.codes, kind="stable")
+            self._bounds = np.searchsorted(
+                self.codes[self._order], np.arange(len(self.values) + 1)
+            )
+        return self._order, self._bounds
+
+    def rows(self, i: int) -> np.ndarray:
+        """ Positions of all rows where the parameter takes the value
+        ``values[i]`` (in increasing order).
+        """
+        order, bounds = self._postings()
+        return order[bounds[i] : bounds[i + 1]]
+
+    def nearest(self, value: float) -> int:
+        """ Position of the unique value that is closest to ``value`` (the
+        smaller one in case of a tie).
+        """
+        if len(self.values) == 0:
+            raise ValueError("No values available.")
+        i = np.searchsorted(self.values, value)
+        if i == 0:
+            return 0
+        if i == len(self.values):
+            return i - 1
+        if value - self.values[i - 1] <= self.values[i] - value:
+            return i - 1
+        return i
+
+    def close(self, value: float, rtol=1e-05, atol=1e-08) -> slice:
+        """ Positions of all unique values that are close to ``value`` in the
+        sense of :func:`numpy.isclose`.
+        """
+        tol = atol + rtol * abs(value)
+        return slice(
+            np.searchsorted(self.values, value - tol, side="left"),
+            np.searchsorted(self.values, value + tol, side="right"),
+        )
+
+    def locate(self, value: float) -> int:
+        """ Position of ``value`` in :attr:`values` or -1 if it is not one of
+        the values.
+        """
+        i = np.searchsorted(self.values, value)
+        if i < len(self.values) and self.values[i] == value:
+            return i
+        return -1
+
+    def mask(self, selected: np.ndarray) -> np.ndarray:
+        """ Convert a boolean mask on :attr:`values` to a boolean mask on the
+        rows.
+        """
+        return selected[self.codes]
+
+    def select_nearest(self, values: Iterable[float]) -> np.ndarray:
+        """ Boolean mask of all rows whose value is close to the value that
+        is nearest to one of the requested values (see
+        :meth:`clusterking.data.Data.fix_param`).
+        """
+        selected = np.full(len(self.values), False, bool)
+        for value in values:
+            selected[self.close(self.values[self.nearest(value)])] = True
+        return self.mask(selected)
+
+    def select_exact(self, value: float) -> np.ndarray:
+        """ Boolean mask of all rows where the parameter is equal to
+        ``value``.
+        """
+        selected = np.full(len(self.values), False, bool)
+        i = self.locate(value)
+        if i >= 0:
+            selected[i] = True
+        return self.mask(selected)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+# std
+import json
+import logging
+from pathlib import PurePath, Path
+from typing import Union, Optional, List, Dict, Any, Tuple
+
+# 3rd
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# ours
+from clusterking.data.data import Data
+from clusterking.data.dwe import DataWithErrors
+from clusterking.util.metadata import failsafe_serialize, nested_dict
+from clusterking.util.log import get_logger
+
+
+def _read_index(path: Union[str, PurePath]) -> pd.Index:
+    """ Read only the index of the dataframe from a file as created by
+    :py:meth:`~clusterking.data.DFMD.write`. """
+    engine = sqlalchemy.create_engine("sqlite:///" + str(Path(path).resolve()))
+    # Order by rowid, else sqlite returns the labels sorted (from the index
+    # of the table)
+    df = pd.read_sql_query('SELECT "index" FROM df ORDER BY rowid', engine)
+    return pd.Index(df["index"])
+
+
+class ShardedData(object):
+    """ A dataset that is split into several files ("shards") in one
+    directory. This is useful if a large scan is split over many (batch) jobs.
+
+    All shards are written as regular :class:`~clusterking.data.Data` files
+    (so they can also be opened individually). Additionally, a manifest file
+    (``manifest.json``) records the number of sample points and the
+    parameter ranges of each shard, as well as the part of the metadata that
+    has to agree between all shards (distribution function, binning,
+    parameter names, error configuration).
+
+    The shards can then be opened as one logical
+    :class:`~clusterking.data.Data` object with :meth:`load`. The shards are
+    only read (and concatenated) once the dataframe is actually accessed.
+    If a selection of the parameter space is given, only the shards that
+    could contain matching sample points are read.
+
+    Example:
+
+    .. code-block:: python
+
+        import clusterking as ck
+        from clusterking.data.sharded import ShardedData
+
+        # In every job: Write the results of the scan to a new shard
+        d = ck.Data()
+        s = ck.scan.Scanner()
+        ...
+        s.run(d).write()
+        ShardedData("/path/to/scan/").add(d)
+
+        # Later: Open everything as one Data object
+        d = ShardedData("/path/to/scan/").load()
+
+        # Only load the shards that contain sample points with
+        # 0 <= a <= 1
+        d = ShardedData("/path/to/scan/").load(a=(0, 1))
+
+    .. note::
+
+        The index of the dataframe of the loaded data is built from the
+        position of the shard and the position of the row within it, so that
+        it is the same for every selection.
+    """
+
+    #: Name of the manifest file
+    manifest_name = "manifest.json"
+
+    #: Data classes that can be stored as shards
+    _data_classes = {
+        "Data": Data,
+        "DataWithErrors": DataWithErrors,
+    }
+
+    def __init__(
+        self,
+        directory: Union[str, PurePath],
+        log: Optional[Union[str, logging.Logger]] = None,
+    ):
+        """ Initialize a :class:`ShardedData` object.
+
+        Args:
+            directory: Directory of the shards. If it does not exist yet, it
+                will be created once the first shard is added.
+            log: Optional: instance of :py:class:`logging.Logger` or name of
+                logger to be created
+        """
+        #: Directory of the shards
+        self.directory = Path(directory)
+
+        if isinstance(log, logging.Logger):
+            self.log = log
+        elif isinstance(log, str):
+            self.log = get_logger(log)
+        elif log is None:
+            self.log = get_logger("ShardedData")
+        else:
+            raise ValueError(
+                "Unsupported type '{}' for 'log' argument.".format(type(log))
+            )
+
+        #: Content of the manifest file
+        self._manifest = self._read_manifest()
+
+    # **************************************************************************
+    # Manifest
+    # **************************************************************************
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.directory / self.manifest_name
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if not self._manifest_path.is_file():
+            return {"data_class": None, "compatibility": None, "shards": []}
+        with self._manifest_path.open() as manifest_file:
+            return json.load(manifest_file)
+
+    def _write_manifest(self) -> None:
+        with self._manifest_path.open("w") as manifest_file:
+            json.dump(self._manifest, manifest_file, sort_keys=True, indent=4)
+
+    # **************************************************************************
+    # Properties
+    # **************************************************************************
+
+    @property
+    def shards(self) -> List[Dict[str, Any]]:
+        """ List of the manifest entries of all shards (dictionaries with the
+        keys ``file``, ``n`` and ``ranges``).
+        """
+        return self._manifest["shards"]
+
+    @property
+    def nshards(self) -> int:
+        """ Number of shards """
+        return len(self.shards)
+
+    @property
+    def n(self) -> int:
+        """ Total number of sample points in all shards """
+        return sum(shard["n"] for shard in self.shards)
+
+    @property
+    def par_cols(self) -> List[str]:
+        """ Names of the parameter columns (see
+        :attr:`clusterking.data.Data.par_cols`)
+        """
+        if self._manifest["compatibility"] is None:
+            return []
+        return self._manifest["compatibility"]["coeffs"]
+
+    # **************************************************************************
+    # Writing
+    # **************************************************************************
+
+    def _check_compatible(self, data: Data) -> None:
+        """ Raise :py:class:`ValueError` if data can't be added to the
+        shards that are already present. """
+        data_class = type(data).__name__
+        if data_class not in self._data_classes:
+            raise ValueError(
+                "Unsupported data class {}.".format(type(data).__name__)
+            )
+        compatibility = failsafe_serialize(data._compatibility_md())
+        if not self.shards:
+            self._manifest["data_class"] = data_class
+            self._manifest["compatibility"] = compatibility
+            return
+        if data_class != self._manifest["data_class"]:
+            raise ValueError(
+                "Can't add shard of type {} to shards of type {}.".format(
+                    data_class, self._manifest["data_class"]
+                )
+            )
+        existing = self._manifest["compatibility"]
+        differing = sorted(
+            key
+            for key in set(existing) | set(compatibility)
+            if existing.get(key) != compatibility.get(key)
+        )
+        if differing:
+            raise ValueError(
+                "The metadata of the new shard is not compatible with the "
+                "existing shards. The following entries differ: {}".format(
+                    ", ".join(differing)
+                )
+            )
+
+    def add_shard(self, data: Data) -> Path:
+        """ Write data object as a new shard.
+
+        Args:
+            data: :class:`~clusterking.data.Data` object
+
+        Returns:
+            Path to the newly written shard
+        """
+        self._check_compatible(data)
+        if not self.directory.is_dir():
+            self.log.debug("Creating directory '{}'.".format(self.directory))
+            self.directory.mkdir(parents=True)
+        i = self.nshards
+        while (self.directory / "shard_{:04d}.sql".format(i)).exists():
+            i += 1
+        path = self.directory / "shard_{:04d}.sql".format(i)
+        data.write(path, overwrite="raise")
+        ranges = {}
+        for col in data.par_cols:
+            values = data.df[col].values
+            if len(values):
+                ranges[col] = [float(np.min(values)), float(np.max(values))]
+            else:
+                ranges[col] = None
+        self.shards.append({"file": path.name, "n": data.n, "ranges": ranges})
+        self._write_manifest()
+        self.log.debug("Wrote shard {}.".format(path))
+        return path
+
+    def add(self, data: Data, shard_size: Optional[int] = None) -> List[Path]:
+        """ Add data object, splitting it up into several shards if requested.
+
+        Args:
+            data: :class:`~clusterking.data.Data` object
+            shard_size: Maximal number of sample points per shard. If
+                ``None`` (default), all sample points are written to one
+                shard.
+
+        Returns:
+            List of paths of the newly written shards
+        """
+        if shard_size is None or data.n <= shard_size:
+            return [self.add_shard(data)]
+        if shard_size <= 0:
+            raise ValueError("shard_size has to be an integer >= 1.")
+        paths = []
+        for start in range(0, data.n, shard_size):
+            shard = data.copy(data=False)
+            shard.df = data.df.iloc[start : start + shard_size]
+            paths.append(self.add_shard(shard))
+        return paths
+
+    # **************************************************************************
+    # Loading
+    # **************************************************************************
+
+    def _selected_shards(
+        self, ranges: Dict[str, Tuple[float, float]]
+    ) -> List[int]:
+        """ Indizes of all shards that can contain sample points in the
+        given parameter ranges. """
+        selected = []
+        for ishard, shard in enumerate(self.shards):
+            if shard["n"] == 0:
+                continue
+            touched = True
+            for param, (mini, maxi) in ranges.items():
+                shard_range = shard["ranges"][param]
+                if shard_range[1] < mini or shard_range[0] > maxi:
+                    touched = False
+                    break
+            if touched:
+                selected.append(ishard)
+        return selected
+
+    def _load_df(
+        self, ishards: List[int], ranges: Dict[str, Tuple[float, float]]
+    ) -> pd.DataFrame:
+        """ Read and concatenate the dataframes of the given shards and only
+        keep the rows in the given parameter ranges. """
+        offsets = np.cumsum([0] + [shard["n"] for shard in self.shards])
+        dfs = []
+        for ishard in ishards:
+            path = self.directory / self.shards[ishard]["file"]
+            df = Data(path).df
+            df.index = pd.RangeIndex(
+                offsets[ishard], offsets[ishard] + len(df), name="index"
+            )
+            selector = np.full(len(df), True, bool)
+            for param, (mini, maxi) in ranges.items():
+                values = df[param].values
+                selector &= (values >= mini) & (values <= maxi)
+            if not selector.all():
+                df = df[selector]
+            dfs.append(df)
+        return pd.concat(dfs)
+
+    def load(self, **kwargs) -> Data:
+        """ Open the shards as one :class:`~clusterking.data.Data` object
+        (or :class:`~clusterking.data.DataWithErrors` object if the shards
+        were written from such objects).
+        The dataframe is only read and concatenated once it is accessed.
+
+        Args:
+            **kwargs: Optional selection of parameter ranges:
+                ``<parameter name>=(min, max)`` (both inclusive). Only the
+                shards that can contain such sample points are read.
+
+        Returns:
+            :class:`~clusterking.data.Data` object. Its metadata is taken from
+            the first selected shard, except for the errors per sample point
+            of :class:`~clusterking.data.DataWithErrors` objects, which are
+            taken from all selected shards.
+        """
+        if not self.shards:
+            raise ValueError(
+                "No shards found in '{}'.".format(self.directory.resolve())
+            )
+        ranges = {}
+        for param, value in kwargs.items():
+            if param not in self.par_cols:
+                raise ValueError(
+                    "Unknown parameter '{}'. Available parameters: {}".format(
+                        param, ", ".join(self.par_cols)
+                    )
+                )
+            try:
+                mini, maxi = value
+            except (TypeError, ValueError):
+                raise ValueError(
+                    "Please specify the range of '{}' as (min, max).".format(
+                        param
+                    )
+                )
+            ranges[param] = (mini, maxi)
+
+        ishards = self._selected_shards(ranges)
+        if not ishards:
+            if not self.par_cols:
+                # Only happens if all shards are empty
+                raise ValueError(
+                    "None of the shards in '{}' contains sample points and "
+                    "there are no parameter columns to select on.".format(
+                        self.directory.resolve()
+                    )
+                )
+            # We still need the metadata (and columns), so we read the first
+            # shard and select nothing.
+            ishards = [0]
+            ranges = {self.par_cols[0]: (np.inf, -np.inf)}
+
+        data_class = self._data_classes[self._manifest["data_class"]]
+        data = data_class()
+        first_path = self.directory / self.shards[ishards[0]]["file"]
+        data.md = data._read_md(first_path)
+        if isinstance(data, DataWithErrors):
+            self._merge_point_errors(data, ishards)
+        data._set_lazy_df(lambda: self._load_df(ishards, ranges))
+        return data
+
+    def _merge_point_errors(
+        self, data: DataWithErrors, ishards: List[int]
+    ) -> None:
+        """ Take over the errors per sample point of all given shards, with
+        the index labels of the rows in the loaded dataframe (see
+        :meth:`_load_df`).
+        """
+        offsets = np.cumsum([0] + [shard["n"] for shard in self.shards])
+        data.md["errors"]["points"] = nested_dict()
+        for ishard in ishards:
+            path = self.directory / self.shards[ishard]["file"]
+            shard = DataWithErrors()
+            shard.md = shard._read_md(path)
+            if not shard.md.get("errors", {}).get("points"):
+                continue
+            old_labels = _read_index(path)
+            new_labels = pd.RangeIndex(
+                offsets[ishard], offsets[ishard] + len(old_labels)
+            )
+            data._extend_md(shard, old_labels, new_labels)
@@ -2,14 +2,17 @@
 
 # std
 from pathlib import Path
+import tempfile
 import unittest
 
 # 3rd
 import numpy as np
+import pandas as pd
 
 # ours
 from clusterking.util.testing import MyTestCase
 from clusterking.data.data import Data
+from clusterking.data.dfmd import _pandas_copy_on_write
 
 
 class TestData(MyTestCase):
@@ -72,6 +75,28 @@ class TestData(MyTestCase):
         )
         self.assertAlmostEqual(self.d.get_param_values("CT_bctaunutau")[1], 0.0)
 
+    def test_fingerprint(self):
+        d = self.d.copy()
+        fingerprint = d.fingerprint()
+        self.assertEqual(fingerprint, self.d.fingerprint())
+        # Other columns don't matter
+        d.df["new_column"] = 1
+        self.assertEqual(d.fingerprint(), fingerprint)
+        # In place modification of bins are detected
+        d.df[d.bin_cols[0]] *= 2
+        self.assertNotEqual(d.fingerprint(), fingerprint)
+        # The fingerprint is cached
+        self.assertTrue(
+            d._is_cached(
+                ("fingerprint",),
+                columns=d.bin_cols + d.par_cols,
+                depends=[d._row_hashes()] + d._fingerprint_depends(),
+            )
+        )
+        e = self.d.copy()
+        e.md["scan"]["dfunction"]["binning"] = [0, 1]
+        self.assertNotEqual(e.fingerprint(), fingerprint)
+
     def test_data_normed(self):
         self.assertAllClose(
             self.d.data(normalize=True), [[1 / 3, 2 / 3], [4 / 9, 5 / 9]]
@@ -228,6 +253,41 @@ class TestSubSample(MyTestCase):
         e = self.d.sample_param_random(n=5)
         self.assertEqual(e.n, 5)
 
+    def test_view(self):
+        e = self.d.view([0, 2, 5])
+        if _pandas_copy_on_write():
+            self.assertIsNone(e._df)
+        self.assertEqual(e.n, 3)
+        self.assertEqual(list(e.df.index), [0, 2, 5])
+        e = self.d.view(self.d.df["a"].values == 0)
+        self.assertEqual(e.n, 16)
+        with self.assertRaises(ValueError):
+            self.d.view(np.full(3, True))
+
+    def test_view_independent(self):
+        d = self.nd()
+        e = d.fix_param(a=0)
+        d.df["new_column"] = 1
+        self.assertNotIn("new_column", e.df.columns)
+        e.df["bin0"] = 1000
+        e.md["scan"]["spoints"]["coeffs"] = []
+        self.assertEqual(d.df["bin0"].max(), 62)
+        self.assertEqual(d.par_cols, ["a", "b", "c"])
+
+    def test_view_snapshot(self):
+        d = self.nd()
+        e = d.view([0, 2, 5])
+        d.df.iloc[0, 0] = 1000
+        d.df["bin0"] += 1
+        self.assertEqual(e.df.iloc[0, 0], self.d.df.iloc[0, 0])
+        self.assertEqual(list(e.df["bin0"]), list(self.d.df["bin0"][[0, 2, 5]]))
+
+    def test_copy_lazy(self):
+        e = self.d.fix_param(a=0).copy()
+        if _pandas_copy_on_write():
+            self.assertIsNone(e._df)
+        self.assertEqual(e.n, 16)
+
     def test_find_closest_spoints(self):
         self.assertAllClose(
             self.d.find_closest_spoints(point=dict(a=0, b=0, c=0), n=1)
@@ -252,6 +312,216 @@ class TestSubSample(MyTestCase):
             [[0, 0, 0], [0, 1, 0], [0, 1, 1], [0, 2, 0], [1, 1, 0]],
         )
 
+    def test_find_closest_spoints_scale(self):
+        # With a large scale for b, only points with b = 1 are close
+        closest = self.d.find_closest_spoints(
+            point=dict(a=0, b=1, c=0), n=3, scale=dict(b=100)
+        )
+        self.assertAllClose(closest.df["b"].values, [1, 1, 1])
+
+    def test_nearest_spoints(self):
+        points = np.array([[0, 0, 0], [0, 1, 0]])
+        distances, positions = self.d.nearest_spoints(points, k=5)
+        self.assertEqual(distances.shape, (2, 5))
+        for point, dist, pos in zip(points, distances, positions):
+            # Compare with brute force
+            brute = np.linalg.norm(
+                self.d.df[["a", "b", "c"]].values - point, axis=1
+            )
+            self.assertAllClose(dist, np.sort(brute)[:5])
+            self.assertAllClose(brute[pos], dist)
+
+    def test_nearest_spoints_too_many(self):
+        distances, positions = self.d.only_bpoints().nearest_spoints(
+            dict(a=0, b=0, c=0), k=self.d.n + 1
+        )
+        self.assertTrue(np.isinf(distances[0, -1]))
+
+    def test_spoints_within(self):
+        rows = self.d.spoints_within([[0, 0, 0], [0, 1, 0]], radius=1)
+        self.assertEqual([len(r) for r in rows], [4, 5])
+        self.assertAllClose(
+            sorted(self.d.df[["a", "b", "c"]].values[rows[0]].tolist()),
+            [[0, 0, 0], [0, 0, 1], [0, 1, 0], [1, 0, 0]],
+        )
+
+    def test_nearest_spoints_invalid(self):
+        with self.assertRaises(ValueError):
+            self.d.nearest_spoints(dict(a=0, b=0))
+        with self.assertRaises(ValueError):
+            self.d.nearest_spoints([0, 0])
+        with self.assertRaises(ValueError):
+            self.d.nearest_spoints([0, 0, 0], scale=dict(x=1))
+
+
+class TestExtend(MyTestCase):
+    def setUp(self):
+        path = Path(__file__).parent / "data" / "test.sql"
+        self.d = Data(path)
+        self.other = self.d.copy()
+        # One new and one existing sample point
+        self.other.df.iloc[1, 0] = 5.0
+        self.other.df.index = pd.RangeIndex(7, 9, name="index")
+
+    def test_extend(self):
+        d = self.d.copy()
+        d.extend(self.other)
+        self.assertEqual(d.n, 3)
+        self.assertEqual(d.df.index.tolist(), [0, 1, 2])
+        cols = d.par_cols + d.bin_cols
+        self.assertAllClose(
+            d.df[cols].values[2], self.other.df[cols].values[1]
+        )
+
+    def test_extend_no_dedupe(self):
+        d = self.d.copy()
+        d.extend(self.other, dedupe=False)
+        self.assertEqual(d.n, 4)
+        self.assertEqual(d.df.index.tolist(), [0, 1, 2, 3])
+
+    def test_extend_empty(self):
+        d = Data()
+        d.extend(self.d)
+        self.assertAllClose(d.data(), self.d.data())
+        self.assertEqual(d.par_cols, self.d.par_cols)
+
+    def test_extend_incompatible(self):
+        d = self.d.copy()
+        self.other.md["scan"]["dfunction"]["nbins"] = 5
+        with self.assertRaises(ValueError):
+            d.extend(self.other)
+
+    def test_extend_param_index(self):
+        d = self.d.copy()
+        col = d.par_cols[0]
+        d.param_index(col)
+        d.extend(self.other)
+        index = d.param_index(col)
+        # Was updated rather than rebuilt, but agrees with a rebuilt one
+        self.assertIs(d.param_index(col), index)
+        d._invalidate_cache()
+        self.assertAllClose(index.values, d.param_index(col).values)
+        self.assertEqual(
+            index.codes.tolist(), d.param_index(col).codes.tolist()
+        )
+
+    def test_extend_fingerprint(self):
+        d = self.d.copy()
+        d.fingerprint()
+        row_hashes = d._row_hashes()
+        d.extend(self.other)
+        columns = d.bin_cols + d.par_cols
+        # The row hashes were extended rather than rebuilt
+        extended = d._get_cached(("row_hashes",), columns=columns)
+        self.assertIsNotNone(extended)
+        self.assertEqual(extended[:-1].tolist(), row_hashes.tolist())
+        fingerprint = d.fingerprint()
+        self.assertIs(d._row_hashes(), extended)
+        # Agrees with the fingerprint built from scratch
+        e = Data()
+        e.md = d.copy(data=False).md
+        e.df = d.df.copy()
+        self.assertEqual(e.fingerprint(), fingerprint)
+        self.assertEqual(e._row_hashes().tolist(), extended.tolist())
+        d._invalidate_cache()
+        self.assertEqual(d.fingerprint(), fingerprint)
+
+    def test_append_to_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.sql"
+            self.d.append_to_file(path)
+            self.other.append_to_file(path)
+            self.other.append_to_file(path)
+            d = Data(path)
+        expected = self.d.copy()
+        expected.extend(self.other)
+        self.assertEqual(d.df.index.tolist(), [0, 1, 2])
+        cols = d.par_cols + d.bin_cols
+        self.assertAllClose(d.df[cols].values, expected.df[cols].values)
+
+
+class TestRenameClusters(MyTestCase):
+    def setUp(self):
+        self.d = Data()
+        self.d.df = pd.DataFrame(
+            {"bin0": np.arange(6.0), "cluster": [5, 3, 5, 7, 3, 3]}
+        )
+
+    def test_rename_clusters_auto(self):
+        self.d.rename_clusters()
+        self.assertEqual(self.d.df["cluster"].tolist(), [1, 0, 1, 2, 0, 0])
+
+    def test_rename_clusters_dict(self):
+        old2new = {5: 50, 7: 70}
+        self.d.rename_clusters(old2new, new_column="new")
+        self.assertEqual(self.d.df["new"].tolist(), [50, 3, 50, 70, 3, 3])
+        self.assertEqual(self.d.df["cluster"].tolist(), [5, 3, 5, 7, 3, 3])
+        # The dictionary of the caller is not modified
+        self.assertEqual(old2new, {5: 50, 7: 70})
+
+    def test_rename_clusters_func(self):
+        calls = []
+
+        def funct(cluster):
+            calls.append(cluster)
+            return "c{}".format(cluster)
+
+        self.d.rename_clusters(funct)
+        self.assertEqual(
+            self.d.df["cluster"].tolist(),
+            ["c5", "c3", "c5", "c7", "c3", "c3"],
+        )
+        # Only called once per cluster
+        self.assertEqual(sorted(calls), [3, 5, 7])
+
+    def test_rename_clusters_merge(self):
+        self.d.rename_clusters({5: 3})
+        self.assertEqual(self.d.df["cluster"].tolist(), [3, 3, 3, 7, 3, 3])
+
+
+class TestDtypes(MyTestCase):
+    def setUp(self):
+        path = Path(__file__).parent / "data" / "test_longer.sql"
+        self.d = Data(path)
+        self.d.df["cluster"] = np.arange(self.d.n) % 3 + 1
+        self.d.md["cluster"]["cluster"] = {}
+        self.d.df["bpoint"] = (np.arange(self.d.n) % 3 == 0).astype(int)
+        self.d.md["bpoint"]["bpoint"] = {}
+
+    def test_set_dtypes(self):
+        d = self.d.copy()
+        d.set_dtypes()
+        self.assertTrue((d.df[d.bin_cols].dtypes == np.float32).all())
+        self.assertEqual(d.df["cluster"].dtype, np.uint16)
+        self.assertEqual(d.df["bpoint"].dtype, bool)
+        self.assertEqual(d.md["dtypes"]["bins"], "float32")
+        # Calculations are still done with 64 bit precision
+        self.assertEqual(d.norms().dtype, np.float64)
+        self.assertEqual(d.data(normalize=True).dtype, np.float64)
+
+    def test_set_dtypes_categorical(self):
+        d = self.d.copy()
+        d.set_dtypes()
+        d.rename_clusters(lambda cluster: "c{}".format(cluster))
+        self.assertEqual(d.df["cluster"].dtype, "category")
+        self.assertEqual(d.clusters(), ["c1", "c2", "c3"])
+
+    def test_set_dtypes_invalid(self):
+        with self.assertRaises(ValueError):
+            self.d.set_dtypes(bins="float16")
+
+    def test_set_dtypes_load(self):
+        d = self.d.copy()
+        d.set_dtypes()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.sql"
+            d.write(path)
+            e = Data(path)
+        self.assertTrue((e.df[e.bin_cols].dtypes == np.float32).all())
+        self.assertEqual(e.df["cluster"].dtype, np.uint16)
+        self.assertEqual(e.df["bpoint"].dtype, bool)
+        self.assertAllClose(e.data(), d.data())
+
 
 if __name__ == "__main__":
     unittest.main()
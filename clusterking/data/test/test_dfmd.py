@@ -5,9 +5,69 @@ from pathlib import Path
 import tempfile
 import unittest
 
+# 3rd
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
 # ours
 from clusterking.util.testing import MyTestCase
-from clusterking.data.dfmd import DFMD
+from clusterking.data.dfmd import DFMD, _IdentityToken
+
+
+class TestIdentityToken(unittest.TestCase):
+    def test_equal(self):
+        a = np.arange(3)
+        self.assertEqual(
+            _IdentityToken(["x", 1, a]), _IdentityToken(["x", 1, a])
+        )
+        self.assertNotEqual(_IdentityToken(["x", a]), _IdentityToken(["y", a]))
+        # Arrays are compared by identity, not by content
+        self.assertNotEqual(_IdentityToken([a]), _IdentityToken([a.copy()]))
+        self.assertNotEqual(_IdentityToken([a]), _IdentityToken([a, a]))
+
+    def test_garbage_collected(self):
+        a = np.arange(3)
+        token = _IdentityToken([a])
+        del a
+        self.assertNotEqual(token, _IdentityToken([np.arange(3)]))
+
+
+class TestDFMDCache(unittest.TestCase):
+    def setUp(self):
+        self.d = DFMD()
+        self.d.df = pd.DataFrame({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+        self.calls = 0
+
+    def build(self):
+        self.calls += 1
+        return self.d.df["a"].sum()
+
+    def test_cached(self):
+        self.assertEqual(self.d._cached("sum", self.build, ["a"]), 3.0)
+        self.assertEqual(self.d._cached("sum", self.build, ["a"]), 3.0)
+        self.assertEqual(self.calls, 1)
+        # Replacing other columns does not invalidate the quantity
+        self.d.df["b"] = [5.0, 6.0]
+        self.d._cached("sum", self.build, ["a"])
+        self.assertEqual(self.calls, 1)
+        # Replacing the column does
+        self.d.df["a"] = [2.0, 3.0]
+        self.assertEqual(self.d._cached("sum", self.build, ["a"]), 5.0)
+        self.assertEqual(self.calls, 2)
+        self.d._invalidate_cache()
+        self.d._cached("sum", self.build, ["a"])
+        self.assertEqual(self.calls, 3)
+
+    def test_depends(self):
+        a = np.arange(3)
+        self.d._cached("sum", self.build, depends=["x", a])
+        self.d._cached("sum", self.build, depends=["x", a])
+        self.assertEqual(self.calls, 1)
+        self.d._cached("sum", self.build, depends=["x", a.copy()])
+        self.assertEqual(self.calls, 2)
+        self.d._cached("sum", self.build, depends=["y", a])
+        self.assertEqual(self.calls, 3)
 
 
 class TestDFMD(MyTestCase):
@@ -69,6 +129,25 @@ class TestDFMD(MyTestCase):
             dfmd_loaded = DFMD(Path(tmpdir) / "tmp_test.sql")
             self._compare_dfs(dfmd, dfmd_loaded)
 
+    def test_write_read_arrays(self):
+        dfmd = self.ndfmd()
+        array = np.arange(12, dtype=np.float32).reshape((3, 4))
+        dfmd.md["some"]["array"] = array
+        dfmd.md["some"]["list"] = [1, 2]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "tmp_test.sql"
+            dfmd.write(path)
+            # Arrays are not part of the JSON metadata
+            engine = sqlalchemy.create_engine("sqlite:///" + str(path))
+            md_json = pd.read_sql_table("md", engine)["md"][0]
+            self.assertNotIn("11.0", md_json)
+            dfmd_loaded = DFMD(path)
+        loaded = dfmd_loaded.md["some"]["array"]
+        self.assertIsInstance(loaded, np.ndarray)
+        self.assertEqual(loaded.dtype, np.float32)
+        self.assertAllClose(loaded, array)
+        self.assertEqual(dfmd_loaded.md["some"]["list"], [1, 2])
+
     def test_handle_overwrite(self):
         dfmd = DFMD()
         dfmd2 = self.ndfmd()
@@ -2,10 +2,12 @@
 
 # std
 from pathlib import Path
+import tempfile
 import unittest
 
 # 3rd
 import numpy as np
+import pandas as pd
 
 # ours
 from clusterking.util.testing import MyTestCase
@@ -135,6 +137,197 @@ class TestDataWithErrors(MyTestCase):
         self.assertAllClose(rel_err1, rel_err2 * 2)
 
     # --------------------------------------------------------------------------
+    def test_err_cached(self):
+        dwe = self.ndwe()
+        dwe.add_err_uncorr(1.0)
+        err = dwe.err()
+        self.assertIs(dwe.err(), err)
+        self.assertFalse(err.flags.writeable)
+        # Changing the error configuration invalidates the cache
+        dwe.add_err_poisson(100)
+        self.assertAllClose(
+            dwe.err(), np.sqrt(1 + np.array(self.data) / 100)
+        )
+        self.assertAllClose(
+            dwe.err(relative=True),
+            np.sqrt(1 + np.array(self.data) / 100) / np.array(self.data),
+        )
+        # Setting new data invalidates the cache
+        dwe.df = dwe.df * 2
+        self.assertAllClose(
+            dwe.err(), np.sqrt(1 + 2 * np.array(self.data) / 100)
+        )
+
+    def test_iter_cov(self):
+        dwe = self.ndwe()
+        dwe.add_err_uncorr(1.0)
+        dwe.add_rel_err_maxcorr(0.1)
+        dwe.add_err_poisson(100)
+        for relative in [False, True]:
+            cov = dwe.cov(relative=relative)
+            chunks = list(dwe.iter_cov(chunk_size=1, relative=relative))
+            self.assertEqual(len(chunks), dwe.n)
+            for rows, block in chunks:
+                self.assertAllClose(block, cov[rows])
+        # One 2x2 matrix of 64 bit floats has 32 bytes
+        self.assertEqual(len(list(dwe.iter_cov(max_memory=32))), 2)
+        self.assertEqual(len(list(dwe.iter_cov(max_memory=64))), 1)
+
+    def test_iter_corr(self):
+        dwe = self.ndwe()
+        self.assertAllClose(
+            dwe.corr(chunk_size=1), np.tile(np.eye(2), (2, 1, 1))
+        )
+        dwe.add_err_uncorr(1.0)
+        dwe.add_rel_err_maxcorr(0.1)
+        corr = dwe.corr()
+        self.assertAllClose(dwe.corr(chunk_size=1), corr)
+        for rows, block in dwe.iter_corr(max_memory=64):
+            self.assertAllClose(block, corr[rows])
+
+    def test_iter_err(self):
+        dwe = self.ndwe()
+        dwe.add_err_uncorr(1.0)
+        dwe.add_err_poisson(100)
+        for relative in [False, True]:
+            err = dwe.err(relative=relative)
+            chunks = list(dwe.iter_err(relative=relative, chunk_size=1))
+            self.assertEqual(len(chunks), dwe.n)
+            for rows, block in chunks:
+                self.assertAllClose(block, err[rows])
+
+    def test_write_read_errors(self):
+        dwe = self.ndwe()
+        dwe.add_err_cov([[4.0, 4.0], [4.0, 16.0]])
+        dwe.add_rel_err_uncorr(0.1)
+        dwe.add_err_poisson(10)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.sql"
+            dwe.write(path)
+            loaded = DataWithErrors(path)
+        self.assertIsInstance(loaded.md["errors"]["abs_cov"], np.ndarray)
+        self.assertAllClose(loaded.abs_cov, dwe.abs_cov)
+        self.assertAllClose(loaded.rel_cov, dwe.rel_cov)
+        self.assertTrue(loaded.poisson_errors)
+        self.assertEqual(loaded.poisson_errors_scale, 10)
+        self.assertAllClose(loaded.cov(), dwe.cov())
+        self.assertEqual(loaded.fingerprint(), dwe.fingerprint())
+
+    def test_read_errors_as_lists(self):
+        # Files written with older versions store the matrices as lists
+        dwe = self.ndwe()
+        dwe.md["errors"]["abs_cov"] = [[4.0, 4.0], [4.0, 16.0]]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.sql"
+            dwe.write(path)
+            loaded = DataWithErrors(path)
+        self.assertIsInstance(loaded.md["errors"]["abs_cov"], np.ndarray)
+        self.assertAllClose(loaded.err(), [[2.0, 4.0], [2.0, 4.0]])
+
+    def test_add_err_per_point(self):
+        dwe = self.ndwe()
+        err = np.array([[1.0, 2.0], [3.0, 4.0]])
+        dwe.add_err_uncorr(err)
+        # Not part of the uniform covariance matrix
+        self.assertAllClose(dwe.abs_cov, np.zeros((2, 2)))
+        self.assertAllClose(dwe.err(), err)
+        self.assertAllClose(dwe.cov(), [np.diag([1, 4]), np.diag([9, 16])])
+        dwe.add_err_cov(np.eye(2))
+        self.assertAllClose(dwe.err(), np.sqrt(np.square(err) + 1))
+
+    def test_extend_per_point(self):
+        dwe = self.ndwe()
+        dwe.add_err_uncorr(np.array([[1.0, 2.0], [3.0, 4.0]]))
+        other = self.ndwe()
+        other.df.iloc[:, 0] = [5.0, 6.0]
+        other.df.index = pd.RangeIndex(3, 5, name="index")
+        other.add_err_uncorr(np.array([[5.0, 6.0], [7.0, 8.0]]))
+        dwe.err()
+        dwe.extend(other)
+        self.assertEqual(dwe.df.index.tolist(), [0, 1, 2, 3])
+        err = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0], [7.0, 8.0]])
+        self.assertAllClose(dwe.err(), err)
+        dwe._invalidate_cache()
+        self.assertAllClose(dwe.err(), err)
+
+    def test_extend_incompatible_errors(self):
+        dwe = self.ndwe()
+        other = self.ndwe()
+        other.add_err_cov(np.eye(2))
+        with self.assertRaises(ValueError):
+            dwe.extend(other)
+
+    def test_extend_removed_labels(self):
+        dwe = self.ndwe()
+        dwe.add_err_uncorr(np.array([[1.0, 2.0], [3.0, 4.0]]))
+        dwe.df = dwe.df.iloc[:1]
+        other = self.ndwe()
+        other.df.iloc[:, 0] = [5.0, 6.0]
+        dwe.extend(other)
+        # Label 1 is still used by the errors of the removed row
+        self.assertEqual(dwe.df.index.tolist(), [0, 2, 3])
+        self.assertAllClose(dwe.err(), [[1.0, 2.0], [0.0, 0.0], [0.0, 0.0]])
+
+    def test_add_rel_err_per_point(self):
+        dwe = self.ndwe()
+        rel_err = np.array([[0.1, 0.2], [0.3, 0.4]])
+        dwe.add_rel_err_maxcorr(rel_err)
+        err = rel_err * np.array(self.data)
+        self.assertAllClose(dwe.err(), err)
+        self.assertAllClose(dwe.corr(), np.ones((2, 2, 2)))
+        self.assertAllClose(
+            dwe.cov(), np.einsum("ki,kj->kij", err, err),
+        )
+
+    def test_add_err_factor(self):
+        dwe = self.ndwe()
+        factor = np.array([[[1.0], [2.0]], [[0.0], [1.0]]])
+        dwe.add_err_factor(factor)
+        self.assertAllClose(
+            dwe.cov(), np.einsum("kir,kjr->kij", factor, factor)
+        )
+        dwe.add_rel_err_factor(np.array([0.1, 0.1]))
+        self.assertAllClose(dwe.rel_cov, 0.01 * np.ones((2, 2)))
+
+    def test_add_err_cov_per_point(self):
+        dwe = self.ndwe()
+        cov = np.array([[[4.0, 1.0], [1.0, 4.0]], [[1.0, 0.0], [0.0, 9.0]]])
+        dwe.add_err_cov(cov)
+        self.assertAllClose(dwe.cov(), cov)
+        self.assertAllClose(dwe.err(), [[2.0, 2.0], [1.0, 3.0]])
+
+    def test_err_per_point_subset(self):
+        dwe = self.ndwe()
+        dwe.add_err_uncorr(np.array([[1.0, 2.0], [3.0, 4.0]]))
+        subset = dwe.view([1])
+        self.assertAllClose(subset.err(), [[3.0, 4.0]])
+        # Errors per point are shared, not copied
+        self.assertIs(
+            subset.md["errors"]["points"]["0"]["err"],
+            dwe.md["errors"]["points"]["0"]["err"],
+        )
+        # Sample points without errors get zero errors
+        subset.df.index = [5]
+        self.assertAllClose(subset.err(), [[0.0, 0.0]])
+
+    def test_write_read_errors_per_point(self):
+        dwe = self.ndwe()
+        dwe.add_err_factor(np.ones((2, 2, 1)))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.sql"
+            dwe.write(path)
+            loaded = DataWithErrors(path)
+        self.assertAllClose(loaded.cov(), dwe.cov())
+        self.assertEqual(loaded.fingerprint(), dwe.fingerprint())
+        loaded.reset_errors()
+        self.assertAllClose(loaded.cov(), np.zeros((2, 2, 2)))
+
+    def test_fingerprint(self):
+        dwe = self.ndwe()
+        fingerprint = dwe.fingerprint()
+        dwe.add_err_poisson()
+        self.assertNotEqual(dwe.fingerprint(), fingerprint)
+
     def test_plot_dist_err(self):
         self.dwe.plot_dist_err()
 
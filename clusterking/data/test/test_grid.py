@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# std
+import itertools
+from pathlib import Path
+import tempfile
+import unittest
+
+# 3rd
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# ours
+from clusterking.util.testing import MyTestCase
+from clusterking.data.data import Data
+from clusterking.plots.plot_clusters import ClusterPlot
+
+
+class TestGridView(MyTestCase):
+    def setUp(self):
+        self.a = [0.0, 1.0, 2.0]
+        self.b = [-1.0, 1.0]
+        self.c = [5.0, 6.0, 7.0, 8.0]
+        points = np.array(list(itertools.product(self.a, self.b, self.c)))
+        self.d = Data()
+        self.d.df = pd.DataFrame(
+            {
+                "a": points[:, 0],
+                "b": points[:, 1],
+                "c": points[:, 2],
+                "bin0": points.sum(axis=1),
+                "bin1": points.prod(axis=1),
+                "cluster": (points[:, 0] + points[:, 2] > 7).astype(int),
+            }
+        )
+        self.d.md["dfunction"]["nbins"] = 2
+        self.d.md["scan"]["spoints"]["coeffs"] = ["a", "b", "c"]
+
+    def test_grid(self):
+        grid = self.d.grid()
+        self.assertEqual(grid.params, ["a", "b", "c"])
+        self.assertEqual(grid.shape, (3, 2, 4))
+        self.assertAllClose(grid.axis("c"), self.c)
+        self.assertTrue(grid.is_ordered)
+        self.assertIs(self.d.grid(), grid)
+
+    def test_tensor(self):
+        grid = self.d.grid()
+        bins = grid.tensor(self.d.data())
+        self.assertEqual(bins.shape, (3, 2, 4, 2))
+        self.assertAllClose(bins[2, 0, 1], [2.0 - 1.0 + 6.0, -12.0])
+
+    def test_shuffled(self):
+        d = self.d.copy()
+        d.df = d.df.sample(frac=1, random_state=0)
+        grid = d.grid()
+        self.assertFalse(grid.is_ordered)
+        self.assertAllClose(
+            grid.tensor(d.data()), self.d.grid().tensor(self.d.data())
+        )
+
+    def test_no_grid(self):
+        d = self.d.copy()
+        d.df = d.df.iloc[1:]
+        self.assertIsNone(d.grid())
+        d = self.d.copy()
+        d.df = pd.concat([d.df.iloc[1:], d.df.iloc[:1]])
+        d.df.iloc[0, 0] = 1.0
+        self.assertIsNone(d.grid())
+
+    def test_select(self):
+        grid = self.d.grid()
+        rows = grid.select(a=1.1, c=8)
+        self.assertEqual(rows.shape, (2,))
+        self.assertAllClose(self.d.df["a"].values[rows], [1.0, 1.0])
+        self.assertAllClose(self.d.df["b"].values[rows], self.b)
+        self.assertAllClose(self.d.df["c"].values[rows], [8.0, 8.0])
+        with self.assertRaises(ValueError):
+            grid.select(x=1)
+
+    def test_neighbours(self):
+        grid = self.d.grid()
+        row = grid.rows[1, 0, 0]
+        neighbours = grid.neighbours(row)
+        self.assertEqual(
+            sorted(neighbours.tolist()),
+            sorted(
+                [
+                    grid.rows[0, 0, 0],
+                    grid.rows[2, 0, 0],
+                    grid.rows[1, 1, 0],
+                    grid.rows[1, 0, 1],
+                ]
+            ),
+        )
+
+    def test_write_grid_axes(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.sql"
+            self.d.write(path, grid_axes=True)
+            engine = sqlalchemy.create_engine("sqlite:///" + str(path))
+            df = pd.read_sql_table("df", engine)
+            self.assertNotIn("a", df.columns)
+            self.assertIn("bin0", df.columns)
+            d = Data(path)
+        self.assertEqual(list(d.df.columns), list(self.d.df.columns))
+        self.assertAllClose(d.df.values, self.d.df.values)
+        self.assertNotIn("grid_axes", d.md)
+        self.assertNotIn("grid_axes", self.d.md)
+
+    def test_fill_matrix(self):
+        cp = ClusterPlot(self.d)
+        cp.draw_legend = False
+        cp._setup_all(["c", "a"])
+        grid = self.d.grid()
+        for isubplot in range(cp._nsubplots):
+            x, y, z = cp._fill_matrix_grid(grid, isubplot)
+            x_old, y_old, z_old = cp._fill_matrix(isubplot)
+            self.assertAllClose(x, x_old)
+            self.assertAllClose(z, z_old)
+
+
+if __name__ == "__main__":
+    unittest.main()
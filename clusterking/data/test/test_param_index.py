@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# std
+from pathlib import Path
+import unittest
+
+# 3rd
+import numpy as np
+
+# ours
+from clusterking.util.testing import MyTestCase
+from clusterking.data.data import Data
+from clusterking.data.param_index import ParamIndex
+
+
+class TestParamIndex(MyTestCase):
+    def setUp(self):
+        self.values = np.array([2.0, 0.0, 1.0, 2.0, 0.0, 2.0])
+        self.index = ParamIndex(self.values)
+
+    def test_values(self):
+        self.assertAllClose(self.index.values, [0.0, 1.0, 2.0])
+        self.assertAllClose(
+            self.index.values[self.index.codes], self.values
+        )
+
+    def test_rows(self):
+        self.assertEqual(self.index.rows(0).tolist(), [1, 4])
+        self.assertEqual(self.index.rows(1).tolist(), [2])
+        self.assertEqual(self.index.rows(2).tolist(), [0, 3, 5])
+
+    def test_nearest(self):
+        self.assertEqual(self.index.nearest(-10), 0)
+        self.assertEqual(self.index.nearest(0.5), 0)
+        self.assertEqual(self.index.nearest(0.6), 1)
+        self.assertEqual(self.index.nearest(1.9), 2)
+        self.assertEqual(self.index.nearest(100), 2)
+
+    def test_select(self):
+        self.assertEqual(
+            self.index.select_nearest([0.1, 1.7]).tolist(),
+            [True, True, False, True, True, True],
+        )
+        self.assertEqual(
+            self.index.select_exact(1.0).tolist(),
+            [False, False, True, False, False, False],
+        )
+        self.assertFalse(self.index.select_exact(1.5).any())
+
+    def test_subset(self):
+        subset = self.index.subset(np.array([0, 2, 3]))
+        self.assertAllClose(subset.values, [1.0, 2.0])
+        self.assertAllClose(subset.values[subset.codes], [2.0, 1.0, 2.0])
+
+    def test_concatenate(self):
+        other = ParamIndex(np.array([3.0, 1.0, 1.5]))
+        index = ParamIndex.concatenate(self.index, other)
+        expected = ParamIndex(np.concatenate([self.values, [3.0, 1.0, 1.5]]))
+        self.assertAllClose(index.values, expected.values)
+        self.assertEqual(index.codes.tolist(), expected.codes.tolist())
+
+
+class TestDataParamIndex(MyTestCase):
+    def setUp(self):
+        path = Path(__file__).parent / "data" / "test_longer.sql"
+        self.d = Data(path)
+
+    def test_cached(self):
+        index = self.d.param_index("a")
+        self.assertIs(self.d.param_index("a"), index)
+        self.assertAllClose(index.values, [0, 1, 2, 3])
+
+    def test_invalidated(self):
+        d = self.d.copy()
+        index = d.param_index("a")
+        d.df = d.df.iloc[:16]
+        self.assertIsNot(d.param_index("a"), index)
+        self.assertAllClose(d.param_index("a").values, [0])
+
+    def test_invalidated_sort(self):
+        d = self.d.copy()
+        d.param_index("c")
+        d.df.sort_values("c", inplace=True)
+        self.assertEqual(
+            d.param_index("c").codes.tolist(), sorted(d.df["c"].tolist())
+        )
+
+    def test_invalidated_column_write(self):
+        d = self.d.copy()
+        index = d.param_index("a")
+        d.param_index("b")
+        d.df["a"] += 100
+        self.assertAllClose(d.param_index("a").values, [100, 101, 102, 103])
+        self.assertIsNot(d.param_index("a"), index)
+        # Other columns keep their index
+        self.assertIs(d.param_index("b"), d.param_index("b"))
+        fixed = d.fix_param(a=101)
+        self.assertEqual(set(fixed.df["a"]), {101})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# std
+from pathlib import Path
+import tempfile
+import unittest
+
+# 3rd
+import numpy as np
+
+# ours
+from clusterking.util.testing import MyTestCase
+from clusterking.data.data import Data
+from clusterking.data.dwe import DataWithErrors
+from clusterking.data.sharded import ShardedData
+
+
+class TestShardedData(MyTestCase):
+    def setUp(self):
+        path = Path(__file__).parent / "data" / "test_longer.sql"
+        self.d = Data(path)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name) / "shards"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_add_load(self):
+        sd = ShardedData(self.dir)
+        paths = sd.add(self.d, shard_size=16)
+        self.assertEqual(len(paths), 4)
+        self.assertEqual(sd.nshards, 4)
+        self.assertEqual(sd.n, 64)
+        # Re-open from manifest
+        sd = ShardedData(self.dir)
+        self.assertEqual(sd.nshards, 4)
+        self.assertEqual(sd.par_cols, ["a", "b", "c"])
+        d = sd.load()
+        self.assertEqual(d.n, 64)
+        self.assertAllClose(d.data(), self.d.data())
+        self.assertEqual(list(d.df.index), list(range(64)))
+        self.assertEqual(d.par_cols, self.d.par_cols)
+
+    def test_load_lazy(self):
+        sd = ShardedData(self.dir)
+        sd.add(self.d, shard_size=16)
+        d = sd.load()
+        self.assertIsNone(d._df)
+        d.df
+        self.assertIsNotNone(d._df)
+
+    def test_load_selection(self):
+        sd = ShardedData(self.dir)
+        sd.add(self.d, shard_size=16)
+        # test_longer.sql is sorted by a, so every shard has one value of a
+        self.assertEqual(sd._selected_shards({"a": (0.5, 1.5)}), [1])
+        d = sd.load(a=(0.5, 1.5))
+        self.assertEqual(d.n, 16)
+        self.assertAllClose(d.get_param_values("a"), [1])
+        d = sd.load(a=(0.5, 1.5), b=(0, 0))
+        self.assertEqual(d.n, 4)
+        self.assertEqual(
+            list(d.df.index), list(self.d.df.index[self.d.df["a"] == 1][:4])
+        )
+        d = sd.load(a=(10, 11))
+        self.assertEqual(d.n, 0)
+        with self.assertRaises(ValueError):
+            sd.load(x=(0, 1))
+
+    def test_incompatible(self):
+        sd = ShardedData(self.dir)
+        sd.add(self.d)
+        e = self.d.copy()
+        e.md["scan"]["dfunction"]["binning"] = [0, 1, 2]
+        with self.assertRaises(ValueError):
+            sd.add(e)
+        self.assertEqual(ShardedData(self.dir).nshards, 1)
+
+    def test_point_errors(self):
+        dwe = DataWithErrors(Path(__file__).parent / "data" / "test_longer.sql")
+        # Shuffle the index, so that it differs from the one of the shards
+        dwe.df.index = dwe.df.index[::-1]
+        rng = np.random.RandomState(0)
+        dwe.add_err_uncorr(rng.uniform(1, 2, size=(dwe.n, dwe.nbins)))
+        dwe.add_err_poisson(100)
+        sd = ShardedData(self.dir)
+        sd.add(dwe, shard_size=16)
+        loaded = sd.load()
+        self.assertEqual(len(loaded.md["errors"]["points"]), 4)
+        self.assertAllClose(loaded.err(), dwe.err())
+        self.assertAllClose(loaded.cov(), dwe.cov())
+        selected = sd.load(a=(0.5, 1.5))
+        self.assertEqual(len(selected.md["errors"]["points"]), 1)
+        self.assertAllClose(selected.err(), dwe.err()[16:32])
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            ShardedData(self.dir).load()
+
+    def test_empty_no_params(self):
+        d = Data()
+        d.md["scan"]["spoints"]["coeffs"] = []
+        d.df = self.d.df[self.d.bin_cols].iloc[:0]
+        sd = ShardedData(self.dir)
+        sd.add(d)
+        self.assertEqual(sd.par_cols, [])
+        with self.assertRaises(ValueError):
+            sd.load()
+
+
+if __name__ == "__main__":
+    unittest.main()
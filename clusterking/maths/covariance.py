@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+
+""" Covariance matrices of many distributions that are not stored as one
+large array.
+"""
+
+# std
+from typing import Optional, Iterator, Tuple, List, Dict
+
+# 3rd
+import numpy as np
+
+
+def chunk_size_from_memory(
+    nbins: int, max_memory: Optional[float] = None, n_arrays=1
+) -> Optional[int]:
+    """ Number of ``nbins x nbins`` matrices (of 64 bit floats) that fit
+    into a memory budget.
+
+    Args:
+        nbins: Number of bins
+        max_memory: Memory budget in bytes. If ``None``, ``None`` is returned.
+        n_arrays: Number of such arrays that are held at the same time
+
+    Returns:
+        Number of matrices (at least 1) or ``None``
+    """
+    if max_memory is None:
+        return None
+    bytes_per_matrix = 8 * max(nbins, 1) ** 2 * n_arrays
+    return max(1, int(max_memory // bytes_per_matrix))
+
+
+class StructuredCovariance(object):
+    """ Covariance matrices of ``n`` distributions :math:`d^{(k)}` with
+    ``nbins`` bins each, that are of the form
+
+    .. math::
+
+        \\mathrm{Cov}^{(k)}_{ij} = \\mathrm{Cov}_{\\text{abs}}(i, j)
+            + \\mathrm{Cov}_{\\text{rel}}(i, j) \\cdot d^{(k)}_i d^{(k)}_j
+            + \\delta_{ij} d^{(k)}_i / s
+
+    (see :class:`~clusterking.data.DataWithErrors`) plus contributions that
+    differ for every distribution. These are given in one of three compact
+    forms:
+
+    * Low rank factors :math:`F^{(k)}` (``n x nbins x r`` arrays), which
+      contribute :math:`F^{(k)} {F^{(k)}}^T`
+    * Errors :math:`e^{(k)}` (``n x nbins``) with a correlation matrix
+      :math:`C` (shared ``nbins x nbins`` or ``n x nbins x nbins``), which
+      contribute :math:`e^{(k)}_i C_{ij} e^{(k)}_j`
+    * Full covariance matrices (``n x nbins x nbins``)
+
+    Only the components are stored, so that the memory footprint is
+    ``O(n * nbins + nbins^2)`` rather than ``O(n * nbins^2)``. Dense
+    covariance matrices are only built for the sample points that are
+    requested:
+
+    .. code-block:: python
+
+        cov = dwe.structured_cov()
+        cov[3]  # nbins x nbins covariance matrix of the 4th sample point
+        cov[:10]  # 10 x nbins x nbins array
+        cov.diagonal()  # n x nbins array of variances
+        for rows, block in cov.iter_blocks(max_memory=1e9):
+            ...
+
+    Args:
+        data: ``n x nbins`` array of the bin contents
+        abs_cov: ``nbins x nbins`` absolute covariance matrix or ``None``
+            (zero)
+        rel_cov: ``nbins x nbins`` relative covariance matrix or ``None``
+            (zero)
+        poisson_scale: Scale :math:`s` of the poisson errors or ``None`` (no
+            poisson errors)
+        point_factors: List of ``n x nbins x r`` arrays of low rank factors
+        point_corrs: List of tuples ``(err, corr)`` of ``n x nbins`` errors
+            and ``nbins x nbins`` or ``n x nbins x nbins`` correlation
+            matrices
+        point_covs: List of ``n x nbins x nbins`` covariance matrices
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        abs_cov: Optional[np.ndarray] = None,
+        rel_cov: Optional[np.ndarray] = None,
+        poisson_scale: Optional[float] = None,
+        point_factors: Optional[List[np.ndarray]] = None,
+        point_corrs: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None,
+        point_covs: Optional[List[np.ndarray]] = None,
+    ):
+        self._data = np.asarray(data, dtype=np.float64)
+        if not self._data.ndim == 2:
+            raise ValueError(
+                "Data has to be of shape n x nbins, but got {}.".format(
+                    self._data.shape
+                )
+            )
+        self._abs_cov = self._interpret_matrix(abs_cov, "abs_cov")
+        self._rel_cov = self._interpret_matrix(rel_cov, "rel_cov")
+        self._poisson_scale = poisson_scale
+        self._point_factors = [
+            self._interpret_points(factor, "factor", 3)
+            for factor in point_factors or []
+        ]
+        self._point_corrs = []
+        for err, corr in point_corrs or []:
+            err = self._interpret_points(err, "err", 2)
+            corr = np.asarray(corr, dtype=np.float64)
+            if corr.ndim == 3:
+                corr = self._interpret_points(corr, "corr", 3)
+            else:
+                corr = self._interpret_matrix(corr, "corr")
+            self._point_corrs.append((err, corr))
+        self._point_covs = [
+            self._interpret_points(cov, "cov", 3) for cov in point_covs or []
+        ]
+
+    def components(self) -> Dict[str, np.ndarray]:
+        """ The arrays that make up the covariance matrices, so that they can
+        be passed on separately (e.g. to the shared memory of
+        :func:`~clusterking.maths.metric_utils.parallel_condensed`) and the
+        object can be rebuilt with :meth:`from_components`.
+
+        Returns:
+            Dictionary of named arrays
+        """
+        components = {"data": self._data}
+        if self._abs_cov is not None:
+            components["abs_cov"] = self._abs_cov
+        if self._rel_cov is not None:
+            components["rel_cov"] = self._rel_cov
+        if self._poisson_scale is not None:
+            components["poisson_scale"] = np.array([self._poisson_scale])
+        for i, factor in enumerate(self._point_factors):
+            components["factor_{}".format(i)] = factor
+        for i, (err, corr) in enumerate(self._point_corrs):
+            components["err_{}".format(i)] = err
+            components["corr_{}".format(i)] = corr
+        for i, cov in enumerate(self._point_covs):
+            components["cov_{}".format(i)] = cov
+        return components
+
+    @classmethod
+    def from_components(
+        cls, components: Dict[str, np.ndarray]
+    ) -> "StructuredCovariance":
+        """ Rebuild the object from the arrays of :meth:`components` (the
+        arrays are not copied).
+
+        Args:
+            components: Dictionary of named arrays
+
+        Returns:
+            :class:`StructuredCovariance`
+        """
+
+        def terms(prefix):
+            count = 0
+            while "{}_{}".format(prefix, count) in components:
+                count += 1
+            return [components["{}_{}".format(prefix, i)] for i in range(count)]
+
+        poisson_scale = None
+        if "poisson_scale" in components:
+            poisson_scale = float(components["poisson_scale"][0])
+        return cls(
+            components["data"],
+            abs_cov=components.get("abs_cov"),
+            rel_cov=components.get("rel_cov"),
+            poisson_scale=poisson_scale,
+            point_factors=terms("factor"),
+            point_corrs=list(zip(terms("err"), terms("corr"))),
+            point_covs=terms("cov"),
+        )
+
+    def _interpret_points(self, array, name: str, ndim: int) -> np.ndarray:
+        array = np.asarray(array, dtype=np.float64)
+        if not (array.ndim == ndim and array.shape[:2] == self.shape[:2]):
+            raise ValueError(
+                "{} has to be a {}-dimensional array starting with the "
+                "dimensions {}, but got shape {}.".format(
+                    name, ndim, self.shape[:2], array.shape
+                )
+            )
+        return array
+
+    def _interpret_matrix(self, matrix, name: str) -> Optional[np.ndarray]:
+        if matrix is None:
+            return None
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if not matrix.shape == (self.nbins, self.nbins):
+            raise ValueError(
+                "{} has to be of shape {}, but got {}.".format(
+                    name, (self.nbins, self.nbins), matrix.shape
+                )
+            )
+        if not matrix.any():
+            return None
+        return matrix
+
+    # **************************************************************************
+    # Properties
+    # **************************************************************************
+
+    @property
+    def n(self) -> int:
+        """ Number of distributions """
+        return self._data.shape[0]
+
+    @property
+    def nbins(self) -> int:
+        """ Number of bins """
+        return self._data.shape[1]
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        """ Shape of the corresponding dense array """
+        return self.n, self.nbins, self.nbins
+
+    @property
+    def is_zero(self) -> bool:
+        """ True if no errors are present """
+        return (
+            self._abs_cov is None
+            and self._rel_cov is None
+            and self._poisson_scale is None
+            and not self._point_factors
+            and not self._point_corrs
+            and not self._point_covs
+        )
+
+    @property
+    def uniform_cov(self) -> Optional[np.ndarray]:
+        """ The covariance matrix if it is the same for all distributions
+        (i.e. if there are only contributions from ``abs_cov``), else
+        ``None``.
+        """
+        if (
+            self._abs_cov is None
+            or self._rel_cov is not None
+            or self._poisson_scale is not None
+            or self._point_factors
+            or self._point_corrs
+            or self._point_covs
+        ):
+            return None
+        return self._abs_cov
+
+    def __len__(self):
+        return self.n
+
+    # **************************************************************************
+    # Dense blocks
+    # **************************************************************************
+
+    def _select_rows(self, rows) -> np.ndarray:
+        """ Bin contents of the selected rows (always 2D). """
+        return self._data[rows].reshape((-1, self.nbins))
+
+    def block(self, rows=slice(None)) -> np.ndarray:
+        """ Dense covariance matrices of some of the distributions.
+
+        Args:
+            rows: Anything that can be used to index the first axis of a numpy
+                array (slice, integer array, boolean mask)
+
+        Returns:
+            ``len(rows) x nbins x nbins`` array
+        """
+        data = self._select_rows(rows)
+        block = np.zeros((data.shape[0], self.nbins, self.nbins))
+        if self._abs_cov is not None:
+            block += self._abs_cov
+        if self._rel_cov is not None:
+            block += self._rel_cov * data[:, :, None] * data[:, None, :]
+        if self._poisson_scale is not None:
+            diag = np.arange(self.nbins)
+            block[:, diag, diag] += data / self._poisson_scale
+        for factor in self._point_factors:
+            factor = factor[rows].reshape((len(data), self.nbins, -1))
+            block += np.einsum("kir,kjr->kij", factor, factor)
+        for err, corr in self._point_corrs:
+            err = err[rows].reshape(data.shape)
+            if corr.ndim == 3:
+                corr = corr[rows].reshape(block.shape)
+            block += err[:, :, None] * corr * err[:, None, :]
+        for cov in self._point_covs:
+            block += cov[rows].reshape(block.shape)
+        return block
+
+    def dense(self) -> np.ndarray:
+        """ Build the full ``n x nbins x nbins`` array. """
+        return self.block()
+
+    def __getitem__(self, item) -> np.ndarray:
+        if isinstance(item, (int, np.integer)):
+            return self.block(item)[0]
+        return self.block(item)
+
+    def iter_blocks(
+        self, chunk_size: Optional[int] = None, max_memory=None
+    ) -> Iterator[Tuple[slice, np.ndarray]]:
+        """ Iterate over the dense covariance matrices in chunks of
+        consecutive distributions.
+
+        Args:
+            chunk_size: Number of distributions per chunk
+            max_memory: Maximal size of one chunk in bytes (only used if
+                ``chunk_size`` is not given). If neither is given, everything
+                is returned in one chunk.
+
+        Yields:
+            Tuples ``(rows, block)`` of the slice of the rows and the
+            ``len(rows) x nbins x nbins`` array
+        """
+        if chunk_size is None:
+            chunk_size = chunk_size_from_memory(self.nbins, max_memory)
+        if chunk_size is None:
+            chunk_size = max(self.n, 1)
+        if chunk_size <= 0:
+            raise ValueError("chunk_size has to be an integer >= 1.")
+        for start in range(0, self.n, chunk_size):
+            rows = slice(start, min(start + chunk_size, self.n))
+            yield rows, self.block(rows)
+
+    # **************************************************************************
+    # Operations without dense matrices
+    # **************************************************************************
+
+    def diagonal(self, rows=slice(None)) -> np.ndarray:
+        """ Variances, i.e. the diagonals of the covariance matrices.
+
+        Args:
+            rows: Only return the variances for these rows (see
+                :meth:`block`)
+
+        Returns:
+            ``len(rows) x nbins`` array
+        """
+        data = self._select_rows(rows)
+        diag = np.zeros(data.shape)
+        if self._abs_cov is not None:
+            diag += self._abs_cov.diagonal()
+        if self._rel_cov is not None:
+            diag += self._rel_cov.diagonal() * np.square(data)
+        if self._poisson_scale is not None:
+            diag += data / self._poisson_scale
+        for factor in self._point_factors:
+            factor = factor[rows].reshape((len(data), self.nbins, -1))
+            diag += np.square(factor).sum(axis=2)
+        for err, corr in self._point_corrs:
+            err = err[rows].reshape(data.shape)
+            if corr.ndim == 3:
+                corr_diag = corr[rows].reshape((-1, self.nbins, self.nbins))
+                corr_diag = corr_diag.diagonal(axis1=1, axis2=2)
+            else:
+                corr_diag = corr.diagonal()
+            diag += np.square(err) * corr_diag
+        for cov in self._point_covs:
+            cov = cov[rows].reshape((-1, self.nbins, self.nbins))
+            diag += cov.diagonal(axis1=1, axis2=2)
+        return diag
+
+    def matvec(self, vectors: np.ndarray, rows=slice(None)) -> np.ndarray:
+        """ Multiply the covariance matrices with vectors, i.e. calculate
+        :math:`\\sum_j \\mathrm{Cov}^{(k)}_{ij} v^{(k)}_j`.
+
+        Args:
+            vectors: ``len(rows) x nbins`` array (one vector for every
+                distribution)
+            rows: Only use the covariance matrices of these rows (see
+                :meth:`block`)
+
+        Returns:
+            ``len(rows) x nbins`` array
+        """
+        data = self._select_rows(rows)
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(data.shape)
+        result = np.zeros(data.shape)
+        if self._abs_cov is not None:
+            result += vectors @ self._abs_cov.T
+        if self._rel_cov is not None:
+            result += data * ((data * vectors) @ self._rel_cov.T)
+        if self._poisson_scale is not None:
+            result += data / self._poisson_scale * vectors
+        for factor in self._point_factors:
+            factor = factor[rows].reshape((len(data), self.nbins, -1))
+            result += np.einsum(
+                "kir,kr->ki", factor, np.einsum("kjr,kj->kr", factor, vectors)
+            )
+        for err, corr in self._point_corrs:
+            err = err[rows].reshape(data.shape)
+            if corr.ndim == 3:
+                corr = corr[rows].reshape((-1, self.nbins, self.nbins))
+                result += err * np.einsum("kij,kj->ki", corr, err * vectors)
+            else:
+                result += err * ((err * vectors) @ corr.T)
+        for cov in self._point_covs:
+            cov = cov[rows].reshape((-1, self.nbins, self.nbins))
+            result += np.einsum("kij,kj->ki", cov, vectors)
+        return result
+
+    def solve(
+        self,
+        vectors: np.ndarray,
+        rows=slice(None),
+        chunk_size: Optional[int] = None,
+        max_memory=None,
+    ) -> np.ndarray:
+        """ Solve :math:`\\mathrm{Cov}^{(k)} x^{(k)} = v^{(k)}` for every
+        distribution. Only ``chunk_size`` dense covariance matrices are built
+        at a time.
+
+        Args:
+            vectors: ``len(rows) x nbins`` array (one vector for every
+                distribution)
+            rows: Only use the covariance matrices of these rows (see
+                :meth:`block`)
+            chunk_size: See :meth:`iter_blocks`
+            max_memory: See :meth:`iter_blocks`
+
+        Returns:
+            ``len(rows) x nbins`` array
+        """
+        positions = np.arange(self.n)[rows].reshape(-1)
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(
+            (len(positions), self.nbins)
+        )
+        if chunk_size is None:
+            chunk_size = chunk_size_from_memory(self.nbins, max_memory)
+        if chunk_size is None:
+            chunk_size = max(len(positions), 1)
+        result = np.empty(vectors.shape)
+        for start in range(0, len(positions), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            result[chunk] = np.linalg.solve(
+                self.block(positions[chunk]), vectors[chunk, :, None]
+            )[:, :, 0]
+        return result
+
+    def __repr__(self):
+        return (
+            "<{} n={} nbins={} abs={} rel={} poisson={} point_terms={}>".format(
+                type(self).__name__,
+                self.n,
+                self.nbins,
+                self._abs_cov is not None,
+                self._rel_cov is not None,
+                self._poisson_scale,
+                len(self._point_factors)
+                + len(self._point_corrs)
+                + len(self._point_covs),
+            )
+        )
+
+
+class RunningCovariance(object):
+    """ Covariance matrix of a sequence of vectors that are added one by one,
+    without storing the vectors.
+
+    Only the sums of the deviations of the vectors from a reference vector
+    and of their outer products are accumulated. The rounding errors are
+    small if the reference vector is close to the mean (e.g. the nominal
+    result if the vectors are variations of it).
+
+    .. code-block:: python
+
+        running = RunningCovariance(nbins, reference=nominal)
+        for vector in vectors:
+            running.add(vector)
+        running.cov  # nbins x nbins array
+    """
+
+    def __init__(self, nbins: int, reference: Optional[np.ndarray] = None):
+        """
+        Args:
+            nbins: Length of the vectors
+            reference: Vector that the deviations are taken from. Default:
+                The first vector that is added.
+        """
+        #: Number of vectors added so far
+        self.count = 0
+        self._reference = None  # type: Optional[np.ndarray]
+        if reference is not None:
+            self._reference = self._interpret_vector(reference, nbins)
+        self._nbins = nbins
+        #: Sum of the deviations from the reference vector
+        self._sum = np.zeros(nbins)
+        #: Sum of the outer products of the deviations from the reference
+        #: vector
+        self._m2 = np.zeros((nbins, nbins))
+
+    @staticmethod
+    def _interpret_vector(vector, nbins: int) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float64).reshape(-1)
+        if vector.shape != (nbins,):
+            raise ValueError(
+                "Expected vector of length {}, got shape {}.".format(
+                    nbins, vector.shape
+                )
+            )
+        return vector
+
+    def add(self, vector) -> None:
+        """ Add one vector. """
+        vector = self._interpret_vector(vector, self._nbins)
+        if self._reference is None:
+            self._reference = vector
+        self.count += 1
+        delta = vector - self._reference
+        self._sum += delta
+        self._m2 += np.outer(delta, delta)
+
+    @property
+    def mean(self) -> np.ndarray:
+        """ Mean of the vectors added so far """
+        if self.count == 0:
+            return np.zeros(self._nbins)
+        return self._reference + self._sum / self.count
+
+    @property
+    def cov(self) -> np.ndarray:
+        """ Sample covariance matrix (normalized by ``count - 1``) of the
+        vectors added so far. Zero if less than two vectors were added.
+        """
+        if self.count < 2:
+            return np.zeros_like(self._m2)
+        return (self._m2 - np.outer(self._sum, self._sum) / self.count) / (
+            self.count - 1
+        )
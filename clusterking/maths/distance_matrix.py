@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+
+""" Distance matrices that are stored in condensed form, optionally in a
+memory-mapped file.
+"""
+
+# std
+import hashlib
+import json
+from pathlib import Path, PurePath
+from typing import Optional, Union, Dict, Callable, Iterable, Any
+
+# 3rd
+import numpy as np
+import pandas as pd
+
+# ours
+from clusterking.maths.metric_utils import (
+    condensed_offset,
+    parallel_condensed,
+    metric_selection,
+)
+from clusterking.util.metadata import stable_serialize, hash_metadata
+
+
+def _row_hashes(data) -> np.ndarray:
+    """ 64 bit hash of the bin contents and parameter values of every sample
+    point of a :class:`~clusterking.data.Data` object.
+    """
+    return pd.util.hash_pandas_object(
+        data.df[data.bin_cols + data.par_cols], index=False
+    ).values
+
+
+def metric_md(*args, **kwargs) -> Dict[str, Any]:
+    """ Metadata of a metric configuration as saved by the ``set_metric``
+    methods of :class:`~clusterking.cluster.HierarchyCluster` and
+    :class:`~clusterking.benchmark.Benchmark`.
+
+    Args:
+        *args: Positional arguments of
+            :func:`~clusterking.maths.metric_utils.metric_selection`
+        **kwargs: Keyword arguments of
+            :func:`~clusterking.maths.metric_utils.metric_selection`
+
+    Returns:
+        Dictionary
+    """
+    return {
+        "args": stable_serialize(args),
+        "kwargs": stable_serialize(kwargs),
+    }
+
+
+def distance_matrix_key(data, metric: Dict[str, Any]) -> str:
+    """ Key that identifies the distance matrix of a dataset for a metric
+    configuration: A hash of the fingerprint of the data (see
+    :meth:`clusterking.data.Data.fingerprint`) and the metric metadata, in
+    which functions are described by
+    :func:`~clusterking.util.metadata.stable_serialize`. The number of
+    processes (``n_jobs``) does not change the key.
+
+    Args:
+        data: :class:`~clusterking.data.Data` object
+        metric: Metric metadata (see :func:`metric_md`)
+
+    Returns:
+        Hexadecimal string
+    """
+    metric = dict(metric)
+    metric["kwargs"] = {
+        key: value
+        for key, value in metric.get("kwargs", {}).items()
+        if key != "n_jobs"
+    }
+    h = hashlib.blake2b(digest_size=16)
+    h.update(data.fingerprint().encode())
+    hash_metadata(metric, h)
+    return h.hexdigest()
+
+
+def distance_matrix_path(data_path: Union[str, PurePath], key: str) -> Path:
+    """ Path of the file of a persisted distance matrix that is saved next to
+    the output file of a dataset.
+
+    Args:
+        data_path: Path to the output file of the
+            :class:`~clusterking.data.Data` object
+        key: Key of the distance matrix (see :func:`distance_matrix_key`)
+
+    Returns:
+        Path to ``.npy`` file
+    """
+    data_path = Path(data_path)
+    return data_path.with_name(
+        "{}.distances-{}.npy".format(data_path.stem, key[:16])
+    )
+
+
+class DistanceMatrix(object):
+    """ Symmetric distance matrix of ``n`` points with vanishing diagonal,
+    stored in condensed form (the upper triangle as a vector of length
+    ``n choose 2``, see :func:`scipy.spatial.distance.squareform`).
+
+    The condensed vector can be kept in memory or in a memory-mapped
+    ``.npy`` file, so that distance matrices that don't fit into memory can be
+    filled block by block (:meth:`compute`) and used without loading them
+    completely (:meth:`row`, :meth:`row_sums`, :meth:`submatrix`,
+    :meth:`uncondense`).
+
+    .. code-block:: python
+
+        dm = DistanceMatrix.compute(
+            pdist_condensed, d.n, {"data": d.data()}, path="distances.npy",
+            n_jobs=8
+        )
+        dm.row_sums()
+
+    Distance matrices can be passed to functions that expect condensed
+    distance matrices as numpy arrays (e.g.
+    :func:`scipy.cluster.hierarchy.linkage`).
+
+    A distance matrix that was built for a dataset with :meth:`from_data`
+    remembers the index labels and contents of the sample points, so that
+    the distances of any subset of them can be retrieved with :meth:`subset`
+    instead of being recomputed. This is used by
+    :meth:`clusterking.cluster.HierarchyCluster.set_distance_matrix` and
+    :meth:`clusterking.benchmark.Benchmark.set_distance_matrix`:
+
+    .. code-block:: python
+
+        dm = DistanceMatrix.from_data(d, "euclidean", data_path="scan.sql")
+        c = HierarchyCluster()
+        c.set_distance_matrix(dm)
+        b = Benchmark()
+        b.set_distance_matrix(dm)
+    """
+
+    def __init__(
+        self,
+        condensed: np.ndarray,
+        labels: Optional[np.ndarray] = None,
+        row_hashes: Optional[np.ndarray] = None,
+        md: Optional[Dict[str, Any]] = None,
+    ):
+        """ Initialize distance matrix from a condensed distance matrix.
+
+        Args:
+            condensed: Condensed distance matrix (numpy array or
+                :class:`numpy.memmap`)
+            labels: Optional: Index labels of the sample points
+            row_hashes: Optional: Hashes of the contents of the sample points
+            md: Optional: Metadata
+        """
+        condensed = np.asanyarray(condensed)
+        if condensed.ndim != 1:
+            raise ValueError(
+                "Condensed distance matrix has to be one dimensional, but "
+                "has shape {}.".format(condensed.shape)
+            )
+        n = int(np.ceil(np.sqrt(2 * len(condensed))))
+        if n * (n - 1) // 2 != len(condensed):
+            raise ValueError(
+                "Invalid length {} of condensed distance matrix.".format(
+                    len(condensed)
+                )
+            )
+        #: Condensed distance matrix
+        self.condensed = condensed
+        self._n = max(n, 1) if len(condensed) == 0 else n
+        #: Index labels of the sample points in the dataframe of the data
+        #: (or ``None``)
+        self.labels = None if labels is None else np.asarray(labels)
+        #: Hashes of the bin contents and parameter values of the sample
+        #: points (or ``None``)
+        self.row_hashes = (
+            None if row_hashes is None else np.asarray(row_hashes, np.uint64)
+        )
+        #: Metadata: Key (see :func:`distance_matrix_key`), data fingerprint
+        #: and metric configuration
+        self.md = {} if md is None else md
+
+    @classmethod
+    def empty(
+        cls, n: int, path: Optional[Union[str, PurePath]] = None
+    ) -> "DistanceMatrix":
+        """ Create a distance matrix of ``n`` points filled with zeros.
+
+        Args:
+            n: Number of points
+            path: If given, the distance matrix is stored in this (``.npy``)
+                file
+
+        Returns:
+            :class:`DistanceMatrix`
+        """
+        size = n * (n - 1) // 2
+        if path is None:
+            new = cls(np.zeros(size))
+        else:
+            new = cls(
+                np.lib.format.open_memmap(
+                    str(path), mode="w+", dtype=np.float64, shape=(size,)
+                )
+            )
+        new._n = n
+        return new
+
+    @classmethod
+    def load(
+        cls, path: Union[str, PurePath], mode="r", n: Optional[int] = None
+    ) -> "DistanceMatrix":
+        """ Open distance matrix that is stored in a file (memory-mapped).
+
+        Args:
+            path: Path to ``.npy`` file
+            mode: Mode of :func:`numpy.load`
+            n: Number of points (only needed if the file is empty)
+
+        Returns:
+            :class:`DistanceMatrix`
+        """
+        path = Path(path)
+        if not path.is_file():
+            raise FileNotFoundError("File '{}' doesn't exist.".format(path))
+        new = cls(np.load(str(path), mmap_mode=mode))
+        if n is not None:
+            new._n = n
+        md_path = cls._md_path(path)
+        if md_path.is_file():
+            with md_path.open() as md_file:
+                md = json.load(md_file)
+            new.md = md["md"]
+            new._n = md["n"]
+            if md["labels"] is not None:
+                new.labels = np.asarray(md["labels"])
+            if md["row_hashes"] is not None:
+                new.row_hashes = np.asarray(md["row_hashes"], np.uint64)
+        return new
+
+    @classmethod
+    def from_data(
+        cls,
+        data,
+        *args,
+        data_path: Optional[Union[str, PurePath]] = None,
+        **kwargs
+    ) -> "DistanceMatrix":
+        """ Distance matrix of a dataset for a metric, computed only once.
+
+        The distance matrix is cached in the data object and, if
+        ``data_path`` is given, saved next to the output file of the data
+        (see :func:`distance_matrix_path`), so that it is also reused in
+        later sessions. A cached distance matrix is only used if the data
+        fingerprint and the metric configuration agree (see
+        :func:`distance_matrix_key`). Functions in the metric configuration
+        are identified by their qualified name, bytecode, default arguments
+        and closure contents (see
+        :func:`~clusterking.util.metadata.stable_serialize`), so different
+        lambdas or closures never share a distance matrix. Closures over
+        objects whose string representation contains a memory address (e.g.
+        data objects) get a new key in every session, so that their persisted
+        distance matrices are not reused.
+
+        Args:
+            data: :class:`~clusterking.data.Data` object
+            *args: Positional arguments of
+                :func:`~clusterking.maths.metric_utils.metric_selection`
+            data_path: Optional: Path of the output file of the data
+            **kwargs: Keyword arguments of
+                :func:`~clusterking.maths.metric_utils.metric_selection`
+
+        Returns:
+            :class:`DistanceMatrix`
+        """
+        metric = metric_md(*args, **kwargs)
+        key = distance_matrix_key(data, metric)
+        cached = data._get_cached(("distance_matrix", key))
+        if cached is not None:
+            return cached
+        path = None
+        if data_path is not None:
+            path = distance_matrix_path(data_path, key)
+            if path.is_file():
+                loaded = cls.load(path)
+                if loaded.md.get("key") == key:
+                    data._set_cached(("distance_matrix", key), loaded)
+                    return loaded
+        distances = metric_selection(*args, **kwargs)(data)
+        md = {"key": key, "data": data.fingerprint(), "metric": metric}
+        if (
+            isinstance(distances, DistanceMatrix)
+            and "precision" in distances.md
+        ):
+            # Result of the check of mixed precision metrics
+            md["precision"] = distances.md["precision"]
+        if isinstance(distances, DistanceMatrix) and path is None:
+            new = distances
+        else:
+            new = cls.empty(data.n, path=path)
+            new.condensed[:] = np.asarray(distances)
+        new.labels = np.asarray(data.df.index)
+        new.row_hashes = _row_hashes(data)
+        new.md = md
+        new.flush()
+        data._set_cached(("distance_matrix", key), new)
+        return new
+
+    @classmethod
+    def compute(
+        cls,
+        kernel: Callable,
+        n: int,
+        arrays: Dict[str, np.ndarray],
+        path: Optional[Union[str, PurePath]] = None,
+        n_jobs: Optional[int] = 1,
+        **kwargs
+    ) -> "DistanceMatrix":
+        """ Fill a new distance matrix block by block (see
+        :func:`~clusterking.maths.metric_utils.parallel_condensed`).
+
+        Args:
+            kernel: Kernel function, e.g.
+                :func:`~clusterking.maths.metric_utils.pdist_condensed` or
+                :func:`~clusterking.maths.metric.chi2_condensed`
+            n: Number of points
+            arrays: Arrays that are passed to the kernel
+            path: If given, the distance matrix is stored in this (``.npy``)
+                file
+            n_jobs: Number of processes
+            **kwargs: Keyword arguments to the kernel
+
+        Returns:
+            :class:`DistanceMatrix`
+        """
+        new = cls.empty(n, path=path)
+        parallel_condensed(
+            kernel, n, arrays, n_jobs=n_jobs, out=new.condensed, **kwargs
+        )
+        new.flush()
+        return new
+
+    # **************************************************************************
+    # Properties
+    # **************************************************************************
+
+    @property
+    def n(self) -> int:
+        """ Number of points """
+        return self._n
+
+    @property
+    def path(self) -> Optional[Path]:
+        """ File of a memory-mapped distance matrix or ``None`` """
+        filename = getattr(self.condensed, "filename", None)
+        if filename is None:
+            return None
+        return Path(filename)
+
+    def __len__(self):
+        return self.n
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return np.asarray(self.condensed)
+        return np.asarray(self.condensed, dtype=dtype)
+
+    @staticmethod
+    def _md_path(path: Union[str, PurePath]) -> Path:
+        """ File with the metadata, labels and row hashes of a distance
+        matrix that is saved in ``path``.
+        """
+        return Path(path).with_suffix(".json")
+
+    def flush(self) -> None:
+        """ Write changes of a memory-mapped distance matrix to disk,
+        together with its metadata.
+        """
+        if isinstance(self.condensed, np.memmap):
+            self.condensed.flush()
+        if self.path is None:
+            return
+        md = {
+            "md": self.md,
+            "n": self.n,
+            "labels": None if self.labels is None else self.labels.tolist(),
+            "row_hashes": (
+                None if self.row_hashes is None else self.row_hashes.tolist()
+            ),
+        }
+        with self._md_path(self.path).open("w") as md_file:
+            json.dump(md, md_file)
+
+    def save(self, path: Union[str, PurePath]) -> "DistanceMatrix":
+        """ Save distance matrix to a ``.npy`` file (and its metadata to a
+        ``.json`` file with the same name).
+
+        Args:
+            path: Path to ``.npy`` file
+
+        Returns:
+            Memory-mapped :class:`DistanceMatrix` of the new file
+        """
+        new = DistanceMatrix.empty(self.n, path=path)
+        new.condensed[:] = self.condensed
+        new.labels = self.labels
+        new.row_hashes = self.row_hashes
+        new.md = self.md
+        new.flush()
+        return new
+
+    # **************************************************************************
+    # Access
+    # **************************************************************************
+
+    def _upper(self, i: int) -> np.ndarray:
+        """ Distances from point ``i`` to the points ``j > i`` """
+        offset = condensed_offset(self.n, i)
+        return self.condensed[offset : offset + self.n - i - 1]
+
+    def row(self, i: int) -> np.ndarray:
+        """ Distances of point ``i`` to all points.
+
+        Args:
+            i: Index of point
+
+        Returns:
+            Vector of length ``n``
+        """
+        if not 0 <= i < self.n:
+            raise IndexError("Point {} out of range.".format(i))
+        row = np.zeros(self.n)
+        k = np.arange(i)
+        row[:i] = self.condensed[condensed_offset(self.n, k) + i - k - 1]
+        row[i + 1 :] = self._upper(i)
+        return row
+
+    def rows(self, indizes: Iterable[int]) -> np.ndarray:
+        """ Distances of several points to all points.
+
+        Args:
+            indizes: Indizes of points
+
+        Returns:
+            ``len(indizes) x n`` array
+        """
+        indizes = list(indizes)
+        out = np.zeros((len(indizes), self.n))
+        for irow, i in enumerate(indizes):
+            out[irow] = self.row(i)
+        return out
+
+    def row_sums(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ Sum of the distances of every point to all other points,
+        computed by reading the condensed distance matrix once.
+
+        Args:
+            out: Vector of length ``n`` to write to
+
+        Returns:
+            Vector of length ``n``
+        """
+        if out is None:
+            out = np.zeros(self.n)
+        else:
+            out[:] = 0.0
+        for i in range(self.n - 1):
+            upper = self._upper(i)
+            out[i] += upper.sum()
+            out[i + 1 :] += upper
+        return out
+
+    def submatrix(
+        self,
+        indizes: Iterable[int],
+        path: Optional[Union[str, PurePath]] = None,
+    ) -> "DistanceMatrix":
+        """ Distance matrix of a subset of the points (in the given order).
+
+        Args:
+            indizes: Indizes of the points
+            path: If given, the new distance matrix is stored in this
+                (``.npy``) file
+
+        Returns:
+            :class:`DistanceMatrix`
+        """
+        indizes = np.asarray(list(indizes), dtype=int)
+        m = len(indizes)
+        new = DistanceMatrix.empty(m, path=path)
+        for a in range(m - 1):
+            offset = condensed_offset(m, a)
+            new.condensed[offset : offset + m - a - 1] = self.row(indizes[a])[
+                indizes[a + 1 :]
+            ]
+        if self.labels is not None:
+            new.labels = self.labels[indizes]
+        if self.row_hashes is not None:
+            new.row_hashes = self.row_hashes[indizes]
+        new.md = dict(self.md)
+        new.flush()
+        return new
+
+    def positions(self, data) -> np.ndarray:
+        """ Positions of the sample points of a dataset in this distance
+        matrix.
+
+        Args:
+            data: :class:`~clusterking.data.Data` object with a subset of the
+                sample points that this distance matrix was built for (see
+                :meth:`from_data`)
+
+        Returns:
+            Integer array
+
+        Raises:
+            ValueError: If the distance matrix does not contain all sample
+                points of the data or their bin contents or parameter values
+                differ
+        """
+        if self.labels is None or self.row_hashes is None:
+            raise ValueError(
+                "Distance matrix doesn't know its sample points, build it "
+                "with DistanceMatrix.from_data."
+            )
+        positions = pd.Index(self.labels).get_indexer(data.df.index)
+        if (positions < 0).any():
+            raise ValueError(
+                "{} sample points are not part of the distance matrix.".format(
+                    int((positions < 0).sum())
+                )
+            )
+        if not np.array_equal(self.row_hashes[positions], _row_hashes(data)):
+            raise ValueError(
+                "The contents of the sample points differ from those that the "
+                "distance matrix was built for."
+            )
+        return positions
+
+    def subset(self, data) -> "DistanceMatrix":
+        """ Distance matrix of the sample points of a dataset, taken from the
+        rows and columns of this distance matrix rather than recomputed.
+
+        Args:
+            data: :class:`~clusterking.data.Data` object with a subset of the
+                sample points that this distance matrix was built for (see
+                :meth:`positions`)
+
+        Returns:
+            :class:`DistanceMatrix` (this object if the data has the same
+            sample points in the same order)
+        """
+        positions = self.positions(data)
+        if np.array_equal(positions, np.arange(self.n)):
+            return self
+        return self.submatrix(positions)
+
+    def uncondense(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ Square form of the distance matrix, built row by row.
+
+        Args:
+            out: ``n x n`` array to write to (can be memory-mapped)
+
+        Returns:
+            ``n x n`` array
+        """
+        if out is None:
+            out = np.zeros((self.n, self.n))
+        elif out.shape != (self.n, self.n):
+            raise ValueError(
+                "Output array has to be of shape {}, but has shape {}.".format(
+                    (self.n, self.n), out.shape
+                )
+            )
+        for i in range(self.n):
+            out[i, i] = 0.0
+            if i < self.n - 1:
+                upper = self._upper(i)
+                out[i, i + 1 :] = upper
+                out[i + 1 :, i] = upper
+        return out
+
+    def __repr__(self):
+        return "DistanceMatrix(n={}{})".format(
+            self.n, ", path='{}'".format(self.path) if self.path else ""
+        )
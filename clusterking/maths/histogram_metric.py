@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+""" Distances between normalized binned distributions (histograms), computed
+for all pairs of sample points at once.
+
+The metrics can be selected by name with the ``set_metric`` methods of
+:class:`~clusterking.cluster.HierarchyCluster` and
+:class:`~clusterking.benchmark.Benchmark` (see
+:func:`~clusterking.maths.metric_utils.metric_selection`), e.g.
+``c.set_metric("hellinger")`` or ``c.set_metric("wasserstein", n_jobs=4)``.
+"""
+
+# std
+from typing import Callable, Optional
+
+# 3rd
+import numpy as np
+import scipy.spatial
+import scipy.special
+
+# ours
+from clusterking.maths.metric_utils import (
+    parallel_condensed,
+    pairwise_condensed,
+    pdist_condensed,
+)
+
+
+def _cumulative(data: np.ndarray, bin_widths: np.ndarray) -> np.ndarray:
+    """ Cumulative distribution functions at the upper bin edges, weighted
+    with the bin widths """
+    return np.cumsum(data, axis=1) * bin_widths
+
+
+def _pdist(values: np.ndarray, metric: str, n_jobs: Optional[int]):
+    """ Condensed distance matrix from :func:`scipy.spatial.distance.pdist`
+    or computed in several processes """
+    if n_jobs is None or n_jobs == 1:
+        return scipy.spatial.distance.pdist(values, metric)
+    return parallel_condensed(
+        pdist_condensed,
+        len(values),
+        {"data": values},
+        n_jobs=n_jobs,
+        metric=metric,
+    )
+
+
+def symmetric_kl_block(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """ Pairwise block function (see
+    :func:`~clusterking.maths.metric_utils.pairwise_condensed`) for the
+    symmetric Kullback-Leibler divergence
+    :math:`\\sum_i (p_i - q_i) (\\log p_i - \\log q_i)`.
+
+    Args:
+        x: ``k x 2 nbins`` array of the distributions and their logarithms
+        y: ``l x 2 nbins`` array of the distributions and their logarithms
+
+    Returns:
+        ``k x l`` array
+    """
+    nbins = x.shape[1] // 2
+    px, lx = x[:, :nbins], x[:, nbins:]
+    py, ly = y[:, :nbins], y[:, nbins:]
+    divergence = (
+        np.einsum("ij,ij->i", px, lx)[:, np.newaxis]
+        + np.einsum("ij,ij->i", py, ly)[np.newaxis, :]
+        - px @ ly.T
+        - lx @ py.T
+    )
+    # Rounding errors can give small negative values
+    return np.maximum(divergence, 0.0)
+
+
+def jensen_shannon_block(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """ Pairwise block function (see
+    :func:`~clusterking.maths.metric_utils.pairwise_condensed`) for the
+    Jensen-Shannon distance, i.e. the square root of the Jensen-Shannon
+    divergence (natural logarithm, as
+    :func:`scipy.spatial.distance.jensenshannon`).
+
+    Args:
+        x: ``k x nbins`` array of normalized distributions
+        y: ``l x nbins`` array of normalized distributions
+
+    Returns:
+        ``k x l`` array
+    """
+    entropy_x = scipy.special.xlogy(x, x).sum(axis=1)
+    entropy_y = scipy.special.xlogy(y, y).sum(axis=1)
+    m = (x[:, np.newaxis, :] + y[np.newaxis, :, :]) / 2
+    divergence = (
+        entropy_x[:, np.newaxis] + entropy_y[np.newaxis, :]
+    ) / 2 - scipy.special.xlogy(m, m).sum(axis=2)
+    return np.sqrt(np.maximum(divergence, 0.0))
+
+
+def histogram_metric(
+    name: str,
+    n_jobs: Optional[int] = 1,
+    chunk_size: Optional[int] = None,
+    epsilon=1e-10,
+    bin_widths: Optional[np.ndarray] = None,
+) -> Callable:
+    """ Metric for normalized binned distributions. The distributions are
+    normalized before comparing them.
+
+    * ``"hellinger"``: Hellinger distance
+      :math:`\\sqrt{\\sum_i (\\sqrt{p_i} - \\sqrt{q_i})^2 / 2}`
+    * ``"symmetric_kl"``: Symmetric Kullback-Leibler divergence
+      :math:`\\sum_i (p_i - q_i) (\\log p_i - \\log q_i)` (with ``epsilon``
+      added to all bins to avoid divergences for empty bins)
+    * ``"jensen_shannon"``: Jensen-Shannon distance (square root of the
+      Jensen-Shannon divergence)
+    * ``"wasserstein"``: 1D Wasserstein (earth mover's) distance
+      :math:`\\sum_i w_i |P_i - Q_i|` with the bin widths :math:`w_i` and the
+      cumulative distributions :math:`P_i, Q_i`
+    * ``"kolmogorov_smirnov"``: Kolmogorov-Smirnov distance
+      :math:`\\max_i |P_i - Q_i|`
+
+    Hellinger, Wasserstein and Kolmogorov-Smirnov distances are computed as
+    euclidean, cityblock and Chebyshev distances of transformed distributions
+    with :func:`scipy.spatial.distance.pdist`, the symmetric Kullback-Leibler
+    divergence with matrix products of blocks of distributions and the
+    Jensen-Shannon distance on blocks of pairs of distributions.
+
+    Args:
+        name: Name of the metric (see above)
+        n_jobs: Number of processes (see
+            :func:`~clusterking.maths.metric_utils.parallel_condensed`)
+        chunk_size: Maximal number of pairs of sample points that are compared
+            at once (only symmetric Kullback-Leibler and Jensen-Shannon)
+        epsilon: Added to the bin contents for the symmetric Kullback-Leibler
+            divergence
+        bin_widths: Widths of the bins for the Wasserstein distance. Default:
+            Taken from the binning in the metadata of the data if available,
+            else 1.
+
+    Returns:
+        Function that takes Data object as only parameter and returns a
+        reduced distance matrix.
+    """
+    if name not in histogram_metrics:
+        raise ValueError(
+            "Unknown histogram metric '{}'. Available: {}.".format(
+                name, ", ".join(histogram_metrics)
+            )
+        )
+
+    def metric(data):
+        p = data.data(normalize=True).astype(np.float64)
+        if name == "hellinger":
+            return _pdist(np.sqrt(p), "euclidean", n_jobs) / np.sqrt(2)
+        elif name in ["wasserstein", "kolmogorov_smirnov"]:
+            widths = np.ones(data.nbins)
+            if name == "wasserstein":
+                widths = _bin_widths(data, bin_widths)
+            return _pdist(
+                _cumulative(p, widths),
+                "cityblock" if name == "wasserstein" else "chebyshev",
+                n_jobs,
+            )
+        elif name == "symmetric_kl":
+            p = p + epsilon
+            p /= p.sum(axis=1, keepdims=True)
+            values = np.concatenate([p, np.log(p)], axis=1)
+            block = symmetric_kl_block
+            block_size = chunk_size
+        else:
+            values = p
+            block = jensen_shannon_block
+            # Bound the size of the n_pairs x nbins intermediate arrays
+            block_size = chunk_size or max(2 ** 22 // data.nbins, 1)
+        return parallel_condensed(
+            pairwise_condensed,
+            len(values),
+            {"data": values},
+            n_jobs=n_jobs,
+            pairwise=block,
+            chunk_size=block_size,
+        )
+
+    return metric
+
+
+def _bin_widths(data, bin_widths: Optional[np.ndarray]) -> np.ndarray:
+    """ Bin widths given by the user or from the binning in the metadata """
+    if bin_widths is not None:
+        bin_widths = np.asarray(bin_widths, dtype=np.float64)
+        if bin_widths.shape != (data.nbins,):
+            raise ValueError(
+                "Expected {} bin widths, got shape {}.".format(
+                    data.nbins, bin_widths.shape
+                )
+            )
+        return bin_widths
+    binning = data.md["scan"]["dfunction"]["binning"]
+    if binning and len(binning) == data.nbins + 1:
+        return np.abs(np.diff(np.asarray(binning, dtype=np.float64)))
+    return np.ones(data.nbins)
+
+
+#: Names of the metrics of :func:`histogram_metric`
+histogram_metrics = [
+    "hellinger",
+    "symmetric_kl",
+    "jensen_shannon",
+    "wasserstein",
+    "kolmogorov_smirnov",
+]
@@ -1,11 +1,31 @@
 #!/usr/bin/env python3
 
+# std
+from pathlib import PurePath
+from typing import Optional, Iterable, Union
+
 # 3rd
 import numpy as np
+import scipy.linalg
+import scipy.spatial
 
 # ours
-from clusterking.maths.metric_utils import condense_distance_matrix
+from clusterking.maths.metric_utils import (
+    condensed_offset,
+    parallel_condensed,
+    pairwise_condensed,
+    pdist_condensed,
+    mixed_precision,
+    mixed_sqeuclidean_block,
+    check_precision,
+)
+from clusterking.maths.covariance import (
+    chunk_size_from_memory,
+    StructuredCovariance,
+)
+from clusterking.maths.distance_matrix import DistanceMatrix
 from clusterking.data.dwe import DataWithErrors
+from clusterking.util.log import get_logger
 
 
 def chi2(
@@ -69,18 +89,253 @@ def chi2(
         )
 
 
-# todo: unittest
-def chi2_metric(dwe: DataWithErrors, output="condensed"):
+def _chi2_pairs(diff: np.ndarray, summed_cov: np.ndarray) -> np.ndarray:
+    """ Chi2 values of pairs of distributions from their differences
+    (``k x nbins``) and their summed covariance matrices
+    (``k x nbins x nbins``). """
+    solved = np.linalg.solve(summed_cov, diff[:, :, np.newaxis])
+    return np.einsum("ni,ni->n", diff, solved[:, :, 0])
+
+
+def _scaled_cov_block(
+    cov: Union[np.ndarray, StructuredCovariance],
+    scales: Optional[np.ndarray],
+    rows: slice,
+) -> np.ndarray:
+    """ Covariance matrices of consecutive rows as a new array, multiplied
+    with ``scales`` (if given). """
+    if isinstance(cov, StructuredCovariance):
+        block = cov.block(rows)
+    else:
+        block = np.array(cov[rows], dtype=np.float64)
+    if scales is not None:
+        block *= scales[rows, np.newaxis, np.newaxis]
+    return block
+
+
+def chi2_condensed(
+    data: np.ndarray,
+    cov: Union[np.ndarray, StructuredCovariance],
+    rows: Optional[Iterable[int]] = None,
+    out: Optional[np.ndarray] = None,
+    chunk_size: Optional[int] = None,
+    scales: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """ Chi2 values (not divided by the number of degrees of freedom) of all
+    pairs of distributions, written to a condensed distance matrix.
+
+    Only pairs ``(i, j)`` with ``i < j`` are computed. The distributions
+    ``j`` are processed in chunks and for every ``i``, the chi2 values with
+    the distributions of the chunk are obtained from batched linear solves
+    with the summed covariance matrices.
+
+    Args:
+        data: ``n x nbins`` array of (normalized) distributions
+        cov: ``n x nbins x nbins`` array of their covariance matrices or
+            :class:`~clusterking.maths.covariance.StructuredCovariance`
+            (the dense covariance matrices are then only built for the
+            pairs that are solved at once)
+        rows: Only compute the pairs ``(i, j)`` for these ``i`` (all other
+            entries of ``out`` are left unchanged). Default: All rows.
+        out: Condensed distance matrix to write to (``n choose 2`` vector).
+            Default: New array.
+        chunk_size: Maximal number of pairs that are solved at once (a few
+            times this many ``nbins x nbins`` matrices are held in memory).
+            Default: All pairs of one row.
+        scales: Factors for the covariance matrices of the distributions
+            (e.g. ``1 / norm^2`` if ``cov`` belongs to the distributions
+            before normalization). Default: No scaling.
+
+    Returns:
+        Condensed distance matrix (``out`` if given)
+    """
+    n = len(data)
+    if out is None:
+        out = np.zeros(n * (n - 1) // 2)
+    if rows is None:
+        rows = range(n)
+    if chunk_size is None:
+        chunk_size = max(n, 1)
+    rows = np.fromiter(rows, dtype=int)
+    if len(rows) == 0:
+        return out
+    # Every chunk of covariance matrices is built once and then compared
+    # with all rows before it
+    for start in range(rows.min() + 1, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        block = _scaled_cov_block(cov, scales, slice(start, stop))
+        for i in rows[rows < stop - 1]:
+            first = max(start, i + 1)
+            offset = condensed_offset(n, i)
+            diff = data[first:stop] - data[i]
+            summed_cov = block[first - start :] + _scaled_cov_block(
+                cov, scales, slice(i, i + 1)
+            )
+            out[offset + first - i - 1 : offset + stop - i - 1] = _chi2_pairs(
+                diff, summed_cov
+            )
+    return out
+
+
+def chi2_structured_condensed(
+    rows: Iterable[int],
+    out: np.ndarray,
+    data: np.ndarray,
+    scales: np.ndarray,
+    chunk_size: Optional[int] = None,
+    **components
+) -> np.ndarray:
+    """ :func:`chi2_condensed` for a
+    :class:`~clusterking.maths.covariance.StructuredCovariance` that is given
+    by its components (prefixed with ``cov_``, see
+    :meth:`~clusterking.maths.covariance.StructuredCovariance.components`), so
+    that only these arrays are put into shared memory by
+    :func:`~clusterking.maths.metric_utils.parallel_condensed`.
+    """
+    cov = StructuredCovariance.from_components(
+        {
+            name[len("cov_") :]: array
+            for name, array in components.items()
+            if name.startswith("cov_")
+        }
+    )
+    return chi2_condensed(
+        data, cov, rows=rows, out=out, chunk_size=chunk_size, scales=scales
+    )
+
+
+def _normalized_chi2_input(dwe: DataWithErrors):
+    """ Normalized distributions, their norms and the covariance matrices
+    before normalization (as
+    :class:`~clusterking.maths.covariance.StructuredCovariance`) of a
+    :class:`~clusterking.data.DataWithErrors` object (with 64 bit
+    precision, see :meth:`clusterking.data.Data.set_dtypes`).
+    """
+    cov = dwe.structured_cov()
+    data = dwe.data().astype(np.float64, copy=True)
+    norms = data.sum(axis=1)
+    data /= norms[:, np.newaxis]
+    return data, norms, cov
+
+
+def chi2_whitened(
+    data: np.ndarray,
+    norms: np.ndarray,
+    cov: np.ndarray,
+    n_jobs: Optional[int] = 1,
+    precision="float64",
+) -> np.ndarray:
+    """ Chi2 values (not divided by the number of degrees of freedom) of all
+    pairs of distributions, if the covariance matrix of the distributions
+    before normalization is the same for all of them.
+
+    In this case, the summed covariance matrix of the normalized
+    distributions ``i`` and ``j`` is ``cov * (1/norm_i^2 + 1/norm_j^2)``, so
+    the data is whitened once with the Cholesky factor of ``cov`` and the
+    chi2 values are squared euclidean distances up to this factor.
+
+    Args:
+        data: ``n x nbins`` array of normalized distributions
+        norms: Norms of the distributions before normalization
+        cov: Covariance matrix of the distributions before normalization
+        n_jobs: Number of processes (see
+            :func:`~clusterking.maths.metric_utils.parallel_condensed`)
+        precision: ``"float64"`` or ``"mixed"`` (squared euclidean distances
+            from 32 bit float matrix products, see
+            :func:`~clusterking.maths.metric_utils.mixed_sqeuclidean_block`)
+
+    Returns:
+        Condensed distance matrix
+    """
+    cholesky = np.linalg.cholesky(cov)
+    whitened = scipy.linalg.solve_triangular(cholesky, data.T, lower=True).T
+    if precision == "mixed":
+        # Small norms keep the rounding errors of the scalar products small
+        whitened -= whitened.mean(axis=0)
+        out = parallel_condensed(
+            pairwise_condensed,
+            len(data),
+            {"data": whitened},
+            n_jobs=n_jobs,
+            pairwise=mixed_sqeuclidean_block,
+        )
+    elif n_jobs is None or n_jobs == 1:
+        out = scipy.spatial.distance.pdist(whitened, "sqeuclidean")
+    else:
+        out = parallel_condensed(
+            pdist_condensed,
+            len(data),
+            {"data": whitened},
+            n_jobs=n_jobs,
+            metric="sqeuclidean",
+        )
+    scales = 1 / np.square(norms)
+    n = len(data)
+    for i in range(n - 1):
+        offset = condensed_offset(n, i)
+        out[offset : offset + n - i - 1] /= scales[i] + scales[i + 1 :]
+    return out
+
+
+def chi2_metric(
+    dwe: DataWithErrors,
+    output="condensed",
+    chunk_size: Optional[int] = None,
+    max_memory: Optional[float] = None,
+    n_jobs: Optional[int] = 1,
+    whiten: Optional[bool] = None,
+    path: Optional[Union[str, PurePath]] = None,
+    precision="float64",
+    tolerance=1e-4,
+    check_pairs=1000,
+):
     """
     Returns the chi2/ndf values of the comparison of a datasets.
 
+    Each distinct pair of sample points is only compared once (see
+    :func:`chi2_condensed`).
+
     Args:
         dwe: :py:class:`clusterking.data.dwe.DataWithErrors` object
-        output: 'condensed' (condensed distance matrix) or 'full' (full distance
-            matrix)
+        output: 'condensed' (condensed distance matrix), 'full' (full distance
+            matrix) or 'distance_matrix'
+            (:class:`~clusterking.maths.distance_matrix.DistanceMatrix`)
+        chunk_size: Maximal number of pairs of sample points that are
+            compared at once. Default: As many as ``nbins x nbins`` matrices
+            fit into ``2 ** 22`` numbers.
+        max_memory: Alternatively to ``chunk_size``: Rough upper limit on the
+            memory for the comparisons (in bytes, per process)
+        n_jobs: Number of processes (see
+            :func:`~clusterking.maths.metric_utils.parallel_condensed`)
+        whiten: If the covariance matrix is the same for all sample points
+            (only absolute errors that were added with the ``add_err_...``
+            methods of :class:`~clusterking.data.DataWithErrors` with the
+            same errors for all sample points), the data can be whitened
+            instead of solving a linear system for every pair (see
+            :func:`chi2_whitened`), which is much faster. ``None`` (default):
+            Detect this case, ``True``: Require it, ``False``: Never whiten.
+        path: Only for ``output='distance_matrix'``: Write the distance matrix
+            to this (``.npy``) file, which is memory-mapped rather than kept
+            in memory
+        precision: ``"float64"`` or ``"mixed"``: When whitening, compute the
+            matrix products in 32 bit floats and sum the results in 64 bit
+            floats (see :func:`chi2_whitened`; otherwise 64 bit floats are
+            used, because the per-pair linear solves don't get faster in
+            32 bit floats). The chi2 values of ``check_pairs`` randomly
+            chosen pairs are recomputed in 64 bit floats. If their maximal
+            relative deviation exceeds ``tolerance``, all chi2 values are
+            computed again in 64 bit floats. The result of the check is
+            saved in the metadata of the
+            :class:`~clusterking.maths.distance_matrix.DistanceMatrix`
+            (``md["precision"]``, see
+            :func:`~clusterking.maths.metric_utils.mixed_precision`).
+        tolerance: Only for ``precision="mixed"``: Maximal relative deviation
+        check_pairs: Only for ``precision="mixed"``: Number of pairs that
+            are checked
 
     Returns:
-        Condensed distance matrix or full distance matrix
+        Condensed distance matrix, full distance matrix or
+        :class:`~clusterking.maths.distance_matrix.DistanceMatrix`
 
     """
     if not isinstance(dwe, DataWithErrors):
@@ -89,28 +344,87 @@ def chi2_metric(dwe: DataWithErrors, output="condensed"):
             "object with added errors, however you supplied an object of type "
             "{type}. ".format(type=type(dwe))
         )
+    if output not in ["condensed", "full", "distance_matrix"]:
+        raise ValueError("Unknown argument '{}'.".format(output))
+    if path is not None and output != "distance_matrix":
+        raise ValueError(
+            "Writing to a file is only supported for "
+            "output='distance_matrix'."
+        )
+    check_precision(precision)
+
+    n_bins = dwe.nbins
+    if chunk_size is None:
+        # Summed covariance matrices, the temporaries while building them
+        # and their LU decompositions
+        chunk_size = chunk_size_from_memory(n_bins, max_memory, n_arrays=3)
+    if chunk_size is None:
+        # Never build the covariance matrices of all sample points at once
+        chunk_size = max(1, 2 ** 22 // max(n_bins, 1) ** 2)
 
-    d = dwe.data()
-    n_obs, n_bins = d.shape
+    data, norms, cov = _normalized_chi2_input(dwe)
+    uniform_cov = None
+    if whiten or whiten is None:
+        uniform_cov = cov.uniform_cov
+        if whiten and uniform_cov is None:
+            raise ValueError(
+                "Whitening requires that the covariance matrix is the same "
+                "for all sample points (only absolute errors)."
+            )
 
-    cov = dwe.cov(relative=False)
-    assert cov.shape == (n_obs, n_bins, n_bins)
+    chi2ndf = DistanceMatrix.empty(len(data), path=path)
+    if uniform_cov is not None:
 
-    # n x n
-    chi2s = np.full((n_obs, n_obs), np.nan)
-    # todo: this calculates the full n x n matrix, even though it's symmetric
-    #    so we could likely optimize this if we wanted
-    for i in range(n_obs):
-        chi2s[i, :] = chi2(d, d[i], cov, cov[i], normalize=True)
+        def compute(_precision):
+            chi2ndf.condensed[:] = chi2_whitened(
+                data, norms, uniform_cov, n_jobs=n_jobs, precision=_precision
+            )
+            return chi2ndf.condensed
 
-    # todo: check for symmetry and vanishing diagonal of matrix here
+        def exact(i, j):
+            scales = 1 / np.square(norms[i]) + 1 / np.square(norms[j])
+            summed_cov = uniform_cov[np.newaxis] * scales[:, None, None]
+            return _chi2_pairs(data[j] - data[i], summed_cov)
 
+        if precision == "mixed":
+            _, chi2ndf.md["precision"] = mixed_precision(
+                compute,
+                exact,
+                tolerance=tolerance,
+                check_pairs=check_pairs,
+                log=get_logger("metric"),
+            )
+        else:
+            compute(precision)
+    else:
+        if precision == "mixed":
+            # Batched solves of small linear systems are not faster in 32
+            # bit floats
+            get_logger("metric").info(
+                "Mixed precision is only used when whitening. Computing the "
+                "chi2 values in 64 bit floats."
+            )
+            chi2ndf.md["precision"] = {"precision": "float64"}
+        # Only the components of the covariance matrices are shared, the
+        # dense matrices are built for every batch of pairs
+        arrays = {"data": data, "scales": 1 / np.square(norms)}
+        for name, array in cov.components().items():
+            arrays["cov_" + name] = array
+        parallel_condensed(
+            chi2_structured_condensed,
+            len(data),
+            arrays,
+            n_jobs=n_jobs,
+            out=chi2ndf.condensed,
+            chunk_size=chunk_size,
+        )
     ndf = n_bins - 1
-    chi2ndf = chi2s / np.full((1, 1), ndf)
+    chi2ndf.condensed /= ndf
+    chi2ndf.flush()
 
-    if output == "condensed":
-        return condense_distance_matrix(chi2ndf)
-    elif output == "full":
+    if output == "distance_matrix":
         return chi2ndf
+    elif output == "condensed":
+        return chi2ndf.condensed
     else:
-        raise ValueError("Unknown argument '{}'.".format(output))
+        return chi2ndf.uncondense()
@@ -4,44 +4,646 @@
 has dependencies on the DWE class.
 """
 
+# std
+import functools
+import multiprocessing
+import os
+from typing import Any, Callable, Dict, Optional, List, Tuple, Union
+
 # 3rd
 import scipy.spatial
-import functools
-from typing import Callable
 import numpy as np
 
 # ours
+from clusterking.util.log import get_logger
 
 
-def condense_distance_matrix(matrix):
+def condense_distance_matrix(matrix, checks: Union[bool, int] = True):
     """ Convert a square-form distance matrix  to a vector-form distance vector
 
     Args:
         matrix: n x n symmetric matrix with 0 diagonal
+        checks: Check that the matrix is symmetric and has a vanishing
+            diagonal (up to rounding errors). True: Check all entries (block
+            by block, without building further n x n arrays), integer: Only
+            check the entries between this number of randomly chosen points,
+            False: Don't check.
 
     Returns:
         n choose 2 vector
     """
-    assert matrix.ndim == 2
+    matrix = np.asarray(matrix)
+    if not matrix.ndim == 2 or not matrix.shape[0] == matrix.shape[1]:
+        raise ValueError(
+            "Distance matrix has to be square, but has shape {}.".format(
+                matrix.shape
+            )
+        )
     # Let's do the checks ourselves, because scipy checks for exact symmetry,
     # which we won't achieve due to rounding errors.
-    assert np.isclose(matrix - matrix.T, 0).all()
-    assert np.isclose(np.diag(matrix), 0.0).all()
+    n = len(matrix)
+    if checks is True:
+        # Compare blocks of rows with the corresponding blocks of columns
+        block = max(1, 2 ** 20 // max(n, 1))
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            rows = matrix[start:stop]
+            _check_distances(
+                rows, matrix[:, start:stop].T, rows[:, start:stop].diagonal()
+            )
+    elif checks:
+        points = np.random.choice(n, min(int(checks), n), replace=False)
+        sub = matrix[np.ix_(points, points)]
+        _check_distances(sub, sub.T, sub.diagonal())
     return scipy.spatial.distance.squareform(matrix, checks=False)
 
 
-def uncondense_distance_matrix(vector):
+def _check_distances(block, transposed, diagonal) -> None:
+    """ Raise ValueError if a block of a distance matrix is not symmetric or
+    has a non-vanishing diagonal (up to rounding errors).
+
+    Args:
+        block: Block of the distance matrix
+        transposed: Transposed mirror block of the distance matrix
+        diagonal: Diagonal entries
+
+    Returns:
+        None
+    """
+    if not np.isclose(block, transposed).all():
+        raise ValueError("Distance matrix is not symmetric.")
+    if not np.isclose(diagonal, 0.0).all():
+        raise ValueError("Distance matrix has non-vanishing diagonal.")
+
+
+def uncondense_distance_matrix(vector, out: Optional[np.ndarray] = None):
     """ Convert a vector-form distance vector to a square-form distance matrix
 
     Args:
-        vector: n choose 2 vector
+        vector: n choose 2 vector or
+            :class:`~clusterking.maths.distance_matrix.DistanceMatrix`
+        out: Only for a
+            :class:`~clusterking.maths.distance_matrix.DistanceMatrix`: n x n
+            array to write to (e.g. memory-mapped)
 
     Returns:
         n x n symmetric matrix with 0 diagonal
     """
+    if hasattr(vector, "uncondense"):
+        # DistanceMatrix (not imported here to avoid circular imports)
+        return vector.uncondense(out=out)
     return scipy.spatial.distance.squareform(vector)
 
 
+def condensed_offset(n: int, i: int) -> int:
+    """ Position of the entry ``(i, i + 1)`` in the condensed distance matrix
+    of ``n`` points (the entries ``(i, j)`` with ``j > i`` follow it).
+
+    Args:
+        n: Number of points
+        i: Row
+
+    Returns:
+        Position in the condensed distance matrix
+    """
+    return n * i - i * (i + 1) // 2
+
+
+#: Numpy views of the shared arrays in worker processes of
+#: :func:`parallel_condensed`
+_worker_arrays = {}  # type: Dict[str, np.ndarray]
+
+
+def _init_worker(shared) -> None:
+    """ Initialize worker process of :func:`parallel_condensed`. """
+    _worker_arrays.clear()
+    for name, (kind, source, offset, shape) in shared.items():
+        if kind == "memmap":
+            # Output that is a memory-mapped file: Map it in the worker as
+            # well
+            _worker_arrays[name] = np.memmap(
+                source, dtype=np.float64, mode="r+", offset=offset, shape=shape
+            )
+        else:
+            size = int(np.prod(shape))
+            _worker_arrays[name] = np.frombuffer(source, dtype=np.float64)[
+                :size
+            ].reshape(shape)
+
+
+def _run_block(task) -> None:
+    """ Fill rows of the condensed distance matrix in a worker process of
+    :func:`parallel_condensed`. """
+    kernel, rows, kwargs = task
+    arrays = dict(_worker_arrays)
+    out = arrays.pop("out")
+    kernel(rows=rows, out=out, **arrays, **kwargs)
+    if isinstance(out, np.memmap):
+        out.flush()
+
+
+def _row_blocks(n: int, n_blocks: int) -> List[range]:
+    """ Split the rows of a condensed distance matrix of ``n`` points into
+    consecutive blocks with roughly the same number of pairs. """
+    pairs = np.cumsum(np.arange(n - 1, 0, -1))
+    if len(pairs) == 0:
+        return []
+    # A block ends after the row where the cumulative number of pairs
+    # reaches its share
+    bounds = (
+        np.searchsorted(pairs, np.linspace(0, pairs[-1], n_blocks + 1)[1:-1])
+        + 1
+    )
+    bounds = np.unique(np.concatenate([[0], bounds, [n - 1]]))
+    return [
+        range(start, stop)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+        if stop > start
+    ]
+
+
+def parallel_condensed(
+    kernel: Callable,
+    n: int,
+    arrays: Dict[str, np.ndarray],
+    n_jobs: Optional[int] = 1,
+    out: Optional[np.ndarray] = None,
+    **kwargs
+) -> np.ndarray:
+    """ Compute a condensed distance matrix of ``n`` points, optionally
+    distributing the rows over several processes.
+
+    The arrays and the output are put into shared memory, so they are not
+    copied to the worker processes, which write their rows of the output in
+    place. If the output is a memory-mapped file (:class:`numpy.memmap`), the
+    workers write to the file directly.
+
+    Args:
+        kernel: Function that is called as
+            ``kernel(rows=rows, out=out, **arrays, **kwargs)`` and fills the
+            entries ``(i, j)`` for ``i`` in ``rows`` and ``j > i`` of the
+            condensed distance matrix ``out``. Has to be a globally defined
+            function.
+        n: Number of points
+        arrays: Named arrays that are passed to the kernel (converted to 64
+            bit floats)
+        n_jobs: Number of processes. ``None`` or 1: Compute in this process,
+            -1: Use all CPUs.
+        out: Condensed distance matrix (64 bit floats) to write to. Default:
+            New array.
+        **kwargs: Further keyword arguments to the kernel
+
+    Returns:
+        Condensed distance matrix (``out`` if given)
+    """
+    if n_jobs is not None and n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    n_pairs = n * (n - 1) // 2
+    if out is None:
+        out = np.zeros(n_pairs)
+    elif out.shape != (n_pairs,) or out.dtype != np.float64:
+        raise ValueError(
+            "Output has to be a vector of {} 64 bit floats.".format(n_pairs)
+        )
+    if not n_jobs or n_jobs == 1 or n < 3:
+        kernel(rows=range(n), out=out, **arrays, **kwargs)
+        return out
+
+    shared = {}
+    views = {}
+    for name, array in arrays.items():
+        array = np.asarray(array, dtype=np.float64)
+        raw = multiprocessing.RawArray("d", max(array.size, 1))
+        view = np.frombuffer(raw, dtype=np.float64)[: array.size]
+        view[:] = array.reshape(-1)
+        shared[name] = ("raw", raw, 0, array.shape)
+        views[name] = view
+    memmapped = isinstance(out, np.memmap) and out.filename is not None
+    if memmapped:
+        out.flush()
+        shared["out"] = ("memmap", out.filename, out.offset, out.shape)
+    else:
+        raw = multiprocessing.RawArray("d", max(n_pairs, 1))
+        shared["out"] = ("raw", raw, 0, out.shape)
+        views["out"] = np.frombuffer(raw, dtype=np.float64)[:n_pairs]
+
+    # Several blocks per process, so that processes that finish early can
+    # take over work
+    blocks = _row_blocks(n, 4 * n_jobs)
+    pool = multiprocessing.Pool(
+        processes=n_jobs, initializer=_init_worker, initargs=(shared,)
+    )
+    try:
+        for _ in pool.imap_unordered(
+            _run_block, [(kernel, rows, kwargs) for rows in blocks]
+        ):
+            pass
+    finally:
+        pool.close()
+        pool.join()
+    if not memmapped:
+        out[:] = views["out"]
+    return out
+
+
+def pairwise_condensed(
+    rows: range,
+    out: np.ndarray,
+    data: np.ndarray,
+    pairwise: Callable,
+    chunk_size: Optional[int] = None,
+    **kwargs
+) -> np.ndarray:
+    """ Kernel for :func:`parallel_condensed` that evaluates a pairwise block
+    function on blocks of rows and writes the upper triangle directly to the
+    condensed distance matrix, so that the full distance matrix is never
+    built.
+
+    Args:
+        rows: Consecutive rows to compute
+        out: Condensed distance matrix to write to
+        data: ``n x nbins`` array
+        pairwise: Function that is called as ``pairwise(x, y, **kwargs)``
+            with two blocks of points (``k x nbins`` and ``l x nbins`` arrays)
+            and returns the ``k x l`` array of their distances. Has to be a
+            globally defined function to be used with several processes.
+        chunk_size: Maximal number of distances that are computed at once.
+            Default: ``max(n, 2 ** 20)``.
+        **kwargs: Keyword arguments to ``pairwise``
+
+    Returns:
+        ``out``
+    """
+    n = len(data)
+    if len(rows) == 0:
+        return out
+    if chunk_size is None:
+        chunk_size = max(n, 2 ** 20)
+    start, stop = rows[0], rows[-1] + 1
+    while start < stop:
+        # Compare a block of rows with all points that follow the first row
+        # of the block
+        block = min(stop - start, max(1, chunk_size // (n - start)))
+        distances = np.asarray(
+            pairwise(data[start : start + block], data[start:], **kwargs)
+        )
+        if distances.shape != (block, n - start):
+            raise ValueError(
+                "Pairwise function returned an array of shape {}, but "
+                "{} was expected.".format(distances.shape, (block, n - start))
+            )
+        for k in range(block):
+            i = start + k
+            offset = condensed_offset(n, i)
+            out[offset : offset + n - i - 1] = distances[k, k + 1 :]
+        start += block
+    return out
+
+
+def pdist_condensed(
+    rows: range,
+    out: np.ndarray,
+    data: np.ndarray,
+    metric="euclidean",
+    chunk_size: Optional[int] = None,
+    **kwargs
+) -> np.ndarray:
+    """ Kernel for :func:`parallel_condensed` that uses the metrics of
+    :func:`scipy.spatial.distance.cdist`.
+
+    Args:
+        rows: Consecutive rows to compute
+        out: Condensed distance matrix to write to
+        data: ``n x nbins`` array
+        metric: Name of metric
+        chunk_size: Maximal number of distances that are computed at once
+            (see :func:`pairwise_condensed`)
+        **kwargs: Keyword arguments to :func:`scipy.spatial.distance.cdist`
+
+    Returns:
+        ``out``
+    """
+    return pairwise_condensed(
+        rows,
+        out,
+        data,
+        scipy.spatial.distance.cdist,
+        chunk_size=chunk_size,
+        metric=metric,
+        **kwargs
+    )
+
+
+def check_pairwise(
+    pairwise: Callable, data: np.ndarray, n_samples=100, **kwargs
+) -> None:
+    """ Check that a pairwise block function (see :func:`pairwise_condensed`)
+    is symmetric and vanishes for identical points, using the distances
+    between randomly chosen points.
+
+    Args:
+        pairwise: Pairwise block function
+        data: ``n x nbins`` array
+        n_samples: Number of points to check
+        **kwargs: Keyword arguments to ``pairwise``
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the checks fail
+    """
+    n = len(data)
+    points = data[np.random.choice(n, min(n_samples, n), replace=False)]
+    others = data[np.random.choice(n, min(n_samples, n), replace=False)]
+    _check_distances(
+        np.asarray(pairwise(points, others, **kwargs)),
+        np.asarray(pairwise(others, points, **kwargs)).T,
+        np.asarray(pairwise(points, points, **kwargs)).diagonal(),
+    )
+
+
+#: Allowed values of the ``precision`` arguments of the metrics
+precisions = ["float64", "mixed"]
+
+#: Pairs whose squared distance is smaller than this factor times the float32
+#: rounding error of the squared norms are recomputed in float64 by
+#: :func:`mixed_sqeuclidean_block`
+_CANCELLATION_FACTOR = 1e4
+
+
+def mixed_sqeuclidean_block(
+    x: np.ndarray, y: np.ndarray, chunk_size: Optional[int] = None
+) -> np.ndarray:
+    """ Pairwise block function (see :func:`pairwise_condensed`) for squared
+    euclidean distances in mixed precision: The scalar products of the points
+    are computed as a 32 bit float matrix product, the squared norms and the
+    distances in 64 bit floats.
+
+    Pairs of points that are close compared to their norms would lose their
+    precision in the difference of the squared norms and the scalar products
+    and are recomputed in 64 bit floats. Centering the points first keeps
+    their number small. For nearly identical points, almost all pairs are
+    recomputed, so this happens in chunks of pairs.
+
+    Args:
+        x: ``k x nbins`` array (64 bit floats)
+        y: ``l x nbins`` array (64 bit floats)
+        chunk_size: Maximal number of entries of the differences of the
+            pairs that are recomputed at once. Default: ``k x l``, so that
+            the memory stays bounded by the size of the block.
+
+    Returns:
+        ``k x l`` array (64 bit floats)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    products = x.astype(np.float32) @ y.astype(np.float32).T
+    norms_x = np.einsum("ij,ij->i", x, x)[:, np.newaxis]
+    norms_y = np.einsum("ij,ij->i", y, y)[np.newaxis, :]
+    distances = norms_x + norms_y - 2 * products.astype(np.float64)
+    bound = (
+        _CANCELLATION_FACTOR * np.finfo(np.float32).eps * (norms_x + norms_y)
+    )
+    rows, cols = np.nonzero(distances <= bound)
+    if chunk_size is None:
+        chunk_size = distances.size
+    step = max(1, int(chunk_size) // max(x.shape[1], 1))
+    for start in range(0, len(rows), step):
+        r = rows[start : start + step]
+        c = cols[start : start + step]
+        distances[r, c] = np.square(x[r] - y[c]).sum(axis=1)
+    return distances
+
+
+def random_pairs(n: int, n_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+    """ Randomly chosen pairs ``(i, j)`` with ``i < j`` of ``n`` points.
+
+    Args:
+        n: Number of points
+        n_samples: Number of pairs (can contain duplicates)
+
+    Returns:
+        Arrays ``i`` and ``j``
+    """
+    if n < 2 or n_samples <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    i = np.random.randint(0, n, size=n_samples)
+    j = np.random.randint(0, n - 1, size=n_samples)
+    j[j >= i] += 1
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def max_relative_deviation(
+    condensed: np.ndarray, exact: Callable, n_samples=1000
+) -> float:
+    """ Maximal relative deviation of a condensed distance matrix from the
+    distances of randomly chosen pairs of points that are recomputed in 64
+    bit floats.
+
+    Args:
+        condensed: Condensed distance matrix
+        exact: Function that is called as ``exact(i, j)`` with two arrays of
+            point indizes and returns the distances of the pairs
+            ``(i[k], j[k])`` in 64 bit floats
+        n_samples: Number of pairs
+
+    Returns:
+        Maximal relative deviation (0 if there are no pairs)
+    """
+    n = int(np.ceil(np.sqrt(2 * len(condensed))))
+    i, j = random_pairs(n, n_samples)
+    if len(i) == 0:
+        return 0.0
+    expected = np.asarray(exact(i, j), dtype=np.float64)
+    computed = np.asarray(condensed)[condensed_offset(n, i) + j - i - 1]
+    deviation = np.abs(computed - expected) / np.maximum(
+        np.abs(expected), np.finfo(np.float64).tiny
+    )
+    return float(deviation.max())
+
+
+def mixed_precision(
+    compute: Callable,
+    exact: Callable,
+    tolerance=1e-4,
+    check_pairs=1000,
+    log=None,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """ Compute a condensed distance matrix in mixed precision and check it
+    against randomly chosen pairs that are recomputed in 64 bit floats (see
+    :func:`max_relative_deviation`). If the deviation exceeds the tolerance,
+    the distance matrix is computed again in 64 bit floats.
+
+    Args:
+        compute: Function that is called as ``compute(precision)`` with
+            ``"mixed"`` or ``"float64"`` and returns the condensed distance
+            matrix
+        exact: Function that returns the distances of pairs of points in 64
+            bit floats (see :func:`max_relative_deviation`)
+        tolerance: Maximal relative deviation
+        check_pairs: Number of randomly chosen pairs of points
+        log: Logger for a warning about the fallback
+
+    Returns:
+        Condensed distance matrix and metadata: ``"precision"`` (the
+        precision of the result), ``"max_relative_deviation"`` (of the mixed
+        precision result), ``"tolerance"`` and ``"check_pairs"``
+    """
+    condensed = compute("mixed")
+    deviation = max_relative_deviation(condensed, exact, n_samples=check_pairs)
+    md = {
+        "precision": "mixed",
+        "max_relative_deviation": deviation,
+        "tolerance": tolerance,
+        "check_pairs": check_pairs,
+    }
+    if deviation > tolerance:
+        if log is not None:
+            log.warning(
+                "Maximal relative deviation {:.2e} of the distances in mixed "
+                "precision exceeds the tolerance {:.2e}. Computing them in "
+                "64 bit floats.".format(deviation, tolerance)
+            )
+        condensed = compute("float64")
+        md["precision"] = "float64"
+    return condensed, md
+
+
+def check_precision(precision: str) -> None:
+    """ Raise ValueError for unknown values of the ``precision`` arguments
+    of the metrics """
+    if precision not in precisions:
+        raise ValueError(
+            "Unknown precision '{}'. Available: {}.".format(
+                precision, ", ".join(precisions)
+            )
+        )
+
+
+def mixed_euclidean_metric(
+    squared=False,
+    n_jobs: Optional[int] = 1,
+    chunk_size: Optional[int] = None,
+    reduced=False,
+    tolerance=1e-4,
+    check_pairs=1000,
+) -> Callable:
+    """ Euclidean metric in mixed precision (see
+    :func:`mixed_sqeuclidean_block` and :func:`mixed_precision`).
+
+    Args:
+        squared: Squared euclidean distances
+        n_jobs: Number of processes (see :func:`parallel_condensed`)
+        chunk_size: Maximal number of distances that are computed at once
+        reduced: Use the coordinates of the principal components (see
+            :meth:`clusterking.data.Data.reduced_data`) instead of the bins
+        tolerance: Maximal relative deviation from the distances in 64 bit
+            floats, above which they are computed again in 64 bit floats
+        check_pairs: Number of randomly chosen pairs of points with which
+            the deviation is determined
+
+    Returns:
+        Function that takes Data object as only parameter and returns a
+        :class:`~clusterking.maths.distance_matrix.DistanceMatrix` with the
+        result of the check in its metadata (``md["precision"]``).
+    """
+    # Imported here to avoid circular imports
+    from clusterking.maths.distance_matrix import DistanceMatrix
+
+    def metric(data):
+        values = data.reduced_data() if reduced else data.data()
+        values = np.array(values, dtype=np.float64)
+        # Small norms keep the rounding errors of the scalar products small
+        values -= values.mean(axis=0)
+
+        def compute(precision):
+            if precision == "mixed":
+                distances = parallel_condensed(
+                    pairwise_condensed,
+                    len(values),
+                    {"data": values},
+                    n_jobs=n_jobs,
+                    pairwise=mixed_sqeuclidean_block,
+                    chunk_size=chunk_size,
+                )
+                return distances if squared else np.sqrt(distances, distances)
+            name = "sqeuclidean" if squared else "euclidean"
+            if n_jobs is None or n_jobs == 1:
+                return scipy.spatial.distance.pdist(values, name)
+            return parallel_condensed(
+                pdist_condensed,
+                len(values),
+                {"data": values},
+                n_jobs=n_jobs,
+                metric=name,
+            )
+
+        def exact(i, j):
+            distances = np.square(values[i] - values[j]).sum(axis=1)
+            return distances if squared else np.sqrt(distances)
+
+        condensed, md = mixed_precision(
+            compute,
+            exact,
+            tolerance=tolerance,
+            check_pairs=check_pairs,
+            log=get_logger("metric"),
+        )
+        return DistanceMatrix(condensed, md={"precision": md})
+
+    return metric
+
+
+def pairwise_metric(
+    pairwise: Callable,
+    n_jobs: Optional[int] = 1,
+    chunk_size: Optional[int] = None,
+    checks: int = 100,
+    reduced=False,
+    **kwargs
+) -> Callable:
+    """ Metric from a pairwise block function that is applied to the bin
+    contents of the data. The distances are written directly to the
+    condensed distance matrix (see :func:`pairwise_condensed`).
+
+    Args:
+        pairwise: Function that is called as ``pairwise(x, y, **kwargs)``
+            with two blocks of points (``k x nbins`` and ``l x nbins`` arrays)
+            and returns the ``k x l`` array of their distances. Has to be a
+            globally defined function to be used with several processes.
+        n_jobs: Number of processes (see :func:`parallel_condensed`)
+        chunk_size: Maximal number of distances that are computed at once
+        checks: Number of randomly chosen points with which it is checked that
+            ``pairwise`` is symmetric and vanishes for identical points (see
+            :func:`check_pairwise`). 0: Don't check.
+        reduced: Apply ``pairwise`` to the coordinates of the principal
+            components (see :meth:`clusterking.data.Data.reduced_data`)
+            rather than to the bin contents
+        **kwargs: Keyword arguments to ``pairwise``
+
+    Returns:
+        Function that takes Data object as only parameter and returns a
+        reduced distance matrix.
+    """
+
+    def metric(data):
+        values = data.reduced_data() if reduced else data.data()
+        if checks:
+            check_pairwise(pairwise, values, n_samples=checks, **kwargs)
+        return parallel_condensed(
+            pairwise_condensed,
+            data.n,
+            {"data": values},
+            n_jobs=n_jobs,
+            pairwise=pairwise,
+            chunk_size=chunk_size,
+            **kwargs
+        )
+
+    return metric
+
+
 def metric_selection(*args, **kwargs) -> Callable:
     """ Select a metric in one of the following ways:
 
@@ -51,6 +653,23 @@ def metric_selection(*args, **kwargs) -> Callable:
        additional arguments will be past to this function).
     3. If the first positional argument is a function, we take this function
        (and add all additional arguments to it).
+    4. If the first positional argument is the name of one of the metrics for
+       binned distributions (``"hellinger"``, ``"symmetric_kl"``,
+       ``"jensen_shannon"``, ``"wasserstein"``, ``"kolmogorov_smirnov"``),
+       we take this metric (all arguments are passed to
+       :func:`~clusterking.maths.histogram_metric.histogram_metric`).
+    5. If no positional arguments, but the keyword argument ``pairwise`` is
+       given, this is a function that returns the distances between two
+       blocks of points, which are written directly to the condensed distance
+       matrix (see :func:`pairwise_metric`, all keyword arguments are passed
+       to this function).
+    6. If the first positional argument is ``"knn_graph"`` or
+       ``"radius_graph"``, the metric returns a sparse graph of the
+       distances to the nearest neighbours of every sample point rather than
+       a condensed distance matrix (all arguments are passed to
+       :func:`~clusterking.maths.neighbour_graph.graph_metric`). This is
+       only supported by single linkage hierarchical clustering and by
+       :class:`~clusterking.cluster.DBSCANCluster`.
 
     Examples:
 
@@ -59,6 +678,27 @@ def metric_selection(*args, **kwargs) -> Callable:
     * ``...(lambda data: scipy.spatial.distance.pdist(data.data(),
       'euclidean')``: Also Euclidean metric
     * ``...("minkowski", p=2)``: Minkowsky distance with ``p=2``.
+    * ``...("euclidean", n_jobs=8)``: Euclidean metric, computed with 8
+      processes (see :func:`parallel_condensed`). Functions such as
+      :func:`clusterking.maths.metric.chi2_metric` also accept ``n_jobs``.
+    * ``...(pairwise=scipy.spatial.distance.cdist)``: Also Euclidean metric
+    * ``...("hellinger", n_jobs=8)``: Hellinger distance between the
+      normalized distributions, computed with 8 processes
+    * ``...("euclidean", reduced=True)``: Euclidean metric on the
+      coordinates of the principal components that were determined by
+      :class:`clusterking.preprocess.PCA` (see
+      :meth:`clusterking.data.Data.reduced_data`). Only for metrics that are
+      selected by name from ``scipy.spatial.distance.pdist`` and for
+      ``pairwise``.
+    * ``...("euclidean", precision="mixed")``: Euclidean metric computed
+      with 32 bit float matrix products and 64 bit float sums, checked
+      against randomly chosen pairs of points in 64 bit floats (see
+      :func:`mixed_euclidean_metric`, also for ``"sqeuclidean"``; further
+      arguments: ``tolerance``, ``check_pairs``, ``n_jobs``, ``chunk_size``,
+      ``reduced``). :func:`clusterking.maths.metric.chi2_metric` also
+      accepts ``precision="mixed"``.
+    * ``...("knn_graph", k=10)``: Euclidean distances from every sample point
+      to its 10 nearest neighbours as a sparse graph
 
     See
     https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.distance.pdist.html
@@ -72,15 +712,71 @@ def metric_selection(*args, **kwargs) -> Callable:
         Function that takes Data object as only parameter and returns a
         reduced distance matrix.
     """
+    if len(args) == 0 and "pairwise" in kwargs:
+        return pairwise_metric(**kwargs)
     if len(args) == 0:
         # default
         args = ["euclidean"]
     if isinstance(args[0], str):
+        # Imported here to avoid circular imports
+        from clusterking.maths.histogram_metric import (
+            histogram_metric,
+            histogram_metrics,
+        )
+
+        from clusterking.maths.neighbour_graph import (
+            graph_metric,
+            graph_metrics,
+        )
+
+        if args[0] in graph_metrics:
+            return graph_metric(*args, **kwargs)
+        if args[0] in histogram_metrics:
+            if kwargs.get("reduced"):
+                raise ValueError(
+                    "Metric '{}' compares distributions and can't be applied "
+                    "to reduced coordinates.".format(args[0])
+                )
+            kwargs.pop("reduced", None)
+            return histogram_metric(*args, **kwargs)
         # The user can specify any of the metrics from
         # scipy.spatial.distance.pdist by name and supply additional
         # values
+        precision = kwargs.pop("precision", "float64")
+        check_precision(precision)
+        if precision == "mixed":
+            if args[0] not in ["euclidean", "sqeuclidean"] or args[1:]:
+                raise ValueError(
+                    "Mixed precision is only supported for the euclidean and "
+                    "squared euclidean metric, not '{}'.".format(args[0])
+                )
+            return mixed_euclidean_metric(
+                squared=args[0] == "sqeuclidean", **kwargs
+            )
+        n_jobs = kwargs.pop("n_jobs", 1)
+        reduced = kwargs.pop("reduced", False)
+
+        def values(data):
+            return data.reduced_data() if reduced else data.data()
+
+        if n_jobs is not None and n_jobs != 1:
+            if args[1:]:
+                raise ValueError(
+                    "Parameters of metric '{}' have to be given as keyword "
+                    "arguments to use several processes (e.g. "
+                    "('minkowski', p=2, n_jobs=4) rather than "
+                    "('minkowski', 2, n_jobs=4)).".format(args[0])
+                )
+            return lambda data: parallel_condensed(
+                pdist_condensed,
+                data.n,
+                {"data": values(data)},
+                n_jobs=n_jobs,
+                metric=args[0],
+                **kwargs
+            )
         return lambda data: scipy.spatial.distance.pdist(
-            data.data(), args[0], *args[1:], **kwargs
+            values(data), args[0], *args[1:], **kwargs
         )
     elif isinstance(args[0], Callable):
         # Assume that this is a function that takes DWE or Data as first
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+""" Sparse graphs of the distances between neighbouring sample points.
+
+Rather than the distances between all pairs of sample points, only the
+distances to the ``k`` nearest neighbours or to all points within a radius are
+computed with a KD-tree. The result is a symmetric sparse matrix, so that
+clustering scales roughly linearly with the number of sample points.
+The graphs can be selected by name with the ``set_metric`` methods of
+:class:`~clusterking.cluster.HierarchyCluster` (single linkage only) and
+:class:`~clusterking.cluster.DBSCANCluster` (see
+:func:`~clusterking.maths.metric_utils.metric_selection`), e.g.
+``c.set_metric("knn_graph", k=10)`` or
+``c.set_metric("radius_graph", radius=0.1)``.
+"""
+
+# std
+from typing import Callable, Optional
+
+# 3rd
+import numpy as np
+import scipy
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.spatial
+
+#: Names of the metrics of :func:`graph_metric`
+graph_metrics = ["knn_graph", "radius_graph"]
+
+
+def _query_jobs_kwarg() -> str:
+    """ Name of the keyword argument of :meth:`scipy.spatial.cKDTree.query`
+    that sets the number of processes (``n_jobs`` was renamed to ``workers``
+    in scipy 1.6).
+    """
+    version = tuple(int(v) for v in scipy.__version__.split(".")[:2])
+    if version >= (1, 6):
+        return "workers"
+    return "n_jobs"
+
+
+def neighbour_graph(
+    values: np.ndarray,
+    k: Optional[int] = None,
+    radius: Optional[float] = None,
+    p=2,
+    n_jobs: Optional[int] = 1,
+) -> scipy.sparse.csr_matrix:
+    """ Sparse graph of the distances between neighbouring points.
+
+    Points that are at the same position are connected with the smallest
+    positive float rather than with zero, because zeros are not stored in
+    sparse matrices.
+
+    Args:
+        values: ``n x d`` array of points
+        k: Connect every point with its ``k`` nearest neighbours (the graph is
+            symmetrized, so points can have more neighbours)
+        radius: Connect all points whose distance is at most ``radius``
+        p: Which Minkowski p-norm to use (2: euclidean distance)
+        n_jobs: Number of processes for the ``k`` nearest neighbour queries
+            (-1: all CPUs)
+
+    Returns:
+        Symmetric ``n x n`` :class:`scipy.sparse.csr_matrix`
+    """
+    if (k is None) == (radius is None):
+        raise ValueError("Please specify exactly one of k and radius.")
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    tree = scipy.spatial.cKDTree(values)
+    if k is not None:
+        if n < 2:
+            return scipy.sparse.csr_matrix((n, n))
+        k = min(int(k), n - 1)
+        distances, neighbours = tree.query(
+            values, k=k + 1, p=p, **{_query_jobs_kwarg(): n_jobs or 1}
+        )
+        rows = np.repeat(np.arange(n), k + 1)
+        cols = neighbours.reshape(-1)
+        distances = distances.reshape(-1)
+        keep = rows != cols
+        rows, cols, distances = rows[keep], cols[keep], distances[keep]
+    else:
+        pairs = tree.query_pairs(radius, p=p, output_type="ndarray")
+        rows, cols = pairs[:, 0], pairs[:, 1]
+        distances = np.linalg.norm(values[rows] - values[cols], ord=p, axis=1)
+    distances = np.maximum(distances, np.finfo(np.float64).tiny)
+    graph = scipy.sparse.csr_matrix(
+        (distances, (rows, cols)), shape=(n, n), dtype=np.float64
+    )
+    # Symmetrize (for the k nearest neighbours, the relation isn't symmetric)
+    return graph.maximum(graph.T).tocsr()
+
+
+def single_linkage(graph) -> np.ndarray:
+    """ Single linkage hierarchy (as returned by
+    :func:`scipy.cluster.hierarchy.linkage`) from a sparse distance graph,
+    built from its minimum spanning tree.
+
+    For a graph that contains the distances between all pairs of points, this
+    is the same as the single linkage hierarchy of the full distance matrix.
+    Groups of points that are not connected by the graph are joined at
+    infinite distance.
+
+    Args:
+        graph: Symmetric sparse ``n x n`` matrix of distances
+
+    Returns:
+        ``(n - 1) x 4`` linkage matrix
+    """
+    n = graph.shape[0]
+    tree = scipy.sparse.csgraph.minimum_spanning_tree(graph).tocoo()
+    order = np.argsort(tree.data, kind="stable")
+    edges = list(zip(tree.row[order], tree.col[order], tree.data[order]))
+
+    # Union-find: Every point and every merged cluster gets a node
+    parent = np.arange(2 * n - 1)
+    size = np.ones(2 * n - 1, dtype=np.int64)
+
+    def find(node):
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    linkage = np.zeros((max(n - 1, 0), 4))
+    row = 0
+    for a, b, distance in edges:
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            continue
+        linkage[row] = [min(ra, rb), max(ra, rb), distance, size[ra] + size[rb]]
+        new = n + row
+        parent[ra] = parent[rb] = new
+        size[new] = size[ra] + size[rb]
+        row += 1
+    # Join the connected components of the graph
+    roots = sorted({find(i) for i in range(n)})
+    while len(roots) > 1:
+        ra, rb = roots[0], roots[1]
+        linkage[row] = [ra, rb, np.inf, size[ra] + size[rb]]
+        new = n + row
+        parent[ra] = parent[rb] = new
+        size[new] = size[ra] + size[rb]
+        roots = [new] + roots[2:]
+        row += 1
+    return linkage
+
+
+def graph_metric(
+    name: str,
+    k: Optional[int] = None,
+    radius: Optional[float] = None,
+    normalize=False,
+    whiten=False,
+    reduced=False,
+    p=2,
+    n_jobs: Optional[int] = 1,
+) -> Callable:
+    """ Metric that returns a sparse graph of the distances between
+    neighbouring sample points (see :func:`neighbour_graph`).
+
+    Args:
+        name: ``"knn_graph"`` (``k`` nearest neighbours) or
+            ``"radius_graph"`` (all neighbours within ``radius``)
+        k: Number of nearest neighbours
+        radius: Maximal distance
+        normalize: Use normalized distributions
+        whiten: Divide every bin by its standard deviation over all sample
+            points
+        reduced: Use the coordinates of the principal components (see
+            :meth:`clusterking.data.Data.reduced_data`) instead of the bins
+        p: Which Minkowski p-norm to use (2: euclidean distance)
+        n_jobs: Number of processes for the nearest neighbour queries
+
+    Returns:
+        Function that takes Data object as only parameter and returns a
+        sparse distance graph.
+    """
+    if name not in graph_metrics:
+        raise ValueError(
+            "Unknown graph metric '{}'. Available: {}.".format(
+                name, ", ".join(graph_metrics)
+            )
+        )
+    if name == "knn_graph" and (k is None or radius is not None):
+        raise ValueError("Metric 'knn_graph' requires k (and no radius).")
+    if name == "radius_graph" and (radius is None or k is not None):
+        raise ValueError("Metric 'radius_graph' requires radius (and no k).")
+
+    def metric(data):
+        if reduced:
+            values = np.array(data.reduced_data(), dtype=np.float64)
+        else:
+            values = np.array(data.data(normalize=normalize), dtype=np.float64)
+        if whiten:
+            std = values.std(axis=0)
+            values /= np.where(std > 0, std, 1.0)
+        return neighbour_graph(values, k=k, radius=radius, p=p, n_jobs=n_jobs)
+
+    return metric
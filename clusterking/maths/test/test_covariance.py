@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# std
+import unittest
+
+# 3rd
+import numpy as np
+
+# ours
+from clusterking.maths.covariance import (
+    StructuredCovariance,
+    RunningCovariance,
+    chunk_size_from_memory,
+)
+from clusterking.util.testing import MyTestCase
+
+
+class TestStructuredCovariance(MyTestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.n, self.nbins = 7, 4
+        self.data = rng.uniform(1, 2, size=(self.n, self.nbins))
+        a = rng.normal(size=(self.nbins, self.nbins))
+        self.abs_cov = a @ a.T
+        r = rng.normal(size=(self.nbins, self.nbins))
+        self.rel_cov = 0.01 * r @ r.T
+        self.scale = 3.0
+        self.cov = StructuredCovariance(
+            self.data,
+            abs_cov=self.abs_cov,
+            rel_cov=self.rel_cov,
+            poisson_scale=self.scale,
+        )
+        self.expected = np.array(
+            [
+                self.abs_cov
+                + self.rel_cov * np.outer(d, d)
+                + np.diag(d / self.scale)
+                for d in self.data
+            ]
+        )
+
+    def test_shape(self):
+        self.assertEqual(self.cov.shape, (self.n, self.nbins, self.nbins))
+        self.assertEqual(len(self.cov), self.n)
+        self.assertFalse(self.cov.is_zero)
+        self.assertTrue(StructuredCovariance(self.data).is_zero)
+
+    def test_dense(self):
+        self.assertAllClose(self.cov.dense(), self.expected)
+
+    def test_getitem(self):
+        self.assertAllClose(self.cov[2], self.expected[2])
+        self.assertAllClose(self.cov[1:3], self.expected[1:3])
+        self.assertAllClose(self.cov[[4, 0]], self.expected[[4, 0]])
+
+    def test_diagonal(self):
+        self.assertAllClose(
+            self.cov.diagonal(), self.expected.diagonal(axis1=1, axis2=2)
+        )
+
+    def test_iter_blocks(self):
+        rows = []
+        for _rows, block in self.cov.iter_blocks(chunk_size=3):
+            self.assertAllClose(block, self.expected[_rows])
+            rows.append(_rows)
+        self.assertEqual(
+            rows, [slice(0, 3), slice(3, 6), slice(6, 7)],
+        )
+
+    def test_matvec(self):
+        v = np.arange(self.n * self.nbins).reshape((self.n, self.nbins))
+        self.assertAllClose(
+            self.cov.matvec(v), np.einsum("kij,kj->ki", self.expected, v)
+        )
+
+    def test_solve(self):
+        v = np.arange(self.n * self.nbins).reshape((self.n, self.nbins))
+        x = self.cov.solve(v, chunk_size=2)
+        self.assertAllClose(self.cov.matvec(x), v)
+        self.assertAllClose(self.cov.solve(v[1:3], rows=slice(1, 3)), x[1:3])
+
+    def test_components(self):
+        rng = np.random.RandomState(1)
+        cov = StructuredCovariance(
+            self.data,
+            rel_cov=self.rel_cov,
+            poisson_scale=self.scale,
+            point_factors=[rng.normal(size=(self.n, self.nbins, 2))],
+            point_corrs=[(self.data, np.eye(self.nbins))],
+        )
+        rebuilt = StructuredCovariance.from_components(cov.components())
+        self.assertAllClose(rebuilt.dense(), cov.dense())
+        self.assertEqual(repr(rebuilt), repr(cov))
+
+    def test_uniform_cov(self):
+        self.assertIsNone(self.cov.uniform_cov)
+        cov = StructuredCovariance(self.data, abs_cov=self.abs_cov)
+        self.assertAllClose(cov.uniform_cov, self.abs_cov)
+        self.assertIsNone(StructuredCovariance(self.data).uniform_cov)
+
+    def test_invalid_shape(self):
+        with self.assertRaises(ValueError):
+            StructuredCovariance(self.data, abs_cov=np.eye(2))
+
+    def test_chunk_size_from_memory(self):
+        self.assertIsNone(chunk_size_from_memory(10))
+        self.assertEqual(chunk_size_from_memory(10, 8000), 10)
+        self.assertEqual(chunk_size_from_memory(10, 1), 1)
+
+
+class TestRunningCovariance(MyTestCase):
+    def test_running_covariance(self):
+        vectors = np.random.RandomState(1).normal(size=(20, 3))
+        running = RunningCovariance(3)
+        for vector in vectors:
+            running.add(vector)
+        self.assertEqual(running.count, 20)
+        self.assertAllClose(running.mean, vectors.mean(axis=0))
+        self.assertAllClose(running.cov, np.cov(vectors.T))
+
+    def test_running_covariance_reference(self):
+        vectors = 1e8 + np.random.RandomState(2).normal(size=(20, 3))
+        running = RunningCovariance(3, reference=vectors[3])
+        for vector in vectors:
+            running.add(vector)
+        self.assertAllClose(running.mean, vectors.mean(axis=0))
+        self.assertAllClose(running.cov, np.cov(vectors.T))
+        with self.assertRaises(ValueError):
+            RunningCovariance(3, reference=[1, 2])
+
+    def test_running_covariance_few(self):
+        running = RunningCovariance(2)
+        self.assertAllClose(running.cov, np.zeros((2, 2)))
+        running.add([1, 2])
+        self.assertAllClose(running.cov, np.zeros((2, 2)))
+        with self.assertRaises(ValueError):
+            running.add([1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
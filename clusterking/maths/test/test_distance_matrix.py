@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# std
+from pathlib import Path
+import tempfile
+import unittest
+
+# 3rd
+import numpy as np
+import pandas as pd
+import scipy.spatial
+
+# ours
+from clusterking.maths.distance_matrix import (
+    DistanceMatrix,
+    distance_matrix_key,
+    distance_matrix_path,
+    metric_md,
+)
+from clusterking.maths.metric_utils import (
+    pdist_condensed,
+    uncondense_distance_matrix,
+)
+from clusterking.data.data import Data
+from clusterking.cluster import HierarchyCluster
+from clusterking.benchmark.benchmark import Benchmark
+from clusterking.stability.subsamplestability import SubSampleStabilityTester
+from clusterking.util.testing import MyTestCase
+
+
+class TestDistanceMatrix(MyTestCase):
+    def setUp(self):
+        self.points = np.random.RandomState(0).normal(size=(13, 3))
+        self.condensed = scipy.spatial.distance.pdist(self.points)
+        self.square = scipy.spatial.distance.squareform(self.condensed)
+        self.dm = DistanceMatrix(self.condensed)
+
+    def test_n(self):
+        self.assertEqual(self.dm.n, 13)
+        self.assertEqual(DistanceMatrix(np.zeros(0)).n, 1)
+        self.assertEqual(DistanceMatrix.empty(0).n, 0)
+        with self.assertRaises(ValueError):
+            DistanceMatrix(np.zeros(4))
+
+    def test_row(self):
+        for i in [0, 5, 12]:
+            self.assertAllClose(self.dm.row(i), self.square[i])
+        self.assertAllClose(self.dm.rows([3, 1]), self.square[[3, 1]])
+        with self.assertRaises(IndexError):
+            self.dm.row(13)
+
+    def test_row_sums(self):
+        self.assertAllClose(self.dm.row_sums(), self.square.sum(axis=1))
+
+    def test_submatrix(self):
+        indizes = [7, 2, 11, 0]
+        self.assertAllClose(
+            self.dm.submatrix(indizes).uncondense(),
+            self.square[np.ix_(indizes, indizes)],
+        )
+
+    def test_uncondense(self):
+        self.assertAllClose(self.dm.uncondense(), self.square)
+        self.assertAllClose(uncondense_distance_matrix(self.dm), self.square)
+        self.assertAllClose(np.asarray(self.dm), self.condensed)
+
+    def test_compute_memmap(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "distances.npy"
+            for n_jobs in [1, 2]:
+                dm = DistanceMatrix.compute(
+                    pdist_condensed,
+                    len(self.points),
+                    {"data": self.points},
+                    path=path,
+                    n_jobs=n_jobs,
+                )
+                self.assertEqual(dm.path, path)
+                self.assertAllClose(np.asarray(dm), self.condensed)
+                del dm
+                loaded = DistanceMatrix.load(path)
+                self.assertAllClose(loaded.row_sums(), self.square.sum(axis=1))
+                del loaded
+
+
+class TestPersistedDistanceMatrix(MyTestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.d = Data()
+        self.d.df = pd.DataFrame(
+            {
+                "a": np.arange(20.0),
+                "bin0": rng.uniform(size=20),
+                "bin1": rng.uniform(size=20),
+                "cluster": np.arange(20) % 3,
+            }
+        )
+        self.d.md["dfunction"]["nbins"] = 2
+        self.d.md["scan"]["spoints"]["coeffs"] = ["a"]
+        self.expected = scipy.spatial.distance.pdist(self.d.data())
+
+    def test_key(self):
+        key = distance_matrix_key(self.d, metric_md("euclidean"))
+        self.assertEqual(
+            key,
+            distance_matrix_key(self.d, metric_md("euclidean", n_jobs=2)),
+        )
+        self.assertNotEqual(
+            key, distance_matrix_key(self.d, metric_md("cityblock"))
+        )
+        d = self.d.copy()
+        d.df.loc[0, "bin0"] += 1
+        self.assertNotEqual(key, distance_matrix_key(d, metric_md("euclidean")))
+
+    def test_from_data_cached(self):
+        dm = DistanceMatrix.from_data(self.d, "euclidean")
+        self.assertAllClose(np.asarray(dm), self.expected)
+        self.assertIs(DistanceMatrix.from_data(self.d, "euclidean"), dm)
+        self.assertIsNot(DistanceMatrix.from_data(self.d, "cityblock"), dm)
+
+    def test_from_data_mixed_precision(self):
+        dm = DistanceMatrix.from_data(self.d, "euclidean", precision="mixed")
+        np.testing.assert_allclose(np.asarray(dm), self.expected, rtol=1e-5)
+        self.assertEqual(dm.md["precision"]["precision"], "mixed")
+        self.assertEqual(dm.md["metric"]["kwargs"]["precision"], "mixed")
+
+    def test_from_data_persisted(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            data_path = Path(tmpdir) / "data.sql"
+            self.d.write(data_path)
+            dm = DistanceMatrix.from_data(
+                self.d, "euclidean", data_path=data_path
+            )
+            key = dm.md["key"]
+            self.assertEqual(dm.path, distance_matrix_path(data_path, key))
+            del dm
+            # New session
+            d = Data(data_path)
+            loaded = DistanceMatrix.from_data(
+                d, "euclidean", n_jobs=2, data_path=data_path
+            )
+            self.assertEqual(loaded.md["key"], key)
+            self.assertEqual(loaded.path, distance_matrix_path(data_path, key))
+            self.assertAllClose(np.asarray(loaded), self.expected)
+            self.assertAllClose(
+                loaded.subset(d.view([3, 1])),
+                [np.linalg.norm(self.d.data()[3] - self.d.data()[1])],
+            )
+            del loaded
+
+    def test_from_data_callables(self):
+        def pdist_metric(name):
+            return lambda data: scipy.spatial.distance.pdist(data.data(), name)
+
+        expected = scipy.spatial.distance.pdist(self.d.data(), "cityblock")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            data_path = Path(tmpdir) / "data.sql"
+            self.d.write(data_path)
+            euclidean = DistanceMatrix.from_data(
+                self.d, pdist_metric("euclidean"), data_path=data_path
+            )
+            # Neither the cached nor the persisted distance matrix are reused
+            cityblock = DistanceMatrix.from_data(
+                self.d, pdist_metric("cityblock"), data_path=data_path
+            )
+            self.assertIsNot(cityblock, euclidean)
+            self.assertNotEqual(cityblock.path, euclidean.path)
+            self.assertAllClose(np.asarray(cityblock), expected)
+            d = Data(data_path)
+            cityblock = DistanceMatrix.from_data(
+                d, pdist_metric("cityblock"), data_path=data_path
+            )
+            self.assertAllClose(np.asarray(cityblock), expected)
+            euclidean = DistanceMatrix.from_data(
+                d,
+                lambda data: scipy.spatial.distance.pdist(
+                    data.data(), "euclidean"
+                ),
+                data_path=data_path,
+            )
+            self.assertAllClose(np.asarray(euclidean), self.expected)
+            del euclidean, cityblock
+
+    def test_subset(self):
+        dm = DistanceMatrix.from_data(self.d, "euclidean")
+        self.assertIs(dm.subset(self.d), dm)
+        sub = self.d.sample_param_random(frac=0.5, random_state=0)
+        self.assertAllClose(
+            np.asarray(dm.subset(sub)),
+            scipy.spatial.distance.pdist(sub.data()),
+        )
+        changed = self.d.view(np.arange(5))
+        changed.df.loc[2, "bin1"] += 1.0
+        with self.assertRaises(ValueError):
+            dm.subset(changed)
+        other = self.d.copy()
+        other.df.index += 100
+        with self.assertRaises(ValueError):
+            dm.subset(other)
+        with self.assertRaises(ValueError):
+            DistanceMatrix(self.expected).subset(self.d)
+
+    def test_workers(self):
+        dm = DistanceMatrix.from_data(self.d, "euclidean")
+
+        c = HierarchyCluster()
+        c.set_metric("euclidean")
+        c.set_max_d(0.3)
+        expected_clusters = c.run(self.d).get_clusters()
+        c.set_distance_matrix(dm)
+        self.assertAllClose(c.run(self.d).get_clusters(), expected_clusters)
+
+        b = Benchmark()
+        b.set_metric("euclidean")
+        b.run(self.d).write()
+        expected_bpoints = self.d.df["bpoint"].values.copy()
+        b.set_distance_matrix(dm)
+        b.run(self.d).write()
+        self.assertEqual(
+            self.d.df["bpoint"].values.tolist(), expected_bpoints.tolist()
+        )
+
+    def test_subsample_stability(self):
+        dm = DistanceMatrix.from_data(self.d, "euclidean")
+        c = HierarchyCluster()
+        c.set_metric("euclidean")
+        c.set_max_d(0.3)
+        b = Benchmark()
+        b.set_metric("euclidean")
+        b.run(self.d).write()
+        ssst = SubSampleStabilityTester()
+        ssst.set_sampling(frac=0.8)
+        ssst.set_repeat(2)
+        ssst.set_progress_bar(False)
+        metric_c, metric_b = c.metric, b.metric
+        ssst.run(self.d, cluster=c, benchmark=b, distance_matrix=dm)
+        # The workers that were passed keep their metrics
+        self.assertIs(c.metric, metric_c)
+        self.assertIs(b.metric, metric_b)
+        self.assertEqual(c.md["metric"]["args"], ["euclidean"])
+        self.assertEqual(b.md["metric"]["args"], ["euclidean"])
+        configured = ssst._use_distance_matrix(dm, c, b, None)
+        self.assertEqual(configured[0].metric, dm.subset)
+        self.assertEqual(configured[1].metric, dm.subset)
+        self.assertIsNone(configured[2])
+        self.assertIs(ssst._use_distance_matrix(None, c)[0], c)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# std
+import unittest
+
+# 3rd
+import numpy as np
+import pandas as pd
+import scipy.spatial
+import scipy.stats
+
+# ours
+from clusterking.maths.histogram_metric import histogram_metric
+from clusterking.maths.metric_utils import metric_selection
+from clusterking.data.data import Data
+from clusterking.util.testing import MyTestCase
+
+
+class TestHistogramMetric(MyTestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        data = rng.uniform(size=(17, 5))
+        data[3, 2] = 0.0
+        self.d = Data()
+        self.d.df = pd.DataFrame(
+            data, columns=["bin{}".format(i) for i in range(5)]
+        )
+        self.p = data / data.sum(axis=1, keepdims=True)
+
+    def _reference(self, distance):
+        n = len(self.p)
+        return np.array(
+            [
+                distance(self.p[i], self.p[j])
+                for i in range(n)
+                for j in range(i + 1, n)
+            ]
+        )
+
+    def _check(self, name, expected, **kwargs):
+        for n_jobs in [1, 2]:
+            self.assertAllClose(
+                histogram_metric(name, n_jobs=n_jobs, **kwargs)(self.d),
+                expected,
+            )
+        self.assertAllClose(metric_selection(name, **kwargs)(self.d), expected)
+
+    def test_hellinger(self):
+        self._check(
+            "hellinger",
+            self._reference(
+                lambda p, q: np.sqrt(
+                    np.sum(np.square(np.sqrt(p) - np.sqrt(q))) / 2
+                )
+            ),
+        )
+
+    def test_symmetric_kl(self):
+        def kl(p, q):
+            p = (p + 1e-10) / np.sum(p + 1e-10)
+            q = (q + 1e-10) / np.sum(q + 1e-10)
+            return np.sum((p - q) * (np.log(p) - np.log(q)))
+
+        self._check("symmetric_kl", self._reference(kl), chunk_size=7)
+
+    def test_jensen_shannon(self):
+        expected = self._reference(scipy.spatial.distance.jensenshannon)
+        self._check("jensen_shannon", expected)
+        self._check("jensen_shannon", expected, chunk_size=5)
+
+    def test_wasserstein(self):
+        centers = np.arange(5) + 0.5
+        self._check(
+            "wasserstein",
+            self._reference(
+                lambda p, q: scipy.stats.wasserstein_distance(
+                    centers, centers, p, q
+                )
+            ),
+        )
+        self.d.md["scan"]["dfunction"]["binning"] = [0, 1, 2, 4, 5, 10]
+        self._check(
+            "wasserstein",
+            self._reference(
+                lambda p, q: np.sum(
+                    np.abs(np.cumsum(p) - np.cumsum(q)) * [1, 1, 2, 1, 5]
+                )
+            ),
+        )
+        with self.assertRaises(ValueError):
+            histogram_metric("wasserstein", bin_widths=[1, 2])(self.d)
+
+    def test_kolmogorov_smirnov(self):
+        self._check(
+            "kolmogorov_smirnov",
+            self._reference(
+                lambda p, q: np.max(np.abs(np.cumsum(p) - np.cumsum(q)))
+            ),
+        )
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            histogram_metric("hellinger2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,15 +2,23 @@
 
 # std
 from functools import partial
+from pathlib import Path
 
 # 3rd
 import pytest
 import numpy as np
+import pandas as pd
 import scipy.stats
 import scipy.spatial
 
 # ours
-from clusterking.maths.metric import chi2
+from clusterking.maths.metric import (
+    chi2,
+    chi2_metric,
+    chi2_condensed,
+    condensed_offset,
+)
+from clusterking.data.dwe import DataWithErrors
 
 
 _metrics_to_test = [
@@ -83,6 +91,151 @@ def test_metric_symmetric(metric):
         assert np.isclose(chi2s1, chi2s2).all()
 
 
+def _random_dwe(n_obs=13, n_bins=4, seed=0):
+    rng = np.random.RandomState(seed)
+    dwe = DataWithErrors()
+    dwe.df = pd.DataFrame(
+        rng.uniform(1, 2, size=(n_obs, n_bins)),
+        columns=["bin{}".format(i) for i in range(n_bins)],
+    )
+    dwe.add_rel_err_uncorr(0.1)
+    dwe.add_err_corr(0.2, random_correlation_matrix(n_bins))
+    dwe.add_err_poisson(100)
+    return dwe
+
+
+def _chi2_metric_reference(dwe):
+    """ Compare every pair of distributions separately """
+    d = dwe.data()
+    cov = dwe.cov()
+    chi2s = np.array(
+        [chi2(d, d[i], cov, cov[i], normalize=True) for i in range(dwe.n)]
+    )
+    return chi2s / (dwe.nbins - 1)
+
+
+def test_condensed_offset():
+    n = 7
+    square = np.arange(n * n).reshape((n, n))
+    condensed = scipy.spatial.distance.squareform(
+        np.triu(square, 1) + np.triu(square, 1).T
+    )
+    for i in range(n - 1):
+        assert condensed[condensed_offset(n, i)] == square[i, i + 1]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 5])
+def test_chi2_metric(chunk_size):
+    dwe = _random_dwe()
+    expected = _chi2_metric_reference(dwe)
+    full = chi2_metric(dwe, output="full", chunk_size=chunk_size)
+    assert np.isclose(full, expected).all()
+    condensed = chi2_metric(dwe, chunk_size=chunk_size)
+    assert np.isclose(
+        condensed, scipy.spatial.distance.squareform(full, checks=False)
+    ).all()
+
+
+def test_chi2_metric_n_jobs():
+    dwe = _random_dwe()
+    assert np.isclose(
+        chi2_metric(dwe, n_jobs=2, chunk_size=3), chi2_metric(dwe)
+    ).all()
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_chi2_metric_point_errors(n_jobs, monkeypatch):
+    dwe = _random_dwe()
+    rng = np.random.RandomState(1)
+    dwe.add_err_uncorr(rng.uniform(0.1, 0.2, size=(dwe.n, dwe.nbins)))
+    dwe.add_err_factor(rng.normal(0, 0.1, size=(dwe.n, dwe.nbins, 2)))
+    expected = _chi2_metric_reference(dwe)
+
+    # The dense n x nbins x nbins array is never built
+    def dense_cov(*args, **kwargs):
+        raise AssertionError("Dense covariance matrices were built.")
+
+    monkeypatch.setattr(DataWithErrors, "cov", dense_cov)
+    full = chi2_metric(dwe, output="full", n_jobs=n_jobs, chunk_size=3)
+    assert np.isclose(full, expected).all()
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_chi2_metric_whiten(n_jobs):
+    dwe = _random_dwe()
+    dwe.reset_errors()
+    dwe.add_err_corr(0.2, random_correlation_matrix(dwe.nbins))
+    # Different norms
+    dwe.df.iloc[0] *= 3
+    expected = _chi2_metric_reference(dwe)
+    whitened = chi2_metric(dwe, output="full", n_jobs=n_jobs)
+    assert np.isclose(whitened, expected).all()
+    assert np.isclose(
+        chi2_metric(dwe, whiten=True), chi2_metric(dwe, whiten=False)
+    ).all()
+
+
+def test_chi2_metric_whiten_impossible():
+    with pytest.raises(ValueError):
+        chi2_metric(_random_dwe(), whiten=True)
+
+
+@pytest.mark.parametrize("whiten", [True, False])
+def test_chi2_metric_distance_matrix(tmpdir, whiten):
+    dwe = _random_dwe()
+    if whiten:
+        dwe.reset_errors()
+        dwe.add_err_corr(0.2, random_correlation_matrix(dwe.nbins))
+    path = Path(str(tmpdir)) / "distances.npy"
+    dm = chi2_metric(dwe, output="distance_matrix", path=path, n_jobs=2)
+    assert dm.path == path
+    assert np.isclose(dm.uncondense(), _chi2_metric_reference(dwe)).all()
+    with pytest.raises(ValueError):
+        chi2_metric(dwe, path=path)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_chi2_metric_mixed_precision(n_jobs):
+    dwe = _random_dwe()
+    dwe.reset_errors()
+    dwe.add_err_corr(0.2, random_correlation_matrix(dwe.nbins))
+    dm = chi2_metric(
+        dwe, output="distance_matrix", precision="mixed", n_jobs=n_jobs
+    )
+    assert np.allclose(dm.uncondense(), _chi2_metric_reference(dwe))
+    assert dm.md["precision"]["precision"] == "mixed"
+    assert dm.md["precision"]["max_relative_deviation"] < 1e-4
+    # Fall back to 64 bit floats
+    dm = chi2_metric(
+        dwe, output="distance_matrix", precision="mixed", tolerance=0.0
+    )
+    assert dm.md["precision"]["precision"] == "float64"
+    assert np.allclose(dm.uncondense(), _chi2_metric_reference(dwe))
+    # Not whitened: Always 64 bit floats
+    dm = chi2_metric(_random_dwe(), output="distance_matrix", precision="mixed")
+    assert dm.md["precision"]["precision"] == "float64"
+    with pytest.raises(ValueError):
+        chi2_metric(dwe, precision="float16")
+
+
+def test_chi2_condensed_rows():
+    dwe = _random_dwe()
+    data = dwe.data(normalize=True)
+    cov = dwe.cov() / np.square(dwe.norms())[:, np.newaxis, np.newaxis]
+    full = chi2_condensed(data, cov)
+    out = np.full_like(full, np.nan)
+    chi2_condensed(data, cov, rows=range(0, 5), out=out)
+    chi2_condensed(data, cov, rows=range(5, dwe.n), out=out)
+    assert np.isclose(out, full).all()
+    structured = chi2_condensed(
+        data,
+        dwe.structured_cov(),
+        scales=1 / np.square(dwe.norms()),
+        chunk_size=4,
+    )
+    assert np.isclose(structured, full).all()
+
+
 def generate_toy_dataset(
     base_hist: np.ndarray, cov: np.ndarray, n_toys=1000
 ) -> np.ndarray:
@@ -5,15 +5,34 @@ import unittest
 
 # 3rd
 import numpy as np
+import pandas as pd
+import scipy.spatial
 
 # ours
 from clusterking.maths.metric_utils import (
     condense_distance_matrix,
     uncondense_distance_matrix,
+    parallel_condensed,
+    pdist_condensed,
+    pairwise_metric,
+    metric_selection,
+    mixed_sqeuclidean_block,
+    max_relative_deviation,
+    random_pairs,
+    _row_blocks,
 )
+from clusterking.data.data import Data
 from clusterking.util.testing import MyTestCase
 
 
+def _cityblock(x, y):
+    return np.abs(x[:, np.newaxis, :] - y[np.newaxis, :, :]).sum(axis=2)
+
+
+def _asymmetric(x, y):
+    return np.maximum(x[:, np.newaxis, 0] - y[np.newaxis, :, 0], 0)
+
+
 class TestMetric(MyTestCase):
     def setUp(self):
         self.d_matrix = np.array([[0, 2, 3], [2, 0, 1], [3, 1, 0]])
@@ -28,11 +47,187 @@ class TestMetric(MyTestCase):
             self.d_matrix[np.triu_indices(len(self.d_matrix), k=1)],
         )
 
+    def test_condense_distance_matrix_checks(self):
+        asymmetric = self.d_matrix.copy()
+        asymmetric[0, 1] = 5
+        with self.assertRaises(ValueError):
+            condense_distance_matrix(asymmetric)
+        with self.assertRaises(ValueError):
+            condense_distance_matrix(asymmetric, checks=3)
+        self.assertAllClose(
+            condense_distance_matrix(asymmetric, checks=False), [5, 3, 1]
+        )
+        diagonal = self.d_matrix + np.eye(3)
+        with self.assertRaises(ValueError):
+            condense_distance_matrix(diagonal, checks=2)
+        self.assertAllClose(
+            condense_distance_matrix(self.d_matrix, checks=2),
+            self.d_matrix_condensed,
+        )
+
     def test_uncodense_distance_matrix(self):
         self.assertAllClose(
             uncondense_distance_matrix(self.d_matrix_condensed), self.d_matrix
         )
 
 
+class TestParallelCondensed(MyTestCase):
+    def setUp(self):
+        self.data = np.random.RandomState(0).normal(size=(23, 3))
+        self.expected = scipy.spatial.distance.pdist(self.data, "cityblock")
+
+    def test_row_blocks(self):
+        for n in [0, 1, 2, 3, 10, 23]:
+            for n_blocks in [1, 3, 50]:
+                rows = [i for block in _row_blocks(n, n_blocks) for i in block]
+                self.assertEqual(rows, list(range(max(n - 1, 0))))
+
+    def test_serial(self):
+        self.assertAllClose(
+            parallel_condensed(
+                pdist_condensed, 23, {"data": self.data}, metric="cityblock"
+            ),
+            self.expected,
+        )
+
+    def test_parallel(self):
+        self.assertAllClose(
+            parallel_condensed(
+                pdist_condensed,
+                23,
+                {"data": self.data},
+                n_jobs=2,
+                metric="cityblock",
+            ),
+            self.expected,
+        )
+
+    def test_metric_selection(self):
+        d = Data()
+        d.df = pd.DataFrame(self.data, columns=["bin0", "bin1", "bin2"])
+        self.assertAllClose(
+            metric_selection("cityblock", n_jobs=2)(d), self.expected
+        )
+        self.assertAllClose(
+            metric_selection("minkowski", p=1, n_jobs=2)(d), self.expected
+        )
+        with self.assertRaises(ValueError):
+            metric_selection("minkowski", 1, n_jobs=2)
+
+
+class TestPairwiseMetric(MyTestCase):
+    def setUp(self):
+        self.d = Data()
+        data = np.random.RandomState(0).normal(size=(23, 3))
+        self.d.df = pd.DataFrame(data, columns=["bin0", "bin1", "bin2"])
+        self.expected = scipy.spatial.distance.pdist(data, "cityblock")
+
+    def test_pairwise_metric(self):
+        for chunk_size in [None, 1, 30]:
+            for n_jobs in [1, 2]:
+                self.assertAllClose(
+                    pairwise_metric(
+                        _cityblock, n_jobs=n_jobs, chunk_size=chunk_size
+                    )(self.d),
+                    self.expected,
+                )
+
+    def test_metric_selection(self):
+        self.assertAllClose(
+            metric_selection(pairwise=_cityblock)(self.d), self.expected
+        )
+        self.assertAllClose(
+            metric_selection(
+                pairwise=scipy.spatial.distance.cdist, metric="cityblock"
+            )(self.d),
+            self.expected,
+        )
+
+    def test_checks(self):
+        with self.assertRaises(ValueError):
+            pairwise_metric(_asymmetric)(self.d)
+        pairwise_metric(_asymmetric, checks=0)(self.d)
+
+    def test_wrong_shape(self):
+        with self.assertRaises(ValueError):
+            pairwise_metric(lambda x, y: x, checks=0)(self.d)
+
+
+class TestMixedPrecision(MyTestCase):
+    def setUp(self):
+        self.d = Data()
+        data = np.random.RandomState(0).uniform(size=(41, 6))
+        # Nearly identical points that would lose their precision in the
+        # differences of squared norms and scalar products
+        data[1] = data[0] + 1e-6
+        self.d.df = pd.DataFrame(
+            data, columns=["bin{}".format(i) for i in range(6)]
+        )
+        self.data = data
+
+    def test_block(self):
+        expected = scipy.spatial.distance.cdist(
+            self.data, self.data, "sqeuclidean"
+        )
+        computed = mixed_sqeuclidean_block(self.data, self.data)
+        np.testing.assert_allclose(computed, expected, rtol=1e-5, atol=0)
+
+    def test_block_near_duplicates(self):
+        # All pairs are recomputed in 64 bit floats, in chunks of 2 pairs
+        data = self.data[:1] + 1e-6 * np.arange(5)[:, np.newaxis]
+        expected = scipy.spatial.distance.cdist(data, data, "sqeuclidean")
+        for chunk_size in [None, 12, 1]:
+            computed = mixed_sqeuclidean_block(data, data, chunk_size)
+            np.testing.assert_allclose(computed, expected, rtol=1e-5, atol=0)
+
+    def test_random_pairs(self):
+        i, j = random_pairs(5, 200)
+        self.assertTrue((i < j).all())
+        self.assertTrue((j < 5).all())
+        self.assertEqual(len(random_pairs(1, 10)[0]), 0)
+
+    def test_max_relative_deviation(self):
+        condensed = scipy.spatial.distance.pdist(self.data)
+
+        def exact(i, j):
+            return np.linalg.norm(self.data[i] - self.data[j], axis=1)
+
+        self.assertEqual(max_relative_deviation(condensed, exact), 0.0)
+        self.assertAllClose(
+            max_relative_deviation(condensed * 1.01, exact), 0.01
+        )
+
+    def test_metric_selection(self):
+        for name in ["euclidean", "sqeuclidean"]:
+            for n_jobs in [1, 2]:
+                dm = metric_selection(name, precision="mixed", n_jobs=n_jobs)(
+                    self.d
+                )
+                np.testing.assert_allclose(
+                    np.asarray(dm),
+                    scipy.spatial.distance.pdist(self.data, name),
+                    rtol=1e-5,
+                )
+                self.assertEqual(dm.md["precision"]["precision"], "mixed")
+                self.assertLess(
+                    dm.md["precision"]["max_relative_deviation"], 1e-4
+                )
+
+    def test_fallback(self):
+        dm = metric_selection("euclidean", precision="mixed", tolerance=0.0)(
+            self.d
+        )
+        self.assertEqual(dm.md["precision"]["precision"], "float64")
+        self.assertAllClose(
+            np.asarray(dm), scipy.spatial.distance.pdist(self.data)
+        )
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            metric_selection("cityblock", precision="mixed")
+        with self.assertRaises(ValueError):
+            metric_selection("euclidean", precision="float16")
+
+
 if __name__ == "__main__":
     unittest.main()
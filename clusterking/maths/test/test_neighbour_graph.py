@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# std
+import unittest
+import unittest.mock
+
+# 3rd
+import numpy as np
+import pandas as pd
+import scipy
+import scipy.cluster.hierarchy
+import scipy.spatial
+
+# ours
+from clusterking.maths.neighbour_graph import (
+    _query_jobs_kwarg,
+    neighbour_graph,
+    single_linkage,
+    graph_metric,
+)
+from clusterking.maths.metric_utils import metric_selection
+from clusterking.data.data import Data
+from clusterking.util.testing import MyTestCase
+
+
+class TestNeighbourGraph(MyTestCase):
+    def setUp(self):
+        self.x = np.random.RandomState(0).normal(size=(40, 3))
+        self.dense = scipy.spatial.distance.squareform(
+            scipy.spatial.distance.pdist(self.x)
+        )
+
+    def test_knn(self):
+        graph = neighbour_graph(self.x, k=3)
+        self.assertAllClose(graph.toarray(), graph.T.toarray())
+        rows, cols = graph.nonzero()
+        self.assertAllClose(graph[rows, cols].A1, self.dense[rows, cols])
+        # Every point is connected with (at least) its 3 nearest neighbours
+        for i in range(len(self.x)):
+            nearest = np.argsort(self.dense[i])[1:4]
+            self.assertTrue(set(nearest) <= set(graph[i].indices))
+
+    def test_radius(self):
+        graph = neighbour_graph(self.x, radius=1.0)
+        expected = self.dense * (self.dense <= 1.0)
+        np.fill_diagonal(expected, 0.0)
+        self.assertAllClose(graph.toarray(), expected)
+
+    def test_duplicates(self):
+        x = np.concatenate([self.x, self.x[:1]])
+        graph = neighbour_graph(x, k=1)
+        self.assertGreater(graph[0, len(x) - 1], 0.0)
+        self.assertAllClose(graph[0, len(x) - 1], 0.0)
+
+    def test_query_jobs_kwarg(self):
+        self.assertIn(_query_jobs_kwarg(), ["workers", "n_jobs"])
+        with unittest.mock.patch.object(scipy, "__version__", "1.5.4"):
+            self.assertEqual(_query_jobs_kwarg(), "n_jobs")
+        with unittest.mock.patch.object(scipy, "__version__", "1.10.0rc1"):
+            self.assertEqual(_query_jobs_kwarg(), "workers")
+
+    def test_k_or_radius(self):
+        with self.assertRaises(ValueError):
+            neighbour_graph(self.x)
+        with self.assertRaises(ValueError):
+            neighbour_graph(self.x, k=2, radius=1.0)
+
+    def test_single_linkage_complete_graph(self):
+        graph = neighbour_graph(self.x, k=len(self.x) - 1)
+        linkage = single_linkage(graph)
+        expected = scipy.cluster.hierarchy.linkage(
+            scipy.spatial.distance.pdist(self.x), method="single"
+        )
+        self.assertTrue(scipy.cluster.hierarchy.is_valid_linkage(linkage))
+        self.assertAllClose(linkage[:, 2], expected[:, 2])
+        for t in [0.3, 0.6, 1.0]:
+            self.assertEqual(
+                scipy.cluster.hierarchy.fcluster(
+                    linkage, t, "distance"
+                ).tolist(),
+                scipy.cluster.hierarchy.fcluster(
+                    expected, t, "distance"
+                ).tolist(),
+            )
+
+    def test_single_linkage_disconnected(self):
+        x = np.array([[0.0], [0.1], [5.0], [5.1], [10.0]])
+        linkage = single_linkage(neighbour_graph(x, radius=1.0))
+        self.assertTrue(scipy.cluster.hierarchy.is_valid_linkage(linkage))
+        self.assertEqual(np.isinf(linkage[:, 2]).sum(), 2)
+        clusters = scipy.cluster.hierarchy.fcluster(linkage, 1.0, "distance")
+        self.assertEqual(len(set(clusters)), 3)
+
+
+class TestGraphMetric(MyTestCase):
+    def setUp(self):
+        data = np.random.RandomState(1).uniform(size=(30, 4))
+        self.d = Data()
+        self.d.df = pd.DataFrame(
+            data, columns=["bin{}".format(i) for i in range(4)]
+        )
+
+    def test_metric_selection(self):
+        graph = metric_selection("knn_graph", k=4)(self.d)
+        self.assertAllClose(
+            graph.toarray(), neighbour_graph(self.d.data(), k=4).toarray()
+        )
+        graph = metric_selection("radius_graph", radius=0.5)(self.d)
+        self.assertAllClose(
+            graph.toarray(),
+            neighbour_graph(self.d.data(), radius=0.5).toarray(),
+        )
+
+    def test_whiten(self):
+        values = self.d.data() / self.d.data().std(axis=0)
+        graph = graph_metric("knn_graph", k=4, whiten=True)(self.d)
+        self.assertAllClose(
+            graph.toarray(), neighbour_graph(values, k=4).toarray()
+        )
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            graph_metric("knn_graph", radius=0.5)
+        with self.assertRaises(ValueError):
+            graph_metric("radius_graph", k=3)
+        with self.assertRaises(ValueError):
+            graph_metric("other_graph", k=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -217,9 +217,7 @@ class BundlePlot(object):
             raise ValueError("Invalid argument bpoint=={}".format(bpoint))
 
     def _get_df_cluster_err_high(self, index):
-        indices = list(self.data.df.index)
-        loc = indices.index(index)
-        # todo: this is horribly inefficient
+        loc = self.data.df.index.get_loc(index)
         return self.data.err()[loc]
 
     def _get_df_cluster_err_low(self, *args, **kwargs):
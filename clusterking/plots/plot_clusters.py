@@ -179,7 +179,7 @@ class ClusterPlot(object):
         dofs = []
         for col in self.data.par_cols:
             if col not in self._axis_columns:
-                if len(self.data.df[col].unique()) >= 2:
+                if len(self.data.param_index(col).values) >= 2:
                     dofs.append(col)
         self.log.debug("dofs = {}".format(dofs))
         self._dofs = dofs
@@ -221,6 +221,23 @@ class ClusterPlot(object):
 
         self._df_dofs = df_dofs
 
+    def _dof_selector(self, isubplot: int) -> np.ndarray:
+        """ Boolean mask of all rows of the dataframe that are shown in a
+        subplot, i.e. whose dofs have the values of that subplot.
+
+        Args:
+            isubplot: Index of subplot
+
+        Returns:
+            Boolean numpy array
+        """
+        selector = np.full(self.data.n, True, bool)
+        for col in self._dofs:
+            selector &= self.data.param_index(col).select_exact(
+                self._df_dofs.iloc[isubplot][col]
+            )
+        return selector
+
     def _setup_subplots(self):
         """ Set up the subplot grid"""
 
@@ -487,6 +504,52 @@ class ClusterPlot(object):
                 matrix_colored[irow, icol] = rgb
         return matrix_colored
 
+    def _fill_matrix_grid(self, grid, isubplot: int):
+        """ A helper function for the fill method: Cluster numbers of a
+        subplot arranged as a matrix, if the sample points form a grid.
+
+        Args:
+            grid: :class:`~clusterking.data.grid.GridView` object
+            isubplot: Index of subplot
+
+        Returns:
+            x values, y values, matrix of cluster numbers with y decreasing
+            along the first and x increasing along the second axis
+        """
+        values = {}
+        for param, axis in zip(grid.params, grid.axes):
+            if param in self._dofs:
+                values[param] = self._df_dofs.iloc[isubplot][param]
+            elif param not in self._axis_columns:
+                # Parameters that only attain one value
+                values[param] = axis[0]
+        rows = grid.select(**values)
+        if grid.params.index(self._axis_columns[0]) > grid.params.index(
+            self._axis_columns[1]
+        ):
+            rows = rows.T
+        clusters = self.data.df[self.cluster_column].values
+        z_matrix = clusters[rows].T[::-1]
+        x = grid.axis(self._axis_columns[0])
+        y = grid.axis(self._axis_columns[1])
+        return x, y, z_matrix
+
+    def _fill_matrix(self, isubplot: int):
+        """ Like :meth:`_fill_matrix_grid`, but for sample points that do
+        not form a complete grid. The sample points of the subplot still
+        have to be uniformly sampled.
+        """
+        x_col, y_col = self._axis_columns
+        df_subplot = self.data.df[self._dof_selector(isubplot)]
+        x = df_subplot[x_col].unique()
+        y = df_subplot[y_col].unique()
+        df_subplot = df_subplot.sort_values(
+            by=[y_col, x_col], ascending=[False, True]
+        )
+        z = df_subplot[self.cluster_column].values
+        z_matrix = z.reshape(y.shape[0], int(len(z) / y.shape[0]))
+        return x, y, z_matrix
+
     # ==========================================================================
     # Plotting methods
     # ==========================================================================
@@ -513,15 +576,13 @@ class ClusterPlot(object):
         """
         self._setup_all(cols, clusters)
 
+        clusters = self.data.df[self.cluster_column].values
         for isubplot in range(self._nsubplots - int(self.draw_legend)):
+            subplot_selector = self._dof_selector(isubplot)
             for cluster in self._clusters:
                 df_cluster = self.data.df[
-                    self.data.df[self.cluster_column] == cluster
+                    subplot_selector & (clusters == cluster)
                 ]
-                for col in self._dofs:
-                    df_cluster = df_cluster[
-                        df_cluster[col] == self._df_dofs.iloc[isubplot][col]
-                    ]
 
                 if self._has_bpoints:
                     df_cluster_no_bp = df_cluster[
@@ -590,20 +651,12 @@ class ClusterPlot(object):
         assert len(cols) == 2
         self._setup_all(cols)
 
+        grid = self.data.grid()
         for isubplot in range(self._nsubplots - int(self.draw_legend)):
-            df_subplot = self.data.df.copy()
-            for col in self._dofs:
-                df_subplot = df_subplot[
-                    df_subplot[col] == self._df_dofs.iloc[isubplot][col]
-                ]
-            x = df_subplot[cols[0]].unique()
-            y = df_subplot[cols[1]].unique()
-            df_subplot.sort_values(
-                by=[cols[1], cols[0]], ascending=[False, True], inplace=True
-            )
-            z = df_subplot[self.cluster_column].values
-            # check if this makes sense
-            z_matrix = z.reshape(y.shape[0], int(len(z) / y.shape[0]))
+            if grid is not None:
+                x, y, z_matrix = self._fill_matrix_grid(grid, isubplot)
+            else:
+                x, y, z_matrix = self._fill_matrix(isubplot)
 
             imshow_config = {"interpolation": "none", "aspect": "auto"}
             imshow_config.update(kwargs_imshow)
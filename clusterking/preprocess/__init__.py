@@ -0,0 +1,12 @@
+#!/usr/bin/env python3
+
+""" This subpackage provides workers that transform the data before it is
+clustered.
+
+Currently implemented:
+
+* :class:`~clusterking.preprocess.PCA`: Principal component analysis to
+  reduce the dimension of the distributions
+"""
+
+from clusterking.preprocess.pca import PCA, PCAResult
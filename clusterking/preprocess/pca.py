@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# std
+import time
+from typing import Optional
+
+# 3rd
+import numpy as np
+
+# ours
+from clusterking.worker import DataWorker
+from clusterking.result import DataResult
+from clusterking.util.metadata import nested_dict, version_info
+from clusterking.util.log import get_logger
+
+
+class PCAResult(DataResult):
+    """ Result of :class:`PCA` """
+
+    def __init__(self, data, md):
+        super().__init__(data=data)
+        self._md = md
+
+    @property
+    def n_components(self) -> int:
+        """ Number of retained principal components """
+        return self._md["n_components"]
+
+    @property
+    def retained_variance(self) -> float:
+        """ Fraction of the variance that is retained """
+        return self._md["retained_variance"]
+
+    def write(self) -> None:
+        """ Save the projection to the metadata of the
+        :class:`~clusterking.data.Data` object, so that the reduced
+        coordinates can be retrieved with
+        :meth:`clusterking.data.Data.reduced_data`.
+        """
+        self._data.md["pca"] = self._md
+
+
+class PCA(DataWorker):
+    """ Principal component analysis of the normalized distributions
+    (:meth:`clusterking.data.Data.data` with ``normalize=True``).
+
+    Usually most of the variance of the distributions is contained in a few
+    principal components. Keeping only those reduces the dimension of the
+    points that are compared by metrics and clustering algorithms, which
+    makes computing the distances much faster. The projection is saved to the
+    metadata of the data object and the reduced coordinates are available
+    from :meth:`clusterking.data.Data.reduced_data`. Metrics selected by name
+    use them if ``reduced=True`` is passed to ``set_metric`` (see
+    :func:`~clusterking.maths.metric_utils.metric_selection`),
+    :class:`~clusterking.cluster.KmeansCluster` if
+    :meth:`~clusterking.cluster.KmeansCluster.set_reduced` was called.
+
+    Example:
+
+    .. code-block:: python
+
+        import clusterking as ck
+        d = ck.Data("/path/to/data.sql")
+        p = ck.preprocess.PCA()
+        p.set_variance(0.999)
+        p.run(d).write()
+        c = ck.cluster.HierarchyCluster()
+        c.set_metric("euclidean", reduced=True)
+        c.set_max_d(0.2)
+        c.run(d).write()
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.log = get_logger("PCA")
+        #: Metadata
+        self.md = nested_dict()
+        self.md["git"] = version_info(self.log)
+        self.md["time"] = time.strftime("%a %d %b %Y %H:%M", time.gmtime())
+        self.set_variance()
+        self.set_n_components()
+        self.set_whiten()
+
+    def set_variance(self, threshold=0.99) -> None:
+        """ Keep the smallest number of principal components that retain at
+        least this fraction of the variance.
+
+        Args:
+            threshold: Fraction of the variance (between 0 and 1)
+
+        Returns:
+            None
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(
+                "Variance threshold has to be in (0, 1], but is {}.".format(
+                    threshold
+                )
+            )
+        self.md["variance_threshold"] = threshold
+
+    def set_n_components(self, n_components: Optional[int] = None) -> None:
+        """ Keep a fixed number of principal components instead of choosing
+        it by :meth:`set_variance`.
+
+        Args:
+            n_components: Number of components or ``None`` (use variance
+                threshold)
+
+        Returns:
+            None
+        """
+        self.md["requested_components"] = n_components
+
+    def set_whiten(self, whiten=False) -> None:
+        """ Scale the principal components to unit variance.
+
+        Args:
+            whiten: Scale components
+
+        Returns:
+            None
+        """
+        self.md["whiten"] = whiten
+
+    def run(self, data) -> PCAResult:
+        """ Fit the principal components.
+
+        Args:
+            data: :class:`~clusterking.data.Data` object
+
+        Returns:
+            :class:`PCAResult`
+        """
+        points = data.data(normalize=True).astype(np.float64)
+        mean = points.mean(axis=0)
+        centered = points - mean
+        cov = centered.T @ centered / max(len(points) - 1, 1)
+        variances, vectors = np.linalg.eigh(cov)
+        order = np.argsort(variances)[::-1]
+        variances = np.maximum(variances[order], 0.0)
+        vectors = vectors[:, order]
+        # Fix the signs, so that the result is reproducible
+        signs = np.sign(
+            vectors[np.argmax(np.abs(vectors), axis=0), np.arange(len(order))]
+        )
+        vectors *= np.where(signs == 0, 1, signs)
+
+        total = variances.sum()
+        if total > 0:
+            ratios = variances / total
+        else:
+            ratios = np.zeros_like(variances)
+        if self.md["requested_components"] is not None:
+            n_components = int(self.md["requested_components"])
+        elif total > 0:
+            n_components = int(
+                np.searchsorted(
+                    np.cumsum(ratios), self.md["variance_threshold"] - 1e-12
+                )
+                + 1
+            )
+        else:
+            n_components = 1
+        n_components = max(1, min(n_components, data.nbins))
+
+        md = nested_dict()
+        md.update(self.md)
+        md["n_components"] = n_components
+        md["retained_variance"] = float(ratios[:n_components].sum())
+        md["mean"] = mean
+        md["components"] = vectors[:, :n_components].T.copy()
+        md["explained_variance"] = variances[:n_components]
+        md["explained_variance_ratio"] = ratios[:n_components]
+        self.log.debug(
+            "Keeping {} principal components with {:.4f} of the "
+            "variance.".format(n_components, md["retained_variance"])
+        )
+        return PCAResult(data=data, md=md)
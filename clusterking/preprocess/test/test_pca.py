@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# std
+from pathlib import Path
+import tempfile
+import unittest
+
+# 3rd
+import numpy as np
+import pandas as pd
+import scipy.spatial
+
+# ours
+from clusterking.util.testing import MyTestCase
+from clusterking.data.data import Data
+from clusterking.preprocess import PCA
+from clusterking.cluster import HierarchyCluster, KmeansCluster
+from clusterking.maths.metric_utils import metric_selection
+
+
+class TestPCA(MyTestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # Distributions that vary mostly along two directions
+        base = np.linspace(1.0, 2.0, 10)
+        coeffs = rng.normal(size=(50, 2))
+        directions = rng.normal(size=(2, 10)) * [[0.1], [0.03]]
+        data = base + coeffs @ directions + 1e-4 * rng.normal(size=(50, 10))
+        self.d = Data()
+        self.d.df = pd.DataFrame(
+            data, columns=["bin{}".format(i) for i in range(10)]
+        )
+        self.d.md["scan"]["spoints"]["coeffs"] = []
+
+    def test_variance_threshold(self):
+        p = PCA()
+        p.set_variance(0.999)
+        r = p.run(self.d)
+        self.assertEqual(r.n_components, 2)
+        self.assertGreaterEqual(r.retained_variance, 0.999)
+        r.write()
+        self.assertEqual(self.d.md["pca"]["variance_threshold"], 0.999)
+        self.assertEqual(self.d.reduced_data().shape, (50, 2))
+        # Distances are (almost) preserved
+        np.testing.assert_allclose(
+            scipy.spatial.distance.pdist(self.d.reduced_data()),
+            scipy.spatial.distance.pdist(self.d.data(normalize=True)),
+            rtol=1e-2,
+            atol=1e-4,
+        )
+
+    def test_n_components(self):
+        p = PCA()
+        p.set_n_components(10)
+        p.run(self.d).write()
+        self.assertAllClose(
+            scipy.spatial.distance.pdist(self.d.reduced_data()),
+            scipy.spatial.distance.pdist(self.d.data(normalize=True)),
+        )
+
+    def test_whiten(self):
+        p = PCA()
+        p.set_n_components(2)
+        p.set_whiten(True)
+        p.run(self.d).write()
+        np.testing.assert_allclose(
+            np.cov(self.d.reduced_data(), rowvar=False), np.eye(2), atol=1e-8
+        )
+
+    def test_no_projection(self):
+        with self.assertRaises(ValueError):
+            self.d.reduced_data()
+        with self.assertRaises(ValueError):
+            PCA().set_variance(0)
+
+    def test_fingerprint(self):
+        fingerprint = self.d.fingerprint()
+        PCA().run(self.d).write()
+        self.assertNotEqual(self.d.fingerprint(), fingerprint)
+
+    def test_write(self):
+        PCA().run(self.d).write()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "test.sql"
+            self.d.write(path)
+            d = Data(path)
+        self.assertAllClose(d.reduced_data(), self.d.reduced_data())
+
+    def test_metric(self):
+        PCA().run(self.d).write()
+        expected = scipy.spatial.distance.pdist(self.d.reduced_data())
+        self.assertAllClose(
+            metric_selection("euclidean", reduced=True)(self.d), expected
+        )
+        self.assertAllClose(
+            metric_selection("euclidean", reduced=True, n_jobs=2)(self.d),
+            expected,
+        )
+        self.assertAllClose(
+            metric_selection(
+                pairwise=scipy.spatial.distance.cdist, reduced=True
+            )(self.d),
+            expected,
+        )
+        with self.assertRaises(ValueError):
+            metric_selection("hellinger", reduced=True)
+
+    def test_clustering(self):
+        p = PCA()
+        p.set_variance(0.999)
+        p.run(self.d).write()
+        c = HierarchyCluster()
+        c.set_metric("euclidean", reduced=True)
+        c.set_max_d(0.05)
+        reduced = c.run(self.d).get_clusters()
+        c.set_metric("euclidean")
+        # Data isn't normalized in the full metric
+        self.d.df[self.d.bin_cols] = self.d.data(normalize=True)
+        self.assertEqual(list(reduced), list(c.run(self.d).get_clusters()))
+        k = KmeansCluster()
+        k.set_kmeans_options(n_clusters=3, random_state=0, n_init=10)
+        k.set_reduced()
+        self.assertEqual(len(set(k.run(self.d).get_clusters())), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,16 @@ import functools
 import multiprocessing
 import os
 import time
-from typing import Callable, Sized, Dict, Iterable, Optional, List
+from typing import (
+    Callable,
+    Sized,
+    Dict,
+    Iterable,
+    Optional,
+    List,
+    Any,
+    Tuple,
+)
 import itertools
 
 # 3rd party
@@ -19,7 +28,10 @@ import tqdm.auto
 # ours
 from clusterking.worker import DataWorker
 from clusterking.data.data import Data
+from clusterking.data.dwe import DataWithErrors
 import clusterking.maths.binning
+from clusterking.maths.covariance import RunningCovariance
+from clusterking.maths.statistics import cov2err
 from clusterking.util.metadata import (
     version_info,
     failsafe_serialize,
@@ -50,6 +62,10 @@ class SpointCalculator(object):
         #: Normalize distribution if binning is specified
         self.normalize = False
         self.kwargs = {}
+        #: Keyword arguments for the function (in addition to
+        #: :attr:`kwargs`) for every draw of the nuisance parameters (used by
+        #: :meth:`calc_nuisance`)
+        self.nuisance_draws = []  # type: List[Dict[str, Any]]
 
     # todo: doc
     # todo: ignore static warning
@@ -67,22 +83,67 @@ class SpointCalculator(object):
         """
 
         spoint = self._prepare_spoint(spoint)
+        return self._calc_prepared(spoint, self.kwargs)
+
+    def _calc_prepared(self, spoint, kwargs: Dict[str, Any]):
+        """ Calculate one point in wilson space that was already prepared by
+        :meth:`_prepare_spoint`.
+
+        Args:
+            spoint: Prepared point
+            kwargs: Keyword arguments to the function
+
+        Returns:
+            np.array of the integration results
+        """
         if self.binning is not None:
             if self.binning_mode == "integrate":
                 return clusterking.maths.binning.bin_function(
-                    functools.partial(self.func, spoint, **self.kwargs),
+                    functools.partial(self.func, spoint, **kwargs),
                     self.binning,
                     normalize=self.normalize,
                 )
             elif self.binning_mode == "sample":
-                func = functools.partial(self.func, spoint, **self.kwargs)
+                func = functools.partial(self.func, spoint, **kwargs)
                 res = np.array(list(map(func, self.binning)))
                 if self.normalize:
                     res /= sum(res)
                 print("results", res)
                 return res
         else:
-            return self.func(spoint, **self.kwargs)
+            return self.func(spoint, **kwargs)
+
+    def calc_nuisance(
+        self, spoint
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Calculates one point in wilson space for the nominal keyword
+        arguments and for every draw of the nuisance parameters in
+        :attr:`nuisance_draws`. The results of the draws are only accumulated
+        into their covariance matrix rather than stored.
+
+        Args:
+            spoint: Wilson coefficients
+
+        Returns:
+            Tuple of the nominal result, the errors and the correlation
+            matrix of the results of the nuisance draws
+        """
+        spoint = self._prepare_spoint(spoint)
+        nominal = np.atleast_1d(
+            np.asarray(self._calc_prepared(spoint, self.kwargs), dtype=float)
+        )
+        running = RunningCovariance(len(nominal), reference=nominal)
+        for draw in self.nuisance_draws:
+            kwargs = dict(self.kwargs)
+            kwargs.update(draw)
+            running.add(self._calc_prepared(spoint, kwargs))
+        cov = running.cov
+        err = cov2err(cov)
+        # Bins without errors are uncorrelated
+        scale = np.where(err > 0, err, 1.0)
+        corr = cov / np.outer(scale, scale)
+        np.fill_diagonal(corr, 1.0)
+        return nominal, err, corr
 
 
 # todo: also allow to disable multiprocessing if there are problems.
@@ -159,6 +220,9 @@ class Scanner(DataWorker):
         self._progress_bar = True
         self._tqdm_kwargs = {}
 
+        #: Are nuisance parameters sampled (see :meth:`set_nuisance`)?
+        self._nuisance = False
+
         self.set_imaginary_prefix("im_")
 
     # **************************************************************************
@@ -289,6 +353,60 @@ class Scanner(DataWorker):
         self._spoint_calculator.normalize = normalize
         self._spoint_calculator.kwargs = kwargs
 
+    def set_nuisance(
+        self, sampler: Callable[[], Dict[str, Any]], n_draws: int
+    ) -> None:
+        """ Propagate the uncertainties of nuisance parameters to the
+        distributions by Monte Carlo sampling.
+
+        ``sampler`` is called ``n_draws`` times (in the main process) to draw
+        values of the nuisance parameters. For every sample point, the
+        function set in :meth:`set_dfunction` is then evaluated for the
+        nominal keyword arguments and for every draw (in the same worker
+        process). The covariance matrix of the results of the draws is
+        accumulated without storing the individual results.
+        The nominal results are written as the distributions. The errors
+        from the covariance matrices are added per sample point, together
+        with the mean of the correlation matrices of all sample points (see
+        :meth:`~clusterking.data.DataWithErrors.add_err_corr`), so that only
+        ``n x nbins`` errors and one ``nbins x nbins`` matrix are stored.
+        The :class:`~clusterking.data.DataWithErrors` object has to be passed
+        to :meth:`run`.
+
+        Example:
+
+        .. code-block:: python
+
+            def myfunction(parameters, x, width=1.):
+                ...
+
+            s.set_dfunction(myfunction, binning=[0, 1, 2])
+            s.set_nuisance(
+                lambda: {"width": np.random.normal(1., 0.1)}, n_draws=100
+            )
+
+        Args:
+            sampler: Function without arguments that returns a dictionary
+                of keyword arguments that are passed to the function (in
+                addition to the keyword arguments from
+                :meth:`set_dfunction`, which are overridden)
+            n_draws: Number of draws of the nuisance parameters
+
+        Returns:
+            None
+        """
+        if n_draws < 2:
+            raise ValueError(
+                "At least two draws are needed to estimate a covariance."
+            )
+        draws = [dict(sampler()) for _ in range(n_draws)]
+        self._spoint_calculator.nuisance_draws = draws
+        self._nuisance = True
+        md = self.md["nuisance"]
+        md["n_draws"] = n_draws
+        md["sampler"] = getattr(sampler, "__name__", str(sampler))
+        md["parameters"] = sorted(set().union(*draws))
+
     def set_spoints_grid(self, values: Dict[str, Iterable[float]]) -> None:
         """ Set a grid of points in sampling space.
 
@@ -503,6 +621,11 @@ class Scanner(DataWorker):
                 "anything."
             )
             return
+        if self._nuisance and not isinstance(data, DataWithErrors):
+            raise ValueError(
+                "Sampling nuisance parameters requires a DataWithErrors "
+                "object to write the errors to."
+            )
 
         no_workers = self._no_workers
         if not self._no_workers:
@@ -518,9 +641,9 @@ class Scanner(DataWorker):
         start_time = time.time()
 
         if no_workers >= 2:
-            rows = self._run_multicore(no_workers)
+            rows, nuisance_errors = self._run_multicore(no_workers)
         else:
-            rows = self._run_singlecore()
+            rows, nuisance_errors = self._run_singlecore()
 
         end_time = time.time()
         run_time = end_time - start_time
@@ -532,23 +655,55 @@ class Scanner(DataWorker):
             spoints=self._spoints,
             md=self.md,
             coeffs=self._coeffs,
+            nuisance_errors=nuisance_errors,
         )
 
+    def _worker(self) -> Callable:
+        """ Function that is run for every sample point """
+        if self._nuisance:
+            return self._spoint_calculator.calc_nuisance
+        return self._spoint_calculator.calc
+
+    def _collect(
+        self, index: int, result, rows: list, nuisance: Dict[str, Any]
+    ) -> None:
+        """ Add the result of :meth:`_worker` for one sample point to the
+        rows of the dataframe (and the errors from the nuisance parameters to
+        ``nuisance``, see :meth:`_nuisance_errors`).
+        """
+        if self._nuisance:
+            result, err, corr = result
+            nuisance["err"].append(err)
+            nuisance["corr"] += corr
+
+        md = self.md["dfunction"]
+
+        if not isinstance(result, Iterable):
+            result = [result]
+
+        if "nbins" not in md:
+            md["nbins"] = len(result)
+
+        rows.append([*self._spoints[index], *result])
+
     # todo: shouldn't this rather return numpy arrays than List2
-    def _run_multicore(self, no_workers: int) -> List[List[float]]:
+    def _run_multicore(
+        self, no_workers: int
+    ) -> Tuple[List[List[float]], Optional[Tuple[np.ndarray, np.ndarray]]]:
         """ Calculate spoints in parallel processing mode.
 
         Args:
             no_workers: Number of workers.
 
         Returns:
-            Rows of the dataframe.
+            Rows of the dataframe and errors from the nuisance parameters
+            (see :meth:`_nuisance_errors`)
         """
         # pool of worker nodes
         pool = multiprocessing.Pool(processes=no_workers)
 
         # this is the worker function.
-        worker = self._spoint_calculator.calc
+        worker = self._worker()
 
         results = pool.imap(worker, self._spoints)
 
@@ -561,6 +716,7 @@ class Scanner(DataWorker):
         )
 
         rows = []
+        nuisance = {"err": [], "corr": 0.0}
 
         if self._progress_bar:
             tqdm_kwargs = dict(
@@ -572,28 +728,23 @@ class Scanner(DataWorker):
             iterator = enumerate(results)
 
         for index, result in iterator:
-            md = self.md["dfunction"]
-
-            if not isinstance(result, Iterable):
-                result = [result]
-
-            if "nbins" not in md:
-                md["nbins"] = len(result)
-
-            rows.append([*self._spoints[index], *result])
+            self._collect(index, result, rows, nuisance)
 
         # Wait for completion of all jobs here
         pool.join()
 
-        return rows
+        return rows, self._nuisance_errors(nuisance)
 
     # todo: shouldn't this rather return numpy arrays than List2
-    def _run_singlecore(self) -> List[List[float]]:
+    def _run_singlecore(
+        self,
+    ) -> Tuple[List[List[float]], Optional[Tuple[np.ndarray, np.ndarray]]]:
         """ Calculate spoints in single core processing mode. This is sometimes
         useful because multiprocessing has its quirks.
 
         Returns:
-            Rows of the dataframe.
+            Rows of the dataframe and errors from the nuisance parameters
+            (see :meth:`_nuisance_errors`)
         """
         self.log.info(
             "Started queue with {} job(s) in single core mode.".format(
@@ -601,34 +752,48 @@ class Scanner(DataWorker):
             )
         )
 
+        worker = self._worker()
         rows = []
+        nuisance = {"err": [], "corr": 0.0}
         for index, spoint in tqdm.auto.tqdm(
             enumerate(self._spoints),
             desc="Scanning: ",
             unit=" spoint",
             total=len(self._spoints),
         ):
-            result = self._spoint_calculator.calc(spoint)
-
-            md = self.md["dfunction"]
+            self._collect(index, worker(spoint), rows, nuisance)
 
-            if not isinstance(result, Iterable):
-                result = [result]
+        return rows, self._nuisance_errors(nuisance)
 
-            if "nbins" not in md:
-                md["nbins"] = len(result)
-
-            rows.append([*self._spoints[index], *result])
-
-        return rows
+    def _nuisance_errors(
+        self, nuisance: Dict[str, Any]
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """ Combine the errors and correlation matrices collected by
+        :meth:`_collect` to an ``n x nbins`` array of errors and the mean
+        ``nbins x nbins`` correlation matrix (or ``None`` if no nuisance
+        parameters were sampled).
+        """
+        if not self._nuisance or not nuisance["err"]:
+            return None
+        err = np.array(nuisance["err"], dtype=float)
+        return err, nuisance["corr"] / len(err)
 
 
 class ScannerResult(DataResult):
     def __init__(
-        self, data: Data, rows: List[List[float]], spoints, md, coeffs
+        self,
+        data: Data,
+        rows: List[List[float]],
+        spoints,
+        md,
+        coeffs,
+        nuisance_errors: Optional[Tuple[np.ndarray, np.ndarray]] = None,
     ):
         super().__init__(data=data)
         self._rows = rows
+        #: ``n x nbins`` errors and mean ``nbins x nbins`` correlation matrix
+        #: from the nuisance parameters or ``None``
+        self._nuisance_errors = nuisance_errors
         self._spoints = spoints
         self.md = md  # type: nested_dict
         self._coeffs = coeffs
@@ -674,6 +839,9 @@ class ScannerResult(DataResult):
 
         # Now we finally write everything to data
         self._data.df = pd.DataFrame(data=self._rows, columns=cols)
+        if isinstance(self._data, DataWithErrors):
+            # Errors per sample point belong to the rows of an earlier scan
+            self._data.md["errors"].pop("points", None)
 
         # todo: Shouldn't we do that above already? This sounds not so
         #   great performance wise...
@@ -695,10 +863,16 @@ class ScannerResult(DataResult):
                 self._data.df[coeff] = self._data.df[coeff].apply(np.real)
 
         self._data.df.index.name = "index"
+        # The columns were modified in place
+        self._data._invalidate_cache()
 
         # fixme: Should already be set in worker class
         self.md["spoints"]["coeffs"] = coeffs_with_im
 
         self._data.md["scan"] = self.md
+        self._data._apply_dtypes()
+
+        if self._nuisance_errors is not None:
+            self._data.add_err_corr(*self._nuisance_errors)
 
         self.log.info("Integration done.")
@@ -13,6 +13,8 @@ import numpy as np
 from clusterking.util.testing import MyTestCase
 from clusterking.scan.scanner import Scanner
 from clusterking.data.data import Data
+from clusterking.data.dwe import DataWithErrors
+from clusterking.maths.statistics import cov2err, cov2corr
 
 
 # noinspection PyUnusedLocal
@@ -33,6 +35,10 @@ def func_sum_indentity_x(coeffs, x):
     return sum(coeffs) * x
 
 
+def func_sum_shifted_x(coeffs, x, shift=0.0, slope=1.0):
+    return sum(coeffs) * slope * x + shift
+
+
 class TestScanner(MyTestCase):
     def setUp(self):
         # We also want to test writing, to check that there are e.g. no
@@ -144,6 +150,79 @@ class TestScanner(MyTestCase):
         )
         d.write(Path(self.tmpdir.name) / "test.sql")
 
+    def _nuisance_scanner(self, draws):
+        s = Scanner()
+        s.set_spoints_equidist({"a": (0, 2, 3)})
+        s.set_dfunction(func_sum_shifted_x, sampling=[0, 1, 2])
+        draws = iter(draws)
+        s.set_nuisance(lambda: next(draws), n_draws=5)
+        return s
+
+    def _check_nuisance(self, no_workers):
+        rng = np.random.RandomState(0)
+        draws = [
+            {"shift": rng.normal(), "slope": rng.normal(1, 0.1)}
+            for _ in range(5)
+        ]
+        s = self._nuisance_scanner(draws)
+        s.set_no_workers(no_workers)
+        d = DataWithErrors()
+        s.run(d).write()
+        x = np.array([0, 1, 2])
+        self.assertAllClose(d.data(), np.outer([0, 1, 2], x))
+        covs = np.array(
+            [
+                np.cov(
+                    np.array(
+                        [
+                            a * draw["slope"] * x + draw["shift"]
+                            for draw in draws
+                        ]
+                    ).T
+                )
+                for a in [0, 1, 2]
+            ]
+        )
+        # Errors per sample point and the mean correlation matrix
+        err = cov2err(covs)
+        self.assertAllClose(d.err(), err)
+        corr = cov2corr(covs).mean(axis=0)
+        self.assertAllClose(d.cov(), err[:, :, None] * corr * err[:, None, :])
+        self.assertEqual(d.md["errors"]["points"]["0"]["corr"].shape, (3, 3))
+        self.assertEqual(d.md["scan"]["nuisance"]["n_draws"], 5)
+        self.assertEqual(
+            d.md["scan"]["nuisance"]["parameters"], ["shift", "slope"]
+        )
+        d.write(Path(self.tmpdir.name) / "test.sql")
+        d_loaded = DataWithErrors(Path(self.tmpdir.name) / "test.sql")
+        self.assertAllClose(d_loaded.cov(), d.cov())
+
+    def test_nuisance_singlecore(self):
+        self._check_nuisance(1)
+
+    def test_nuisance_multicore(self):
+        self._check_nuisance(2)
+
+    def test_nuisance_rescan(self):
+        draws = [{"shift": 0.1 * i, "slope": 1 + 0.01 * i} for i in range(5)]
+        d = DataWithErrors()
+        self._nuisance_scanner(draws).run(d).write()
+        cov = d.cov().copy()
+        # Scanning again replaces the errors of the first scan
+        self._nuisance_scanner(draws).run(d).write()
+        self.assertEqual(len(d.md["errors"]["points"]), 1)
+        self.assertAllClose(d.cov(), cov)
+
+    def test_nuisance_requires_dwe(self):
+        s = self._nuisance_scanner([{"shift": i} for i in range(5)])
+        with self.assertRaises(ValueError):
+            s.run(Data())
+
+    def test_nuisance_too_few_draws(self):
+        s = Scanner()
+        with self.assertRaises(ValueError):
+            s.set_nuisance(lambda: {"shift": 1.0}, n_draws=1)
+
     def test_add_gaussian_noise(self):
         s = Scanner()
         s.set_spoints_equidist({"a": (-1, 1, 10), "b": (-1, 1, 10)})
@@ -110,6 +110,7 @@ class TrivialClusterMatcher(ClusterMatcher):
             dct[cluster2] = most_likely
 
         ndata2.df[self.cluster_column] = ndata2.df[self.cluster_column].map(dct)
+        ndata2._invalidate_cache()
 
         return ClusterMatcherResult(data1=ndata1, data2=ndata2, rename_dct=dct)
 
@@ -137,6 +138,7 @@ class FirstComeFirstServe1DClusterMatcher(ClusterMatcher):
         ndata2.df[self.cluster_column] = ndata2.df[self.cluster_column].map(
             rename_dct
         )
+        ndata2._invalidate_cache()
         return ClusterMatcherResult(
             data1=ndata1, data2=ndata2, rename_dct=rename_dct
         )
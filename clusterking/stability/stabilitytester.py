@@ -2,7 +2,8 @@
 
 # std
 from abc import abstractmethod
-from typing import Union
+import copy
+from typing import Tuple, Union
 from pathlib import Path, PurePath
 
 # 3rd
@@ -94,6 +95,32 @@ class AbstractStabilityTester(AbstractWorker):
             )
         self._foms[fom.name] = fom
 
+    @staticmethod
+    def _use_distance_matrix(distance_matrix, *workers) -> Tuple:
+        """ Configure copies of the workers (e.g. clustering and benchmarking)
+        to take their distances from a precomputed distance matrix (if they
+        use a metric). The workers that were passed are not modified.
+
+        Args:
+            distance_matrix:
+                :class:`~clusterking.maths.distance_matrix.DistanceMatrix` or
+                ``None`` (do nothing)
+            *workers: Worker objects or ``None``
+
+        Returns:
+            Tuple of the workers, where the workers that support distance
+            matrices are replaced by configured copies.
+        """
+        if distance_matrix is None:
+            return workers
+        configured = []
+        for worker in workers:
+            if hasattr(worker, "set_distance_matrix"):
+                worker = copy.deepcopy(worker)
+                worker.set_distance_matrix(distance_matrix)
+            configured.append(worker)
+        return tuple(configured)
+
     @abstractmethod
     def run(self, *args, **kwargs) -> StabilityTesterResult:
         """ Run the stability test.
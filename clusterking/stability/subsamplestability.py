@@ -17,6 +17,7 @@ from clusterking.stability.stabilitytester import (
 from clusterking.data.data import Data
 from clusterking.cluster import Cluster
 from clusterking.benchmark import AbstractBenchmark
+from clusterking.maths.distance_matrix import DistanceMatrix
 
 
 class SubSampleStabilityTesterResult(SimpleStabilityTesterResult):
@@ -123,6 +124,7 @@ class SubSampleStabilityTester(AbstractStabilityTester):
         data: Data,
         cluster: Cluster,
         benchmark: Optional[AbstractBenchmark] = None,
+        distance_matrix: Optional[DistanceMatrix] = None,
     ) -> SubSampleStabilityTesterResult:
         """ Run test.
 
@@ -132,6 +134,14 @@ class SubSampleStabilityTester(AbstractStabilityTester):
                 object
             benchmark: Optional: :class:`~clusterking.cluster.cluster.Cluster`
                 object
+            distance_matrix: Optional:
+                :class:`~clusterking.maths.distance_matrix.DistanceMatrix` of
+                ``data`` (see
+                :meth:`~clusterking.maths.distance_matrix.DistanceMatrix.from_data`).
+                The cluster and benchmark objects are configured to take the
+                distances of the subsamples from it instead of computing the
+                metric in every repetition (the objects that were passed are
+                not modified).
 
         Returns:
             :class:`SubSampleStabilityTesterResult` object
@@ -143,6 +153,10 @@ class SubSampleStabilityTester(AbstractStabilityTester):
             )
             raise ValueError(msg)
 
+        cluster, benchmark = self._use_distance_matrix(
+            distance_matrix, cluster, benchmark
+        )
+
         original_data = data.copy(deep=True)
         cluster.run(original_data).write()
         if self._progress_bar:
@@ -189,12 +203,13 @@ class SubSampleStabilityVsFraction(object):
         cluster: Cluster,
         ssst: SubSampleStabilityTester,
         fractions: Iterable[float],
+        distance_matrix: Optional[DistanceMatrix] = None,
     ):
         results = collections.defaultdict(list)
         ssst.set_progress_bar(False)
         for fract in tqdm.auto.tqdm(fractions):
             ssst.set_sampling(frac=fract)
-            r = ssst.run(data, cluster)
+            r = ssst.run(data, cluster, distance_matrix=distance_matrix)
             foms = r.df.mean().to_dict()
             results["fraction"].append(fract)
             for key, value in foms.items():
@@ -5,12 +5,17 @@
 # std
 import collections
 from collections.abc import Iterable
+import functools
+import hashlib
 import json
 import pathlib
 import time
+import types
 from typing import Dict
 
 # 3rd party
+import numpy as np
+
 try:
     import git
 except ImportError:
@@ -165,6 +170,144 @@ def failsafe_serialize(obj):
         return str(obj)
 
 
+def _hash_code(code, hasher) -> None:
+    """ Update a hash object with the bytecode, the constants and the names
+    that are used by a code object (and the code objects nested in it). """
+    hasher.update(code.co_code)
+    hasher.update(json.dumps([code.co_names, code.co_freevars]).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(const, hasher)
+        elif isinstance(const, frozenset):
+            # The iteration order of sets of strings changes between sessions
+            hasher.update(repr(sorted(const, key=repr)).encode())
+        else:
+            hasher.update(repr(const).encode())
+
+
+def _stable_serialize(obj, seen):
+    if isinstance(obj, dict):
+        return {key: _stable_serialize(v, seen) for key, v in obj.items()}
+    elif isinstance(obj, np.ndarray):
+        h = hashlib.blake2b(digest_size=16)
+        hash_metadata(obj, h)
+        return {"array": h.hexdigest()}
+    elif isinstance(obj, (int, float)):
+        return obj
+    elif isinstance(obj, str):
+        return obj
+    elif isinstance(obj, functools.partial):
+        return {
+            "callable": _stable_serialize(obj.func, seen),
+            "args": _stable_serialize(obj.args, seen),
+            "kwargs": _stable_serialize(obj.keywords, seen),
+        }
+    elif isinstance(obj, types.MethodType):
+        return {
+            "callable": _stable_serialize(obj.__func__, seen),
+            "self": _stable_serialize(obj.__self__, seen),
+        }
+    elif isinstance(obj, Iterable):
+        return [_stable_serialize(v, seen) for v in obj]
+    elif isinstance(obj, types.FunctionType):
+        name = "{}.{}".format(obj.__module__, obj.__qualname__)
+        if id(obj) in seen:
+            # Recursive function that refers to itself in its closure
+            return name
+        seen = seen | {id(obj)}
+        h = hashlib.blake2b(digest_size=16)
+        _hash_code(obj.__code__, h)
+        closure = []
+        for cell in obj.__closure__ or ():
+            try:
+                closure.append(_stable_serialize(cell.cell_contents, seen))
+            except ValueError:
+                # Empty cell
+                closure.append(None)
+        return {
+            "callable": name,
+            "code": h.hexdigest(),
+            "defaults": _stable_serialize(obj.__defaults__ or (), seen),
+            "kwdefaults": _stable_serialize(obj.__kwdefaults__ or {}, seen),
+            "closure": closure,
+        }
+    elif isinstance(obj, type) or (
+        callable(obj) and hasattr(obj, "__qualname__")
+    ):
+        # Classes and builtin functions
+        return "{}.{}".format(
+            getattr(obj, "__module__", None), obj.__qualname__
+        )
+    elif callable(obj) and hasattr(obj, "__dict__"):
+        # Instance of a class that implements __call__
+        return {
+            "callable": _stable_serialize(type(obj), seen),
+            "attributes": _stable_serialize(vars(obj), seen),
+        }
+    else:
+        return str(obj)
+
+
+def stable_serialize(obj):
+    """ Like :func:`failsafe_serialize`, but functions are described by their
+    qualified name, a hash of their bytecode, their default arguments and the
+    contents of their closure (and :func:`functools.partial` objects and
+    instances of classes that implement ``__call__`` by their arguments or
+    attributes) rather than by their string representation, which contains
+    memory addresses. Different lambdas or closures (e.g. the metrics
+    returned by :func:`clusterking.maths.metric_utils.metric_selection`)
+    therefore get different descriptions, while the description of the same
+    function is the same across sessions (for the same python version). It
+    can therefore be used in hashes (e.g. of
+    :meth:`clusterking.cluster.HierarchyCluster.fingerprint`). Numpy arrays
+    are described by a hash of their content.
+
+    Other objects are described by their string representation, so objects
+    whose string representation contains a memory address (e.g. in the
+    closure of a function) still give descriptions that change between
+    sessions.
+
+    Args:
+        obj: Object to serialize
+
+    Returns:
+        Serialized object
+    """
+    return _stable_serialize(obj, frozenset())
+
+
+def hash_metadata(obj, hasher) -> None:
+    """ Update a hash object (from :mod:`hashlib`) with (nested) metadata.
+    Numpy arrays are hashed by their binary content, everything else by its
+    JSON representation (see :func:`failsafe_serialize`).
+
+    Args:
+        obj: Metadata
+        hasher: Hash object, e.g. ``hashlib.blake2b()``
+
+    Returns:
+        None
+    """
+    if isinstance(obj, dict):
+        hasher.update(b"{")
+        for key in sorted(obj, key=str):
+            hasher.update(json.dumps(str(key)).encode())
+            hash_metadata(obj[key], hasher)
+        hasher.update(b"}")
+    elif isinstance(obj, np.ndarray):
+        hasher.update("{}{}".format(obj.dtype.str, obj.shape).encode())
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(b"[")
+        for item in obj:
+            hash_metadata(item, hasher)
+        hasher.update(b"]")
+    else:
+        hasher.update(
+            json.dumps(failsafe_serialize(obj), sort_keys=True).encode()
+        )
+
+
 def get_version():
     """ Return ClusterKinG version. """
     version_path = pathlib.Path(__file__).parent.parent / "version.txt"
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
 # std
+import functools
+import json
 import unittest
 
+# 3rd
+import numpy as np
+
 # ours
 import clusterking.util.metadata as metadata
 
@@ -41,6 +46,56 @@ class TestMetaData(unittest.TestCase):
         for case in cases:
             self.assertEqual(metadata.failsafe_serialize(case), case)
         self.assertEqual(metadata.failsafe_serialize(cases), cases)
+        for case in cases:
+            self.assertEqual(metadata.stable_serialize(case), case)
+
+    def test_stable_serialize_callables(self):
+        def fct(x, y=1):
+            return x + y
+
+        def make_metric(name):
+            def metric(data):
+                return name
+
+            return metric
+
+        name = "{}.{}".format(__name__, fct.__qualname__)
+        description = metadata.stable_serialize(fct)
+        self.assertEqual(description["callable"], name)
+        self.assertEqual(description["defaults"], [1])
+        self.assertEqual(metadata.stable_serialize(fct), description)
+        self.assertEqual(
+            metadata.stable_serialize({"f": [functools.partial(fct, y=2)]}),
+            {"f": [{"callable": description, "args": [], "kwargs": {"y": 2}}]},
+        )
+        # Different lambdas and closures of the same function are different
+        self.assertNotEqual(
+            metadata.stable_serialize(lambda d: "cityblock"),
+            metadata.stable_serialize(lambda d: "euclidean"),
+        )
+        self.assertNotEqual(
+            metadata.stable_serialize(make_metric("cityblock")),
+            metadata.stable_serialize(make_metric("euclidean")),
+        )
+        self.assertEqual(
+            metadata.stable_serialize(make_metric("cityblock")),
+            metadata.stable_serialize(make_metric("cityblock")),
+        )
+        self.assertEqual(metadata.stable_serialize(len), "builtins.len")
+        self.assertEqual(metadata.stable_serialize(np.float64), "numpy.float64")
+        self.assertNotIn(
+            " at 0x", json.dumps(metadata.stable_serialize([fct, len]))
+        )
+
+    def test_stable_serialize_recursive(self):
+        def outer():
+            def recursive(n):
+                return 0 if n == 0 else recursive(n - 1)
+
+            return recursive
+
+        description = metadata.stable_serialize(outer())
+        self.assertEqual(description["closure"], [description["callable"]])
 
 
 class TestGetVersion(unittest.TestCase):